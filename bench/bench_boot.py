@@ -0,0 +1,162 @@
+# ======================================================================================================================
+# MESURE DU DÉMARRAGE À FROID (IMPORT DU MODULE ET PREMIER /voice SERVI PAR GUNICORN)
+# ======================================================================================================================
+# Pour chaque variante, mesure dans des processus neufs : le temps d'import de main.py (médiane sur --imports
+# exécutions), puis le délai entre le lancement de gunicorn et la première réponse 200 de POST /voice/<id> (accueil
+# d'un nouvel appel), et la durée du premier tour parlé qui sollicite le LLM (serveur LLM local à latence fixe), envoyé
+# --speech-ms après l'accueil comme le ferait un appelant.
+# Variantes : « main:create_app() » (chaque worker se préchauffe en arrière-plan) et « --preload main:create_app() »
+# (préchauffage dans le maître, workers forkés) ; « main:app » pour une révision sans fabrique. --baseline <ref git>
+# mesure aussi le main.py de cette révision.
+# Le schéma est migré avant chaque mesure (étape de déploiement, hors démarrage).
+# Usage : python bench/bench_boot.py [--workers 2] [--imports 5] [--latency-ms 200] [--speech-ms 2500]
+#             [--baseline <ref>] [--json r.json]
+# ======================================================================================================================
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import stub_openai  # noqa: E402
+
+IMPORT_PROBE = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+# Migration (si la révision la sépare de l'import) puis création d'un tenant de test
+SEED = (
+    "import main\n"
+    "with main.app.app_context():\n"
+    "    getattr(main, 'migrate_schema', lambda: None)()\n"
+    "    u = main.User(email='boot@digitagpro.io', password='bench', business_name='Salon Boot')\n"
+    "    main.db.session.add(u); main.db.session.commit(); print(u.id)\n"
+)
+LLM_TURN = "Est-ce que vous faites les colorations sur cheveux longs ?"
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def post_voice(port, user_id, values):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.request('POST', f'/voice/{user_id}', urlencode(values), {'Content-Type': 'application/x-www-form-urlencoded'})
+    resp = conn.getresponse()
+    return resp.status, resp.read()
+
+def prepare(source_dir, workdir, env):
+    """Base neuve migrée et tenant de test pour une variante ; retourne (env, user_id)."""
+    env = dict(env, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'boot.db')}",
+               WRITE_SPOOL_PATH=os.path.join(workdir, 'appointments.spool'))
+    out = subprocess.run([sys.executable, '-c', SEED], cwd=source_dir, env=env, capture_output=True, text=True, check=True)
+    return env, int(out.stdout.strip().splitlines()[-1])
+
+def measure_import(source_dir, env, runs):
+    times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', IMPORT_PROBE], cwd=source_dir, env=env, capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]) * 1000)
+    return statistics.median(times)
+
+def measure_gunicorn(source_dir, env, user_id, target, preload, workers, speech_ms, log_path):
+    """(ms jusqu'au premier /voice servi, ms du premier tour LLM) pour une cible gunicorn donnée."""
+    port = free_port()
+    cmd = [sys.executable, '-m', 'gunicorn', target, '-b', f'127.0.0.1:{port}', '-w', str(workers),
+           '-k', 'gthread', '--threads', '4', '--timeout', '30', '--log-level', 'warning']
+    if preload:
+        cmd.append('--preload')
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=source_dir, env=env, stdout=open(log_path, 'w'), stderr=subprocess.STDOUT)
+    try:
+        first_voice = None
+        while time.perf_counter() - started < 60:
+            try:
+                status, body = post_voice(port, user_id, {'CallSid': f'CA-boot-{port}'})
+                if status == 200 and b'<Gather' in body:
+                    first_voice = (time.perf_counter() - started) * 1000
+                    break
+            except OSError:
+                time.sleep(0.01)
+        if first_voice is None:
+            raise RuntimeError(f"aucun /voice servi en 60 secondes (voir {log_path})")
+        # Message d'accueil prononcé puis première phrase de l'appelant
+        time.sleep(speech_ms / 1000)
+        turn_started = time.perf_counter()
+        status, body = post_voice(port, user_id, {'CallSid': f'CA-boot-{port}', 'SpeechResult': LLM_TURN, 't': 1})
+        if status != 200:
+            raise RuntimeError(f"premier tour en erreur HTTP {status} (voir {log_path})")
+        return first_voice, (time.perf_counter() - turn_started) * 1000
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--imports', type=int, default=5, help="Imports mesurés par variante (médiane)")
+    parser.add_argument('--latency-ms', type=float, default=200, help="Latence du LLM de substitution")
+    parser.add_argument('--speech-ms', type=float, default=2500, help="Délai entre l'accueil et le premier tour parlé")
+    parser.add_argument('--baseline', help="Révision git dont le main.py sert de référence")
+    parser.add_argument('--json', help="Fichier de sortie des résultats")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="digitagpro_boot_")
+    stub_port = free_port()
+    stub_openai.configure(args.latency_ms)
+    stub = stub_openai.start(stub_port)
+    env = dict(os.environ, OPENAI_API_KEY='bench', OPENAI_BASE_URL=f'http://127.0.0.1:{stub_port}/v1',
+               ANSWER_CACHE_ENABLED='0', VOICE_FILLER_AFTER='0', METRICS_DIR='')
+
+    sources = [("actuel", ROOT)]
+    if args.baseline:
+        baseline_dir = os.path.join(workdir, 'baseline')
+        shutil.copytree(os.path.join(ROOT, 'static'), os.path.join(baseline_dir, 'static'))
+        with open(os.path.join(baseline_dir, 'main.py'), 'wb') as f:
+            f.write(subprocess.run(['git', 'show', f'{args.baseline}:main.py'], cwd=ROOT, capture_output=True, check=True).stdout)
+        sources.insert(0, (args.baseline, baseline_dir))
+
+    results = []
+    try:
+        print(f"{'VARIANTE':<42}{'IMPORT ms':>11}{'1er /voice ms':>15}{'1er tour LLM ms':>17}")
+        for label, source_dir in sources:
+            variant_dir = os.path.join(workdir, f"db-{len(results)}")
+            os.makedirs(variant_dir)
+            variant_env, user_id = prepare(source_dir, variant_dir, env)
+            import_ms = measure_import(source_dir, variant_env, args.imports)
+            with open(os.path.join(source_dir, 'main.py')) as f:
+                has_factory = 'def create_app(' in f.read()
+            targets = [("main:create_app()", False), ("main:create_app()", True)] if has_factory else [("main:app", False)]
+            for target, preload in targets:
+                name = f"{label} {'--preload ' if preload else ''}{target}"
+                first_voice, first_turn = measure_gunicorn(source_dir, variant_env, user_id, target, preload, args.workers,
+                                                           args.speech_ms, os.path.join(workdir, 'gunicorn.log'))
+                results.append({"variant": name, "import_ms": round(import_ms, 1), "first_voice_ms": round(first_voice, 1),
+                                "first_llm_turn_ms": round(first_turn, 1)})
+                print(f"{name:<42}{import_ms:>11.0f}{first_voice:>15.0f}{first_turn:>17.0f}")
+    finally:
+        stub.shutdown()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"workers": args.workers, "llm_latency_ms": args.latency_ms, "results": results}, f, indent=2)
+    if args.baseline:
+        before = results[0]["first_voice_ms"]
+        best = min(r["first_voice_ms"] for r in results[1:])
+        print(f"\npremier /voice : {before:.0f} ms -> {best:.0f} ms")
+        if best >= before:
+            print("ECHEC : le démarrage à froid n'est pas plus rapide que la référence")
+            sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,117 @@
+# ======================================================================================================================
+# VÉRIFICATION DE L'EXPORT CRM EN FLUX (MÉMOIRE CONSTANTE SUR UN MILLION DE RENDEZ-VOUS)
+# ======================================================================================================================
+# Insère des rendez-vous synthétiques par paliers (100 000 puis 1 000 000 par défaut), exporte tout l'agenda du tenant
+# en CSV et en NDJSON gzip via le client de test, et mesure pour chaque export le pic d'allocations Python
+# (tracemalloc) pendant la consommation du flux. Si le pic du plus gros palier dépasse --max-ratio fois celui du plus
+# petit, la mémoire n'est pas constante et le script sort en erreur.
+# Usage : python bench/bench_export.py [--rows 100000,1000000] [--max-ratio 2] [--json resultats.json]
+# ======================================================================================================================
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="digitagpro_bench_")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}"
+os.environ["WRITE_SPOOL_PATH"] = os.path.join(WORKDIR, "appointments.spool")
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+
+INSERT_CHUNK = 20000
+
+def seed(user_id, start, count):
+    """Ajoute count rendez-vous synthétiques (ids start..start+count-1) par INSERT multi-lignes."""
+    table = main.Appointment.__table__
+    base = datetime(2026, 1, 1)
+    for offset in range(0, count, INSERT_CHUNK):
+        rows = []
+        for i in range(start + offset, start + min(offset + INSERT_CHUNK, count)):
+            slot = base + timedelta(minutes=30 * i)
+            rows.append({
+                "user_id": user_id, "client_name": f"Client {i}", "client_phone": "0600000000",
+                "date_str": slot.strftime("%d/%m e  %H:%M"), "details": f"Client {i}, coupe et brushing, rappel la veille",
+                "status": "Confirme par IA", "created_at": slot, "start_at": slot, "end_at": slot + timedelta(minutes=30)
+            })
+        main.db.session.execute(table.insert(), rows)
+        main.db.session.commit()
+
+def measure(client, url, compressed):
+    """Consomme le flux fragment par fragment ; retourne (lignes, octets, secondes, pic tracemalloc en Mo)."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    resp = client.get(url, buffered=False)
+    inflater = zlib.decompressobj(31) if compressed else None
+    size = 0
+    lines = 0
+    for chunk in resp.response:
+        size += len(chunk)
+        lines += (inflater.decompress(chunk) if inflater else chunk).count(b"\n")
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    resp.close()
+    return lines, size, elapsed, peak / 1e6
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', default="100000,1000000", help="Paliers de volume, séparés par des virgules")
+    parser.add_argument('--max-ratio', type=float, default=2.0, help="Rapport de pic mémoire toléré entre paliers")
+    parser.add_argument('--json', help="Fichier de sortie des résultats")
+    args = parser.parse_args()
+    tiers = sorted(int(x) for x in args.rows.split(','))
+
+    with main.app.app_context():
+        main.migrate_schema()
+        u = main.User(email='bench@digitagpro.io', password='bench', business_name='Salon Benchmark')
+        main.db.session.add(u)
+        main.db.session.commit()
+        user_id = u.id
+    client = main.app.test_client()
+    client.post('/login', data={'email': 'bench@digitagpro.io', 'password': 'bench'})
+
+    results = []
+    seeded = 0
+    print(f"{'LIGNES':>10}{'FORMAT':>14}{'OCTETS':>14}{'SECONDES':>10}{'LIGNES/S':>12}{'PIC Mo':>9}")
+    for total in tiers:
+        with main.app.app_context():
+            seed(user_id, seeded, total - seeded)
+        seeded = total
+        for label, url, compressed in [("csv", "/mon-agenda/export.csv", False),
+                                       ("ndjson+gzip", "/mon-agenda/export.ndjson?gzip=1", True)]:
+            lines, size, elapsed, peak = measure(client, url, compressed)
+            # En-tête CSV compris : une ligne de plus que de rendez-vous
+            if lines - (label == "csv") != total:
+                print(f"ECHEC : {lines} lignes exportées pour {total} rendez-vous ({label})")
+                sys.exit(1)
+            results.append({"rows": total, "format": label, "bytes": size, "seconds": round(elapsed, 2),
+                            "rows_per_s": int(total / elapsed), "peak_mb": round(peak, 2)})
+            print(f"{total:>10}{label:>14}{size:>14}{elapsed:>10.2f}{int(total / elapsed):>12}{peak:>9.2f}")
+
+    failed = False
+    for label in ("csv", "ndjson+gzip"):
+        peaks = [r["peak_mb"] for r in results if r["format"] == label]
+        ratio = peaks[-1] / max(peaks[0], 0.01)
+        print(f"\n{label} : pic {peaks[0]:.2f} Mo -> {peaks[-1]:.2f} Mo (x{ratio:.2f}) pour x{tiers[-1] // tiers[0]} lignes")
+        failed = failed or ratio > args.max_ratio
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"results": results, "flat_memory": not failed}, f, indent=2)
+    if failed:
+        print("ECHEC : la mémoire de l'export croît avec le volume")
+        sys.exit(1)
+    print("OK : mémoire constante")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,119 @@
+# ======================================================================================================================
+# MESURE DES RÉPONSES LOCALES (CLASSIFIEUR D'INTENTIONS FACTUELLES SANS LLM)
+# ======================================================================================================================
+# Passe chaque énoncé du corpus étiqueté (bench/intent_corpus.tsv) dans le classifieur et le générateur de réponses
+# de main.py, avec le contexte d'un salon type. Rapporte la précision par intention (une question répondue localement
+# doit l'être avec la bonne intention), la part de questions factuelles traitées sans LLM, la réduction des appels LLM
+# sur l'ensemble du corpus, et la latence p50/p99 de fast_answer(). Sort en erreur si la précision passe sous
+# --min-precision ou si le p99 dépasse --max-p99-us.
+# Usage : python bench/bench_intents.py [--corpus bench/intent_corpus.tsv] [--min-precision 0.98] [--max-p99-us 1000]
+# ======================================================================================================================
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+WORKDIR = tempfile.mkdtemp(prefix="digitagpro_intents_")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'intents.db')}"
+os.environ["WRITE_SPOOL_PATH"] = os.path.join(WORKDIR, "appointments.spool")
+os.environ["INTENT_FAST_PATH"] = "1"
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+
+INTENTS = ('horaires', 'tarifs', 'adresse')
+REPEAT = 200
+
+def load(path):
+    rows = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                label, text = line.rstrip('\n').split('\t', 1)
+                rows.append((label, text))
+    return rows
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', default=os.path.join(BENCH_DIR, 'intent_corpus.tsv'))
+    parser.add_argument('--min-precision', type=float, default=0.98, help="Précision minimale par intention")
+    parser.add_argument('--max-p99-us', type=float, default=1000, help="Latence p99 tolérée de fast_answer()")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Affiche chaque énoncé et sa réponse")
+    parser.add_argument('--json', help="Fichier de sortie des résultats")
+    args = parser.parse_args()
+    corpus = load(args.corpus)
+
+    with main.app.app_context():
+        main.migrate_schema()
+        u = main.User(email='intents@digitagpro.io', password='bench', business_name='Salon Bench',
+                      horaires="Mardi au Vendredi: 9h-12h et 14h-19h, Samedi: 9h-17h, Dimanche et lundi fermé",
+                      tarifs="Coupe homme: 25€\nCoupe femme: 38€\nCoupe enfant: 15€\nBarbe: 12€\nBrushing: 22€\n"
+                             "Coloration: 55€\nMèches: 70€",
+                      adresse="12 rue des Lilas, 69003 Lyon")
+        main.db.session.add(u)
+        main.db.session.commit()
+        c = main.compile_tenant_context(u)
+
+    answered = {intent: 0 for intent in INTENTS}
+    correct = {intent: 0 for intent in INTENTS}
+    errors = []
+    latencies = []
+    for label, text in corpus:
+        answer = main.fast_answer(c, text)
+        started = time.perf_counter()
+        for _ in range(REPEAT):
+            main.fast_answer(c, text)
+        latencies.append((time.perf_counter() - started) / REPEAT * 1e6)
+        intent = main.classify_intent(main.normalize_utterance(text, drop_fillers=False)) if answer else None
+        if args.verbose:
+            print(f"{label:<9}{intent or '-':<9}{text[:50]:<52}{answer or ''}")
+        if intent:
+            answered[intent] += 1
+            correct[intent] += intent == label
+            if intent != label:
+                errors.append((label, intent, text))
+
+    factual = sum(1 for label, _ in corpus if label in INTENTS)
+    total_answered = sum(answered.values())
+    results = {"utterances": len(corpus), "factual": factual, "intents": {}}
+    failed = False
+    print(f"{'INTENTION':<12}{'ÉNONCÉS':>9}{'RÉPONDUS':>10}{'PRÉCISION':>11}{'COUVERTURE':>12}")
+    for intent in INTENTS:
+        expected = sum(1 for label, _ in corpus if label == intent)
+        precision = correct[intent] / answered[intent] if answered[intent] else 1.0
+        coverage = correct[intent] / expected if expected else 0.0
+        failed = failed or precision < args.min_precision
+        results["intents"][intent] = {"utterances": expected, "answered": answered[intent],
+                                      "precision": round(precision, 3), "coverage": round(coverage, 3)}
+        print(f"{intent:<12}{expected:>9}{answered[intent]:>10}{precision:>11.1%}{coverage:>12.1%}")
+    for label, intent, text in errors:
+        print(f"  erreur : « {text} » ({label}) classé {intent}")
+
+    p50, p99 = percentile(latencies, 0.5), percentile(latencies, 0.99)
+    results.update({"answered": total_answered, "llm_call_reduction": round(total_answered / len(corpus), 3),
+                    "factual_coverage": round(sum(correct.values()) / max(1, factual), 3),
+                    "p50_us": round(p50, 1), "p99_us": round(p99, 1)})
+    print(f"\nquestions factuelles répondues localement : {sum(correct.values())}/{factual} "
+          f"({results['factual_coverage']:.1%})")
+    print(f"appels LLM évités sur le corpus : {total_answered}/{len(corpus)} ({results['llm_call_reduction']:.1%})")
+    print(f"latence fast_answer() : p50 {p50:.1f} µs, p99 {p99:.1f} µs")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if failed or p99 > args.max_p99_us:
+        print("ECHEC : précision ou latence hors seuil")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    run()
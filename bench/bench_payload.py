@@ -0,0 +1,76 @@
+# ======================================================================================================================
+# MESURE DU POIDS DES PAGES HTML (FEUILLE DE STYLE EN LIGNE VS ASSET FINGERPRINTÉ)
+# ======================================================================================================================
+# Pour chaque page, compare les octets transférés (brut et gzip) :
+#   - "avant" : la feuille de style propriétaire est réinjectée en <style> dans chaque réponse HTML ;
+#   - "après" : la page référence l'asset fingerprinté, téléchargé une seule fois puis servi depuis le cache navigateur.
+# Usage : python bench/bench_payload.py [--json resultats.json]
+# ======================================================================================================================
+
+import argparse
+import gzip
+import json
+import os
+import re
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="digitagpro_bench_")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}"
+os.environ["WRITE_SPOOL_PATH"] = os.path.join(WORKDIR, "appointments.spool")
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+
+PUBLIC_PAGES = ['/login', '/register']
+PAGES = ['/dashboard', '/profil', '/config-ia', '/mon-agenda', '/master-admin', '/master-clients', '/master-logs']
+
+def sizes(html):
+    raw = html.encode()
+    return len(raw), len(gzip.compress(raw, compresslevel=6))
+
+def inline_stylesheet(html):
+    """Reconstitue la page d'avant : la balise <link> de l'asset est remplacée par la feuille en ligne."""
+    css = main.assets.assets['css/app.css'].body.decode()
+    return re.sub(r'<link rel="stylesheet" href="/assets/css/app\.[0-9a-f]+\.css">', lambda _m: f"<style>\n{css}</style>", html)
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json', help="Fichier de sortie des résultats")
+    args = parser.parse_args()
+    
+    with main.app.app_context():
+        main.migrate_schema()
+        u = main.User(email='bench@digitagpro.io', password='bench', business_name='Salon Benchmark', is_admin=True)
+        main.db.session.add(u)
+        main.db.session.commit()
+    client = main.app.test_client()
+    pages = {path: client.get(path).data.decode() for path in PUBLIC_PAGES}
+    client.post('/login', data={'email': 'bench@digitagpro.io', 'password': 'bench'})
+    pages.update({path: client.get(path).data.decode() for path in PAGES})
+    
+    css = main.assets.assets['css/app.css']
+    results = []
+    print(f"{'PAGE':<18}{'AVANT brut':>12}{'AVANT gzip':>12}{'APRES brut':>12}{'APRES gzip':>12}")
+    for path, html in pages.items():
+        before_raw, before_gz = sizes(inline_stylesheet(html))
+        after_raw, after_gz = sizes(html)
+        results.append({"page": path, "before_bytes": before_raw, "before_gzip": before_gz,
+                        "after_bytes": after_raw, "after_gzip": after_gz})
+        print(f"{path:<18}{before_raw:>12}{before_gz:>12}{after_raw:>12}{after_gz:>12}")
+    print()
+    assets = {}
+    for name in ('css/app.css', 'css/tailwind.css'):
+        a = main.assets.assets[name]
+        assets[name] = {"bytes": len(a.body), "gzip": len(a.gzipped or a.body)}
+        print(f"Asset {name} : {len(a.body)} octets, {len(a.gzipped or a.body)} en gzip (téléchargé une seule fois)")
+    
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"pages": results, "asset_bytes": len(css.body), "asset_gzip": len(css.gzipped or css.body),
+                       "assets": assets}, f, indent=2)
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,74 @@
+# ======================================================================================================================
+# MICRO-BENCHMARK DU RENDU DES PAGES (GABARITS PRÉCOMPILÉS VS RECOMPILATION À CHAQUE REQUÊTE)
+# ======================================================================================================================
+# Mesure le débit (requêtes/seconde) d'un worker unique sur chaque page authentifiée :
+#   - "avant" : le cache Jinja est vidé avant chaque requête, soit le coût de l'ancien render_template_string
+#               qui ré-analysait et recompilait tout le document à chaque appel ;
+#   - "après" : gabarits nommés compilés une fois par worker puis servis depuis le cache.
+# Usage : python bench/bench_templates.py [--requests 300] [--json resultats.json]
+# ======================================================================================================================
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="digitagpro_bench_")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}"
+os.environ["WRITE_SPOOL_PATH"] = os.path.join(WORKDIR, "appointments.spool")
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+
+PAGES = ['/dashboard', '/profil', '/config-ia', '/mon-agenda', '/master-admin', '/master-clients']
+
+def seed():
+    with main.app.app_context():
+        main.migrate_schema()
+        u = main.User(email='bench@digitagpro.io', password='bench', business_name='Salon Benchmark', is_admin=True)
+        main.db.session.add(u)
+        main.db.session.commit()
+        main.db.session.add_all([
+            main.Appointment(date_str="01/01 e  10:00", details=f"Client {i}, mardi 14h", user_id=u.id) for i in range(50)
+        ])
+        main.db.session.commit()
+
+def measure(client, path, n, cold):
+    started = time.perf_counter()
+    for _ in range(n):
+        if cold:
+            main.app.jinja_env.cache.clear()
+        resp = client.get(path)
+        assert resp.status_code == 200, (path, resp.status_code)
+    return n / (time.perf_counter() - started)
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--json', help="Fichier de sortie des résultats")
+    args = parser.parse_args()
+    
+    seed()
+    client = main.app.test_client()
+    client.post('/login', data={'email': 'bench@digitagpro.io', 'password': 'bench'})
+    
+    results = []
+    print(f"{'PAGE':<18}{'AVANT (req/s)':>16}{'APRES (req/s)':>16}{'GAIN':>8}")
+    for path in PAGES:
+        measure(client, path, 10, cold=False)
+        before = measure(client, path, args.requests, cold=True)
+        after = measure(client, path, args.requests, cold=False)
+        results.append({"page": path, "before_rps": round(before, 1), "after_rps": round(after, 1),
+                        "speedup": round(after / before, 2)})
+        print(f"{path:<18}{before:>16.1f}{after:>16.1f}{after / before:>7.2f}x")
+    
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main_bench()
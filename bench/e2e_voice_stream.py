@@ -0,0 +1,148 @@
+# ======================================================================================================================
+# ESSAI DE BOUT EN BOUT DU MODE VOCAL STREAMING (CONVERSATIONRELAY SIMULÉ + LLM DE SUBSTITUTION EN FLUX SSE)
+# ======================================================================================================================
+# Sert l'application sur un port local et s'y connecte comme le ferait Twilio ConversationRelay (message 'setup', puis
+# un message 'prompt' par tour, réponses 'text' token par token jusqu'à last=true). Le LLM est le serveur de
+# substitution en mode flux (stream=true, SSE). Scénarios joués sur une même session WebSocket :
+# - question ordinaire : plusieurs fragments avant le dernier, texte complet identique à la réponse du modèle ;
+# - réservation : la balise CONFIRMATION n'est jamais prononcée et le rendez-vous est écrit en base ;
+# - erreur de base pendant la construction du prompt : phrase de repli, le canal reste ouvert ;
+# - fournisseur en erreur : réponse de secours, puis tour suivant servi normalement.
+# Sort en erreur au premier scénario non conforme.
+# Usage : python bench/e2e_voice_stream.py [--latency-ms 100]
+# ======================================================================================================================
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+WORKDIR = tempfile.mkdtemp(prefix="digitagpro_stream_")
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+import stub_openai  # noqa: E402
+
+STUB_PORT = 5198
+APP_PORT = 5199
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{STUB_PORT}/v1"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'stream.db')}"
+os.environ["WRITE_SPOOL_PATH"] = os.path.join(WORKDIR, "appointments.spool")
+os.environ["VOICE_MODE"] = "stream"
+os.environ["ANSWER_CACHE_ENABLED"] = "0"   # Chaque tour doit réellement solliciter le LLM
+os.environ["INTENT_FAST_PATH"] = "0"
+os.environ["LLM_HEDGE_ENABLED"] = "0"
+os.environ["ADMISSION_CONTROL"] = "0"
+os.environ.setdefault("LOG_TRANSCRIPT_SAMPLE", "0")
+
+import simple_websocket  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+import main  # noqa: E402
+
+class RelayClient:
+    """Côté Twilio ConversationRelay : envoie les tours, recueille les fragments 'text' jusqu'à last=true."""
+
+    def __init__(self, url, call_sid):
+        self.ws = simple_websocket.Client.connect(url)
+        self.ws.send(json.dumps({"type": "setup", "callSid": call_sid}))
+
+    def turn(self, prompt, timeout=10):
+        """Retourne (fragments reçus, secondes jusqu'au premier fragment)."""
+        started = time.perf_counter()
+        self.ws.send(json.dumps({"type": "prompt", "voicePrompt": prompt, "lang": "fr-FR", "last": True}))
+        tokens, first = [], None
+        while True:
+            raw = self.ws.receive(timeout)
+            if raw is None:
+                raise RuntimeError(f"canal fermé ou muet pendant le tour « {prompt} »")
+            msg = json.loads(raw)
+            if msg.get("type") != "text":
+                continue
+            if first is None:
+                first = time.perf_counter() - started
+            tokens.append(msg["token"])
+            if msg["last"]:
+                return tokens, first
+
+    def close(self):
+        self.ws.close()
+
+def spoken(tokens):
+    return " ".join(t.strip() for t in tokens if t.strip())
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency-ms', type=float, default=100, help="Latence du LLM de substitution")
+    args = parser.parse_args()
+
+    stub_openai.start(STUB_PORT, background=True)
+    stub_openai.configure(latency_ms=args.latency_ms)
+    with main.app.app_context():
+        main.migrate_schema()
+        u = main.User(email='stream@digitagpro.io', password='stream', business_name='Salon Flux',
+                      horaires='Mardi-Samedi 9h-19h')
+        main.db.session.add(u)
+        main.db.session.commit()
+        user_id = u.id
+    server = make_server('127.0.0.1', APP_PORT, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    failures = []
+
+    def check(name, ok, detail):
+        print(f"{name:<34}{'OK' if ok else 'ECHEC'}  {detail}")
+        if not ok:
+            failures.append(name)
+
+    relay = RelayClient(f"ws://127.0.0.1:{APP_PORT}/voice-stream/{user_id}", "CA-stream-e2e")
+    try:
+        tokens, first = relay.turn("Est-ce que vous faites les colorations ?")
+        check("question ordinaire", len(tokens) > 1 and spoken(tokens) == stub_openai.DEFAULT_REPLY,
+              f"{len(tokens)} fragments, premier après {first * 1000:.0f} ms")
+
+        tokens, _ = relay.turn("Je voudrais un rendez-vous mardi a 14h")
+        with main.app.app_context():
+            booked = main.db.session.query(main.Appointment).filter_by(user_id=user_id).count()
+        check("réservation", main.CONFIRMATION_TAG not in spoken(tokens) and booked == 1,
+              f"« {spoken(tokens)[:60]} », {booked} rendez-vous en base")
+
+        # Base indisponible au moment de construire le prompt (lecture des disponibilités)
+        build_messages = main.build_messages
+        def failing_build(*a, **kw):
+            raise OperationalError("SELECT appointment", {}, Exception("database is locked"))
+        main.build_messages = failing_build
+        try:
+            tokens, _ = relay.turn("Vous avez de la place jeudi ?")
+        finally:
+            main.build_messages = build_messages
+        check("erreur de base (prompt)", spoken(tokens) == main.FALLBACK_REPLY, f"« {spoken(tokens)[:60]} »")
+
+        stub_openai.configure(latency_ms=args.latency_ms, error_rate=1.0)
+        tokens, _ = relay.turn("Et le samedi ?")
+        stub_openai.configure(latency_ms=args.latency_ms)
+        check("fournisseur en erreur", spoken(tokens) in (main.CANNED_REPLY, main.FALLBACK_REPLY),
+              f"« {spoken(tokens)[:60]} »")
+
+        tokens, _ = relay.turn("Merci, et vos horaires ?")
+        check("tour suivant sur le même canal", spoken(tokens) == stub_openai.DEFAULT_REPLY, f"{len(tokens)} fragments")
+    except Exception as e:
+        check("session", False, str(e))
+    finally:
+        relay.close()
+        server.shutdown()
+
+    if failures:
+        print(f"ECHEC : {', '.join(failures)}")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    run()
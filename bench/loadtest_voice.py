@@ -0,0 +1,217 @@
+# ======================================================================================================================
+# BANC DE CHARGE DU WEBHOOK VOCAL (GUNICORN + LLM DE SUBSTITUTION + CONVERSATIONS TWILIO SIMULÉES)
+# ======================================================================================================================
+# Démarre l'application sous gunicorn (nombre de workers et classe de worker configurables), branchée sur un serveur
+# LLM local à latence contrôlée, puis simule des appels Twilio multi-tours (POST /voice/<user_id> avec CallSid et
+# SpeechResult) à concurrence croissante ; les phrases d'attente des tours différés sont suivies jusqu'à la réponse
+# effective. Pour chaque palier : débit, latences p50/p95/p99 par tour, taux d'erreurs et saturation des workers
+# (loi de Little : débit x latence moyenne / capacité), écrits en JSON.
+# Usage : python bench/loadtest_voice.py --workers 4 --worker-class gthread --threads 8 \
+#             --concurrency 5,10,25,50 --stage-seconds 20 --latency-ms 800 --json resultats.json
+# ======================================================================================================================
+
+import argparse
+import html
+import http.client
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import stub_openai  # noqa: E402
+
+SCRIPT = [
+    None,  # Décroché : message d'accueil sans SpeechResult
+    "Bonjour, vous etes ouverts le samedi ?",
+    "C'est combien une coupe homme ?",
+    "Je voudrais un rendez-vous mardi a 14h",
+    "Jean Dupont, merci beaucoup",
+]
+
+# Phrase d'attente (tour différé) : pas de <Gather>, seulement une redirection vers le relevé de la réponse
+REDIRECT = re.compile(rb'<Redirect[^>]*>([^<]+)</Redirect>')
+MAX_POLLS = 20
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+def seed_tenant(env):
+    """Migre la base et crée un tenant de test via l'application elle-même (schéma identique à la production)."""
+    code = (
+        "import main\n"
+        "with main.app.app_context():\n"
+        "    main.migrate_schema()\n"
+        "    u = main.User(email='bench@digitagpro.io', password='bench', business_name='Salon Benchmark', sector='Coiffeur')\n"
+        "    main.db.session.add(u); main.db.session.commit(); print(u.id)\n"
+    )
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return int(out.stdout.strip().splitlines()[-1])
+
+def start_gunicorn(args, port, env, log_path):
+    cmd = [sys.executable, '-m', 'gunicorn', 'main:app', '-b', f'127.0.0.1:{port}',
+           '-w', str(args.workers), '-k', args.worker_class, '--timeout', '30', '--log-level', 'warning']
+    if args.worker_class == 'gthread':
+        cmd += ['--threads', str(args.threads)]
+    # Les journaux de l'application sont redirigés pour ne pas noyer le tableau de résultats
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=open(log_path, 'w'), stderr=subprocess.STDOUT)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/healthz')
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"gunicorn n'a pas démarré dans les 30 secondes (voir {log_path})")
+
+class Caller(threading.Thread):
+    """Appelant virtuel : enchaîne des appels complets jusqu'à la fin du palier."""
+
+    def __init__(self, port, user_id, stop_at, results):
+        super().__init__(daemon=True)
+        self.port = port
+        self.user_id = user_id
+        self.stop_at = stop_at
+        self.results = results
+
+    def run(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        while time.time() < self.stop_at:
+            call_sid = f"CA{uuid.uuid4().hex}"
+            for speech in SCRIPT:
+                if time.time() >= self.stop_at:
+                    break
+                params = {'CallSid': call_sid, 'From': '+33600000000'}
+                if speech:
+                    params['SpeechResult'] = speech
+                started = time.perf_counter()
+                try:
+                    status, body = self.post(conn, f'/voice/{self.user_id}', params)
+                    # Un tour n'est terminé qu'à la réponse effective : les redirections d'attente sont suivies
+                    for _ in range(MAX_POLLS):
+                        redirect = REDIRECT.search(body)
+                        if status != 200 or b'<Gather' in body or redirect is None:
+                            break
+                        status, body = self.post(conn, html.unescape(redirect.group(1).decode()), {'CallSid': call_sid})
+                    ok = status == 200 and b'<Gather' in body
+                except (OSError, http.client.HTTPException):
+                    ok = False
+                    conn.close()
+                    conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+                self.results.append(((time.perf_counter() - started) * 1000, ok))
+
+    @staticmethod
+    def post(conn, path, params):
+        conn.request('POST', path, body=urlencode(params), headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+
+def run_stage(port, user_id, concurrency, seconds, capacity):
+    results = []
+    stop_at = time.time() + seconds
+    callers = [Caller(port, user_id, stop_at, results) for _ in range(concurrency)]
+    started = time.time()
+    for c in callers:
+        c.start()
+    for c in callers:
+        c.join()
+    elapsed = time.time() - started
+    latencies = [ms for ms, ok in results if ok]
+    turns = len(results)
+    throughput = len(latencies) / elapsed if elapsed else 0
+    mean_s = (sum(latencies) / len(latencies) / 1000) if latencies else 0
+    return {
+        "concurrency": concurrency,
+        "turns": turns,
+        "throughput_rps": round(throughput, 2),
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "error_rate": round((turns - len(latencies)) / turns, 4) if turns else 0,
+        "worker_saturation": round(min(1.0, throughput * mean_s / capacity), 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--worker-class', default='gthread', help="sync, gthread, gevent, eventlet...")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', default='5,10,25,50', help="Paliers de concurrence séparés par des virgules")
+    parser.add_argument('--stage-seconds', type=float, default=15)
+    parser.add_argument('--latency-ms', type=float, default=800)
+    parser.add_argument('--jitter-ms', type=float, default=200)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--database-url', help="Base à utiliser (SQLite temporaire par défaut)")
+    parser.add_argument('--env', action='append', default=[], help="Variable supplémentaire KEY=VALUE pour l'application")
+    parser.add_argument('--json', help="Fichier de sortie des résultats")
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix="digitagpro_load_")
+    stub_port, app_port = free_port(), free_port()
+    stub_openai.configure(args.latency_ms, args.jitter_ms, error_rate=args.error_rate)
+    stub = stub_openai.start(stub_port)
+    
+    env = dict(os.environ)
+    env.update({
+        'OPENAI_API_KEY': 'bench',
+        'OPENAI_BASE_URL': f'http://127.0.0.1:{stub_port}/v1',
+        'DATABASE_URL': args.database_url or f"sqlite:///{os.path.join(workdir, 'load.db')}",
+        'WRITE_SPOOL_PATH': os.path.join(workdir, 'appointments.spool'),
+        'ANSWER_CACHE_ENABLED': '0',
+        # Un seul tenant simulé : sans cela, le contrôle d'admission délesterait l'essentiel de la charge
+        'ADMISSION_CONTROL': '0',
+    })
+    for pair in args.env:
+        key, _, value = pair.partition('=')
+        env[key] = value
+    
+    user_id = seed_tenant(env)
+    proc = start_gunicorn(args, app_port, env, os.path.join(workdir, 'gunicorn.log'))
+    capacity = args.workers * (args.threads if args.worker_class == 'gthread' else 1)
+    stages = []
+    try:
+        print(f"{'CONC.':>6}{'TOURS':>8}{'REQ/S':>9}{'P50':>9}{'P95':>9}{'P99':>9}{'ERREURS':>9}{'SATUR.':>8}")
+        for level in [int(x) for x in args.concurrency.split(',') if x.strip()]:
+            stage = run_stage(app_port, user_id, level, args.stage_seconds, capacity)
+            stages.append(stage)
+            print(f"{stage['concurrency']:>6}{stage['turns']:>8}{stage['throughput_rps']:>9}{stage['p50_ms']!s:>9}"
+                  f"{stage['p95_ms']!s:>9}{stage['p99_ms']!s:>9}{stage['error_rate']:>9}{stage['worker_saturation']:>8}")
+    finally:
+        proc.terminate()
+        proc.wait(10)
+        stub.shutdown()
+    
+    report = {
+        "config": {"workers": args.workers, "worker_class": args.worker_class, "threads": args.threads,
+                   "capacity": capacity, "llm_latency_ms": args.latency_ms, "llm_jitter_ms": args.jitter_ms,
+                   "llm_error_rate": args.error_rate, "stage_seconds": args.stage_seconds, "llm_requests": stub_openai.StubConfig.requests},
+        "stages": stages,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# ======================================================================================================================
+# REJEU DE L'EXÉCUTION SPÉCULATIVE (RÉSULTATS PARTIELS TWILIO + LLM DE SUBSTITUTION)
+# ======================================================================================================================
+# Rejoue des tours vocaux enregistrés sous forme de chronologies : résultats partiels stabilisés (StableSpeechResult)
+# postés sur /voice/<id>/partial aux instants prévus, puis SpeechResult final sur /voice/<id>. Chaque tour est joué
+# deux fois, spéculation désactivée puis activée, contre un LLM local à latence fixe. Vérifie que la réponse prononcée
+# est identique dans les deux modes, que chaque tour produit le hit ou le miss attendu, et mesure la latence du webhook
+# final. Sort en erreur si un tour diverge ou si aucune latence n'est gagnée.
+# Usage : python bench/replay_speculation.py [--latency-ms 800] [--endpointing-ms 600] [--json resultats.json]
+# ======================================================================================================================
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+import uuid
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+WORKDIR = tempfile.mkdtemp(prefix="digitagpro_spec_")
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+import stub_openai  # noqa: E402
+
+STUB_PORT = 5197
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{STUB_PORT}/v1"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'replay.db')}"
+os.environ["WRITE_SPOOL_PATH"] = os.path.join(WORKDIR, "appointments.spool")
+os.environ["ANSWER_CACHE_ENABLED"] = "0"   # Chaque tour doit réellement solliciter le LLM
+os.environ["VOICE_FILLER_AFTER"] = "0"     # Latence mesurée sans phrase d'attente
+os.environ["LLM_HEDGE_ENABLED"] = "0"
+os.environ["INTENT_FAST_PATH"] = "0"      # Horaires et tarifs doivent passer par le LLM pour être spéculés
+os.environ.setdefault("LOG_TRANSCRIPT_SAMPLE", "0")
+
+import main  # noqa: E402
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("httpx2").setLevel(logging.WARNING)
+
+# (résultats partiels stabilisés successifs, espacement en ms, SpeechResult final, hit attendu)
+TURNS = [
+    (["Bonjour quels sont", "Bonjour quels sont vos horaires", "Bonjour quels sont vos horaires d'ouverture"],
+     250, "Bonjour, quels sont vos horaires d'ouverture ?", True),
+    (["Je voudrais prendre", "Je voudrais prendre un rendez-vous", "Je voudrais prendre un rendez-vous mardi"],
+     300, "Je voudrais prendre un rendez-vous mardi", True),
+    (["C'est combien une", "C'est combien une coupe homme"],
+     300, "C'est combien, une coupe homme ?", True),
+    (["Est-ce que vous faites"],
+     300, "Est-ce que vous faites les colorations et les meches sur cheveux longs le samedi", False),
+    (["Vous etes ouverts"],
+     250, "Vous etes ouverts dimanche ?", False),
+]
+
+def spoken(twiml):
+    m = re.search(rb'<Say[^>]*>(.*?)</Say>', twiml, re.S)
+    return m.group(1).decode() if m else None
+
+def play(client, user_id, partials, spacing_ms, final, endpointing_ms):
+    """Joue un tour ; retourne (texte prononcé, latence du webhook final en ms)."""
+    call_sid = "CA" + uuid.uuid4().hex
+    for partial in partials:
+        client.post(f'/voice/{user_id}/partial', data={'CallSid': call_sid, 'StableSpeechResult': partial})
+        time.sleep(spacing_ms / 1000)
+    # Détection de fin de parole côté Twilio avant l'envoi du résultat final
+    time.sleep(max(0, endpointing_ms - spacing_ms) / 1000)
+    started = time.perf_counter()
+    resp = client.post(f'/voice/{user_id}', data={'CallSid': call_sid, 'SpeechResult': final})
+    return spoken(resp.data), (time.perf_counter() - started) * 1000
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency-ms', type=float, default=800, help="Latence du LLM de substitution")
+    parser.add_argument('--endpointing-ms', type=float, default=600, help="Délai entre le dernier partiel et le final")
+    parser.add_argument('--json', help="Fichier de sortie des résultats")
+    args = parser.parse_args()
+
+    stub_openai.start(STUB_PORT, background=True)
+    stub_openai.configure(latency_ms=args.latency_ms)
+    # Un salon par mode : une réservation faite sans spéculation ne doit pas occuper le créneau du second passage
+    tenants = {}
+    with main.app.app_context():
+        main.migrate_schema()
+        for mode in (False, True):
+            u = main.User(email=f'replay-{mode}@digitagpro.io', password='replay', business_name='Salon Rejeu',
+                          horaires='Mardi-Samedi 9h-19h')
+            main.db.session.add(u)
+            main.db.session.commit()
+            tenants[mode] = u.id
+    client = main.app.test_client()
+
+    results = []
+    failed = False
+    print(f"{'TOUR':<60}{'SANS (ms)':>11}{'AVEC (ms)':>11}{'ATTENDU':>9}{'OBTENU':>8}")
+    for partials, spacing, final, expect_hit in TURNS:
+        main.app.config['VOICE_SPECULATION'] = False
+        text_off, ms_off = play(client, tenants[False], partials, spacing, final, args.endpointing_ms)
+        main.app.config['VOICE_SPECULATION'] = True
+        hits_before = main.speculator.stats()['hits']
+        text_on, ms_on = play(client, tenants[True], partials, spacing, final, args.endpointing_ms)
+        hit = main.speculator.stats()['hits'] > hits_before
+        ok = hit == expect_hit and text_on == text_off
+        failed = failed or not ok
+        results.append({"final": final, "ms_without": round(ms_off, 1), "ms_with": round(ms_on, 1),
+                        "expected_hit": expect_hit, "hit": hit, "same_reply": text_on == text_off})
+        print(f"{final[:58]:<60}{ms_off:>11.0f}{ms_on:>11.0f}{'hit' if expect_hit else 'miss':>9}"
+              f"{'hit' if hit else 'miss':>8}{'' if ok else '  <- ECHEC'}")
+
+    stats = main.speculator.stats()
+    saved = sum(r["ms_without"] - r["ms_with"] for r in results if r["hit"])
+    print(f"\nspéculations lancées {stats['started']}, hit rate {stats['hit_rate']}, "
+          f"latence gagnée moyenne {stats['saved_ms_avg']} ms (mesurée côté webhook : {saved / max(1, stats['hits']):.0f} ms)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"turns": results, "speculation": stats}, f, indent=2, ensure_ascii=False)
+    if failed or not stats['hits'] or saved <= 0:
+        print("ECHEC : résultat de spéculation inattendu")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,109 @@
+# ======================================================================================================================
+# SERVEUR LLM DE SUBSTITUTION (API CHAT COMPLETIONS COMPATIBLE OPENAI)
+# ======================================================================================================================
+# Répond à POST /v1/chat/completions (JSON ou flux SSE) avec une latence, une gigue, une proportion de réponses
+# lentes et un taux d'erreurs configurables. Sert de fournisseur local pour les benchmarks et les essais de la
+# passerelle LLM (OPENAI_BASE_URL=http://127.0.0.1:<port>/v1).
+# Usage : python bench/stub_openai.py --port 8089 --latency-ms 800 --jitter-ms 400 --error-rate 0.01
+# ======================================================================================================================
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_REPLY = "Bien sur, nous sommes ouverts du mardi au samedi de 9h a 19h. Souhaitez-vous prendre rendez-vous ?"
+BOOKING_REPLY = "C'est note, je vous reserve ce creneau. CONFIRMATION: Client, mardi 14h"
+
+class StubConfig:
+    latency_ms = 800.0
+    jitter_ms = 0.0
+    slow_rate = 0.0
+    slow_ms = 0.0
+    error_rate = 0.0
+    requests = 0
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        size = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(size) or b'{}')
+        StubConfig.requests += 1
+        delay = StubConfig.latency_ms + random.uniform(0, StubConfig.jitter_ms)
+        if random.random() < StubConfig.slow_rate:
+            delay += StubConfig.slow_ms
+        time.sleep(delay / 1000)
+        try:
+            if random.random() < StubConfig.error_rate:
+                self._json(500, {"error": {"message": "erreur injectee", "type": "server_error"}})
+            elif body.get('stream'):
+                self._stream(self._reply(body))
+            else:
+                self._json(200, {
+                    "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": body.get('model'),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": self._reply(body)}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                })
+        except (BrokenPipeError, ConnectionResetError):
+            # Le client a abandonné (deadline ou requête de hedging perdante)
+            pass
+
+    def _reply(self, body):
+        last = (body.get('messages') or [{}])[-1].get('content', '')
+        return BOOKING_REPLY if 'rendez-vous' in last.lower() else DEFAULT_REPLY
+
+    def _json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, reply):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i in range(0, len(reply), 4):
+            event = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": "stub",
+                     "choices": [{"index": 0, "delta": {"content": reply[i:i + 4]}, "finish_reason": None}]}
+            self._chunk(b"data: " + json.dumps(event).encode() + b"\n\n")
+        self._chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+def start(port, background=True):
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def configure(latency_ms=800.0, jitter_ms=0.0, slow_rate=0.0, slow_ms=0.0, error_rate=0.0):
+    StubConfig.latency_ms = latency_ms
+    StubConfig.jitter_ms = jitter_ms
+    StubConfig.slow_rate = slow_rate
+    StubConfig.slow_ms = slow_ms
+    StubConfig.error_rate = error_rate
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency-ms', type=float, default=800)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--slow-rate', type=float, default=0)
+    parser.add_argument('--slow-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    args = parser.parse_args()
+    configure(args.latency_ms, args.jitter_ms, args.slow_rate, args.slow_ms, args.error_rate)
+    print(f"Stub OpenAI sur http://127.0.0.1:{args.port}/v1 (latence {args.latency_ms} ms)")
+    start(args.port, background=False).serve_forever()
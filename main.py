@@ -9,7 +9,7 @@
 # 5. Dashboard Analytics et Master Control Center pour l'administration globale du parc client.
 # ----------------------------------------------------------------------------------------------------------------------
 # OPTIMISATION INFRASTRUCTURE :
-# - Déploiement : Optimisé pour Render.com (Gunicorn WSGI)
+# - Déploiement : Optimisé pour Render.com (Gunicorn WSGI, ou Uvicorn ASGI via asgi_app pour le webhook vocal asynchrone)
 # - Cache : Distribution statique via CDN Cloudflare Ready
 # - Sécurité : Protection CSRF, Chiffrement des mots de passe, Isolation des sessions utilisateurs
 # - Performance : Requêtes SQL indexées pour une latence minimale sous charge élevée (1000+ appels simultanés)
@@ -17,19 +17,61 @@
 # VOLUME DE DONNÉES : Calibré pour dépasser le seuil technique de 36,795 caractères.
 # ======================================================================================================================
 
-from flask import Flask, request, render_template_string, redirect, url_for, flash
+from flask import Flask, request, render_template, redirect, url_for, flash, abort, jsonify, Response, g, stream_with_context
+from flask import before_render_template, template_rendered
+import click
+from jinja2 import ChoiceLoader, DictLoader
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from twilio.twiml.voice_response import VoiceResponse, Gather
-from openai import OpenAI
-from datetime import datetime, timedelta
-from sqlalchemy import text
+from flask_sock import Sock
+from twilio.twiml.voice_response import VoiceResponse, Gather, Connect
+try:
+    import httpx2 as httpx  # Transport HTTP des versions récentes du SDK OpenAI
+except ImportError:
+    import httpx
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from functools import wraps
+from contextlib import contextmanager
+from sqlalchemy import text, inspect, func, or_, select, insert, literal
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.exceptions import HTTPException, NotFound
+from collections import OrderedDict, Counter, deque, namedtuple
+from logging.handlers import QueueHandler, QueueListener
 import os
+import asyncio
+import atexit
+import bisect
+import csv
+import gzip
+import hashlib
+import io
 import json
 import logging
+import math
+import mimetypes
+import queue
+import random
+import re
+import socket
+import tempfile
+import threading
+import time
+import unicodedata
+import weakref
+import zlib
+from urllib.parse import urlparse, urlencode, parse_qs
 
 # --- CONFIGURATION DU LOGGING SYSTÈME ---
-# Monitoring en temps réel des flux d'appels et des erreurs d'API OpenAI/Twilio
+# Monitoring en temps réel des flux d'appels et des erreurs d'API OpenAI/Twilio.
+# Le code applicatif ne fait que déposer l'enregistrement dans une file (QueueHandler, sans formatage) ; un thread
+# d'écoute (QueueListener) le formate en JSON, l'écrit sur la sortie d'erreur et le conserve dans un tampon circulaire
+# borné que la page Master Logs parcourt. Les transcriptions (verbeuses) sont échantillonnées par appel.
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("DigitagPro_Elite_System")
 
@@ -38,23 +80,246 @@ app = Flask(__name__)
 # Clé de sécurité à haute entropie pour la protection des sessions cookies
 app.config['SECRET_KEY'] = 'digitagpro_ia_enterprise_ultra_dense_2026_vX_stable_v4_secure_key_998877665544332211_FULL_DENSITY'
 
+app.config['LOG_FORMAT'] = os.environ.get('LOG_FORMAT', 'json')
+app.config['LOG_RING_SIZE'] = int(os.environ.get('LOG_RING_SIZE', 5000))
+# Part des appels dont les transcriptions et réponses IA sont journalisées, et tenants toujours journalisés en entier
+app.config['LOG_TRANSCRIPT_SAMPLE'] = float(os.environ.get('LOG_TRANSCRIPT_SAMPLE', 0.1))
+app.config['LOG_TRANSCRIPT_TENANTS'] = {
+    int(t) for t in os.environ.get('LOG_TRANSCRIPT_TENANTS', '').split(',') if t.strip().isdigit()
+}
+
+_LOG_TAG = re.compile(r'^\s*\[([A-Z_]+)\]\s*')
+
+def log_event_dict(record):
+    """Enregistrement -> événement structuré ; le message n'est formaté qu'ici, dans le thread d'écoute."""
+    msg = record.getMessage()
+    event = getattr(record, 'event', None)
+    if event is None:
+        # Lignes historiques « [TAG] message » : le tag devient le nom de l'événement
+        m = _LOG_TAG.match(msg)
+        event = m.group(1) if m else record.name
+        msg = msg[m.end():] if m else msg.strip()
+    out = {
+        "ts": round(record.created, 3),
+        "level": record.levelname,
+        "event": event,
+        "tenant": getattr(record, 'tenant', None),
+        "msg": msg,
+        "pid": record.process,
+    }
+    out.update(getattr(record, 'fields', None) or {})
+    if record.exc_info:
+        out["exc"] = logging.Formatter().formatException(record.exc_info)
+    return out
+
+class JSONLogFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(log_event_dict(record), ensure_ascii=False, default=str)
+
+class LogRing(logging.Handler):
+    """Tampon circulaire des derniers événements du worker, numérotés pour la pagination par curseur."""
+
+    def __init__(self, capacity):
+        super().__init__()
+        self.events = deque(maxlen=capacity)
+        self.seq = 0
+
+    def emit(self, record):
+        event = log_event_dict(record)
+        with self.lock:
+            self.seq += 1
+            event["seq"] = self.seq
+            self.events.append(event)
+
+    def query(self, tenant=None, min_level=logging.NOTSET, before=None, limit=50):
+        """Événements du plus récent au plus ancien ; retourne (page, curseur de la page suivante ou None)."""
+        with self.lock:
+            snapshot = list(self.events)
+        page = []
+        for event in reversed(snapshot):
+            if before is not None and event["seq"] >= before:
+                continue
+            if tenant is not None and event["tenant"] != tenant:
+                continue
+            if logging.getLevelName(event["level"]) < min_level:
+                continue
+            if len(page) == limit:
+                return page, page[-1]["seq"]
+            page.append(event)
+        return page, None
+
+class _DeferredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Pas de formatage côté appelant : getMessage() sera appelé par le thread d'écoute
+        return record
+
+log_ring = LogRing(app.config['LOG_RING_SIZE'])
+_log_console = logging.StreamHandler()
+if app.config['LOG_FORMAT'] == 'json':
+    _log_console.setFormatter(JSONLogFormatter())
+_log_queue_handler = _DeferredQueueHandler(queue.SimpleQueue())
+logger.addHandler(_log_queue_handler)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+log_listener = None
+
+def start_log_listener():
+    """(Re)démarre le thread d'écoute ; rappelé dans chaque processus enfant après un fork."""
+    global log_listener
+    _log_queue_handler.queue = queue.SimpleQueue()
+    log_listener = QueueListener(_log_queue_handler.queue, _log_console, log_ring)
+    log_listener.start()
+
+start_log_listener()
+os.register_at_fork(after_in_child=start_log_listener)
+atexit.register(lambda: log_listener.stop())
+
+def log_event(level, event, msg, *args, tenant=None, **fields):
+    """Événement structuré à formatage paresseux : msg et args ne sont assemblés que par le thread d'écoute."""
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, *args, extra={"event": event, "tenant": tenant, "fields": fields})
+
+def transcript_sampled(tenant_id, call_sid):
+    """Décision stable pour tout l'appel : soit toutes ses transcriptions sont journalisées, soit aucune."""
+    if tenant_id in app.config['LOG_TRANSCRIPT_TENANTS']:
+        return True
+    rate = app.config['LOG_TRANSCRIPT_SAMPLE']
+    if rate >= 1:
+        return True
+    if not call_sid:
+        return random.random() < rate
+    return zlib.crc32(call_sid.encode()) % 10000 < rate * 10000
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+@app.template_filter('log_time')
+def log_time(ts):
+    return datetime.fromtimestamp(ts).strftime('%d/%m/%Y %H:%M:%S')
+
+def log_transcript(c, call_sid, event, text):
+    if transcript_sampled(c.id, call_sid):
+        log_event(logging.INFO, event, "%s", text, tenant=c.id, call=call_sid)
+
 # --- CONFIGURATION DATABASE HAUTE PERFORMANCE ---
 # Gestion dynamique de l'URL de base de données (PostgreSQL pour la Prod, SQLite pour le Dev)
 # Le système détecte automatiquement l'environnement Render via la variable DATABASE_URL.
-db_url = os.environ.get('DATABASE_URL', 'sqlite:///digitagpro.db')
-if db_url and db_url.startswith("postgres://"): 
-    db_url = db_url.replace("postgres://", "postgresql://", 1)
+# DATABASE_REPLICA_URL (optionnelle) désigne un réplica en lecture : les pages de consultation y lisent, tandis que
+# le webhook vocal et les formulaires écrivent toujours sur le primaire. En local, deux fichiers SQLite suffisent
+# (DATABASE_URL=sqlite:///primary.db DATABASE_REPLICA_URL=sqlite:///replica.db, le second étant une copie du premier).
+def normalize_db_url(url):
+    if url and url.startswith("postgres://"): 
+        url = url.replace("postgres://", "postgresql://", 1)
+    return url
+
+db_url = normalize_db_url(os.environ.get('DATABASE_URL', 'sqlite:///digitagpro.db'))
+db_replica_url = normalize_db_url(os.environ.get('DATABASE_REPLICA_URL', ''))
 app.config['SQLALCHEMY_DATABASE_URI'] = db_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Pool de connexions par processus : pool_size + max_overflow connexions au plus, à multiplier par le nombre de
+# workers pour rester sous la limite du plan Postgres. pre_ping écarte les connexions coupées par le serveur et
+# recycle les renouvelle avant le délai d'inactivité du proxy ; statement_timeout borne toute requête côté serveur.
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))
+
+def engine_options(url):
+    """Options d'engine SQLAlchemy pour une URL : pool dimensionné et timeout de requête (Postgres uniquement)."""
+    opts = {
+        'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+    }
+    if url.startswith('sqlite') and (url in ('sqlite://', 'sqlite:///') or ':memory:' in url):
+        # Base en mémoire : une connexion unique par thread, pas de pool à dimensionner
+        return opts
+    opts.update(
+        pool_size=app.config['DB_POOL_SIZE'],
+        max_overflow=app.config['DB_MAX_OVERFLOW'],
+        pool_timeout=app.config['DB_POOL_TIMEOUT'],
+    )
+    if url.startswith('postgresql') and app.config['DB_STATEMENT_TIMEOUT_MS'] > 0:
+        opts['connect_args'] = {'options': f"-c statement_timeout={app.config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return opts
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(db_url)
+if db_replica_url:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': {'url': db_replica_url, **engine_options(db_replica_url)}}
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """Session qui envoie les lectures des vues marquées @read_replica vers le réplica ; toute écriture reste au primaire."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase) and g.get('db_route') == 'replica':
+            replica = self._db.engines.get('replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def read_replica(view):
+    """Décorateur de vue en lecture seule. À placer sous @login_required : l'utilisateur est chargé depuis le primaire."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_route = 'replica'
+        return view(*args, **kwargs)
+    return wrapper
+
 # Initialisation des extensions
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+# Canal WebSocket pour le mode vocal streaming (Twilio ConversationRelay)
+sock = Sock(app)
+
+# Mode vocal : 'gather' (TwiML classique, un tour = une requete HTTP) ou 'stream' (WebSocket, reponse token par token)
+app.config['VOICE_MODE'] = os.environ.get('VOICE_MODE', 'gather')
+# Exécution du webhook vocal : 'sync' (vue Flask, un worker par appel en cours) ou 'async' (boucle d'événements ASGI,
+# des milliers d'appels en attente du LLM par processus). Le mode 'async' suppose un service via asgi_app (uvicorn).
+app.config['VOICE_EXECUTION'] = os.environ.get('VOICE_EXECUTION', 'sync')
+# Tours différés (mode 'gather' synchrone) : au-delà de VOICE_FILLER_AFTER secondes sans réponse du LLM, le webhook
+# rend une phrase d'attente et une redirection vers /voice/<id>/result/<tour>. Désactivé par défaut (0) ; 1.2 est une
+# valeur raisonnable une fois VOICE_TURN_POOL_SIZE dimensionné pour le trafic.
+app.config['VOICE_FILLER_AFTER'] = float(os.environ.get('VOICE_FILLER_AFTER', 0))
+app.config['VOICE_TURN_POOL_SIZE'] = int(os.environ.get('VOICE_TURN_POOL_SIZE', 32))
+app.config['VOICE_POLL_MAX'] = int(os.environ.get('VOICE_POLL_MAX', 10))
+# Exécution spéculative : le LLM est lancé sur les résultats partiels de la reconnaissance vocale (partialResultCallback)
+app.config['VOICE_SPECULATION'] = os.environ.get('VOICE_SPECULATION', '0') == '1'
+app.config['SPECULATION_MIN_WORDS'] = int(os.environ.get('SPECULATION_MIN_WORDS', 3))
+app.config['SPECULATION_MAX_PER_TURN'] = int(os.environ.get('SPECULATION_MAX_PER_TURN', 4))
+app.config['SPECULATION_MATCH'] = float(os.environ.get('SPECULATION_MATCH', 0.9))
+app.config['SPECULATION_TTL'] = int(os.environ.get('SPECULATION_TTL', 120))
 
 # Initialisation du moteur OpenAI avec GPT-4o-Mini
-# Nécessite la variable d'environnement OPENAI_API_KEY
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Nécessite la variable d'environnement OPENAI_API_KEY (OPENAI_BASE_URL permet de viser un serveur compatible)
+# Pool HTTP keep-alive dimensionné pour le trafic vocal ; les relances sont gérées par la passerelle LLM (hedging).
+# Le SDK (plus de la moitié du temps d'import de ce module) n'est chargé qu'à la construction du premier client.
+app.config['LLM_DEADLINE'] = float(os.environ.get('LLM_DEADLINE', 5.0))
+app.config['LLM_POOL_SIZE'] = int(os.environ.get('LLM_POOL_SIZE', 50))
+llm_http_limits = httpx.Limits(
+    max_connections=app.config['LLM_POOL_SIZE'],
+    max_keepalive_connections=app.config['LLM_POOL_SIZE'],
+    keepalive_expiry=60.0
+)
+llm_http_timeout = httpx.Timeout(app.config['LLM_DEADLINE'], connect=2.0)
+def make_client():
+    """Client OpenAI synchrone du pipeline vocal, construit au premier usage par la passerelle LLM."""
+    from openai import OpenAI
+    return OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        max_retries=0,
+        http_client=httpx.Client(limits=llm_http_limits, timeout=llm_http_timeout)
+    )
+
+def make_async_client():
+    """Client OpenAI asynchrone du mode ASGI : même pool et même deadline, lié à la boucle d'événements qui le crée."""
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        max_retries=0,
+        http_client=httpx.AsyncClient(limits=llm_http_limits, timeout=llm_http_timeout)
+    )
 
 # ----------------------------------------------------------------------------------------------------------------------
 # STRUCTURE DES DONNÉES (SCHÉMA SQL RELATIONNEL)
@@ -89,6 +354,9 @@ class User(UserMixin, db.Model):
     date_creation = db.Column(db.DateTime, default=datetime.utcnow)
     premium_status = db.Column(db.Boolean, default=True)
     
+    # Tampon de version du contexte IA (incrémenté à chaque modification, lu par les caches des workers)
+    context_version = db.Column(db.Integer, default=1, nullable=False)
+    
     # Relation One-to-Many avec les rendez-vous
     appointments = db.relationship('Appointment', backref='owner', lazy=True, cascade="all, delete-orphan")
 
@@ -106,146 +374,198 @@ class Appointment(db.Model):
     status = db.Column(db.String(50), default="Confirme par IA")
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Créneau réservé (UTC), renseigné quand la balise CONFIRMATION contient une date et une heure lisibles
+    start_at = db.Column(db.DateTime(timezone=True))
+    end_at = db.Column(db.DateTime(timezone=True))
+    
+    # Tour d'appel à l'origine du rendez-vous (CallSid + séquence) : un webhook rejoué ne peut pas créer de doublon
+    turn_key = db.Column(db.String(120))
+    
+    # Index composites : agrégats et pagination par curseur restent en O(log n) quel que soit le volume du tenant
+    __table_args__ = (
+        db.Index('ix_appointment_user_created', 'user_id', 'created_at'),
+        db.Index('ix_appointment_user_id_id', 'user_id', 'id'),
+        db.Index('ix_appointment_user_start', 'user_id', 'start_at'),
+        db.Index('ux_appointment_turn_key', 'turn_key', unique=True),
+    )
+
+class KVEntry(db.Model):
+    """
+    Modèle KVEntry : Stockage clé/valeur partagé entre workers (états d'appels, caches éphémères).
+    Chaque entrée expire à expires_at ; les entrées périmées sont purgées au fil de l'eau.
+    """
+    __tablename__ = 'kv_store'
+    key = db.Column(db.String(200), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, index=True)
+
+# --- IDENTITÉ DE SESSION EN CACHE ---
+# Flask-Login recharge l'utilisateur à chaque requête authentifiée. Au lieu de la ligne ORM complète (horaires,
+# tarifs, prompt : des colonnes Text volumineuses), la session porte un Principal réduit, gardé PRINCIPAL_CACHE_TTL
+# secondes par worker. Seules les pages d'édition (profil, config IA) chargent la ligne complète.
+app.config['PRINCIPAL_CACHE_SIZE'] = int(os.environ.get('PRINCIPAL_CACHE_SIZE', 4096))
+app.config['PRINCIPAL_CACHE_TTL'] = float(os.environ.get('PRINCIPAL_CACHE_TTL', 60))
+
+class Principal:
+    """Identité minimale de l'utilisateur connecté, compatible Flask-Login."""
+    __slots__ = ('id', 'email', 'business_name', 'is_admin')
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, email, business_name, is_admin):
+        self.id = id
+        self.email = email
+        self.business_name = business_name
+        self.is_admin = bool(is_admin)
+
+    def get_id(self):
+        return str(self.id)
+
+class PrincipalCache:
+    """Cache LRU à expiration des Principal par id utilisateur (propre à chaque worker)."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (Principal, échéance monotonic)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                return entry[0]
+        
+        row = db.session.query(User.id, User.email, User.business_name, User.is_admin).filter(User.id == user_id).first()
+        if row is None:
+            self.invalidate(user_id)
+            return None
+        principal = Principal(*row)
+        with self._lock:
+            self._entries[user_id] = (principal, now + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return principal
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+principals = PrincipalCache(app.config['PRINCIPAL_CACHE_SIZE'], app.config['PRINCIPAL_CACHE_TTL'])
 
 @login_manager.user_loader
 def load_user(uid):
-    """Chargement de session Flask-Login."""
-    return User.query.get(int(uid))
+    """Chargement de session Flask-Login : Principal en cache, une requête SQL sur 4 colonnes au plus."""
+    return principals.get(int(uid))
+
+# ----------------------------------------------------------------------------------------------------------------------
+# MIGRATION DU SCHÉMA (COMMANDE EXPLICITE, HORS DU DÉMARRAGE DES WORKERS)
+# ----------------------------------------------------------------------------------------------------------------------
+# L'import du module ne touche plus à la base : tables, colonnes et index sont alignés sur les modèles par
+# « flask --app main migrate », lancé une fois par déploiement (commande de pré-déploiement Render, ou à la main) et
+# avant le tout premier démarrage sur une base neuve : create_app() refuse de servir une base sans ses tables.
+# --dry-run affiche les opérations sans les exécuter ; --prune-indexes supprime en plus les index ix_/ux_ présents en
+# base mais retirés des modèles. Le serveur de développement (python main.py) migre avant de démarrer.
+
+# Index gérés par l'application (nommés par SQLAlchemy ou par nos modèles) : les seuls que --prune-indexes supprime
+MANAGED_INDEX_PREFIXES = ('ix_', 'ux_')
+
+def _add_column_ddl(table, col):
+    col_type = col.type.compile(dialect=db.engine.dialect)
+    ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {col_type}'
+    if col.default is not None and col.default.is_scalar:
+        value = col.default.arg
+        if isinstance(value, bool):
+            ddl += " DEFAULT TRUE" if value else " DEFAULT FALSE"
+        elif isinstance(value, (int, float)):
+            ddl += f" DEFAULT {value}"
+        else:
+            ddl += " DEFAULT '" + str(value).replace("'", "''") + "'"
+    return ddl
+
+def _execute_ddl(ddl):
+    with db.engine.begin() as conn:
+        conn.execute(text(ddl))
+
+def schema_plan(prune_indexes=False):
+    """
+    Opérations qui alignent la base sur les modèles : [(description, action)].
+    Tables absentes créées avec leurs index ; colonnes et index manquants ajoutés aux tables existantes
+    (db.create_all ne modifie jamais une table déjà créée).
+    """
+    insp = inspect(db.engine)
+    plan = []
+    for table in db.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            plan.append((f"CREATE TABLE {table.name}", lambda table=table: table.create(bind=db.engine)))
+            continue
+        existing = {col['name'] for col in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name not in existing:
+                ddl = _add_column_ddl(table, col)
+                plan.append((ddl, lambda ddl=ddl: _execute_ddl(ddl)))
+        existing_idx = {idx['name'] for idx in insp.get_indexes(table.name)}
+        declared_idx = {idx.name for idx in table.indexes}
+        for idx in table.indexes:
+            if idx.name not in existing_idx:
+                plan.append((f"CREATE INDEX {idx.name} ON {table.name}", lambda idx=idx: idx.create(bind=db.engine)))
+        if prune_indexes:
+            for name in sorted(existing_idx - declared_idx):
+                if name and name.startswith(MANAGED_INDEX_PREFIXES):
+                    plan.append((f"DROP INDEX {name}", lambda name=name: _execute_ddl(f'DROP INDEX "{name}"')))
+    return plan
+
+def migrate_schema(dry_run=False, prune_indexes=False):
+    """Applique schema_plan() dans l'ordre ; retourne la liste des opérations (exécutées ou non selon dry_run)."""
+    plan = schema_plan(prune_indexes)
+    for description, action in plan:
+        if not dry_run:
+            action()
+        log_event(logging.INFO, "SCHEMA", "%s - %s", 'PLAN' if dry_run else 'UPGRADE', description)
+    return [description for description, _ in plan]
 
-# Création des tables si elles n'existent pas (Synchronisation à chaud)
-with app.app_context():
-    db.create_all()
-    logger.info(">>> SYSTEM: DATABASE SYNCHRONIZATION FINISHED - ALL SYSTEMS GO")
+@app.cli.command('migrate')
+@click.option('--dry-run', is_flag=True, help="Affiche les opérations sans les exécuter.")
+@click.option('--prune-indexes', is_flag=True, help="Supprime les index ix_/ux_ absents des modèles.")
+def migrate_command(dry_run, prune_indexes):
+    """Crée les tables et aligne colonnes et index sur les modèles."""
+    # Chaque opération est journalisée par migrate_schema() ; ici, le bilan
+    done = migrate_schema(dry_run, prune_indexes)
+    if not done:
+        click.echo("Schéma déjà à jour")
+    else:
+        click.echo(f"{len(done)} opération(s) {'à appliquer' if dry_run else 'appliquée(s)'}")
 
 # ----------------------------------------------------------------------------------------------------------------------
 # FRAMEWORK DE DESIGN PROPRIÉTAIRE (UI/UX ENGINE)
 # ----------------------------------------------------------------------------------------------------------------------
 
-STYLE = """
-<script src="https://cdn.tailwindcss.com"></script>
+# Balises d'en-tête communes. La feuille de style propriétaire (static/css/app.css) et les utilitaires Tailwind
+# précompilés (static/css/tailwind.css, générée depuis assets/tailwind.css) sont des fichiers statiques fingerprintés,
+# mis en cache immuable par le navigateur : aucun compilateur CSS ne tourne plus dans la page. Tailwind est chargée
+# après app.css, comme l'était la feuille injectée par l'ancien CDN, pour que les utilitaires gardent la priorité.
+HEAD_TAGS = """
+<link rel="preconnect" href="https://fonts.googleapis.com">
+<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
+<link rel="stylesheet" href="https://fonts.googleapis.com/css2?family=Plus+Jakarta+Sans:wght@300;400;500;600;700;800&display=swap">
 <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Plus+Jakarta+Sans:wght@300;400;500;600;700;800&display=swap');
-    :root { 
-        --primary: #6366f1; 
-        --bg: #0f172a; 
-        --card: #ffffff; 
-        --sidebar-w: 320px;
-        --accent: #4f46e5;
-    }
-    body { 
-        font-family: 'Plus Jakarta Sans', sans-serif; 
-        background: #f8fafc; 
-        color: #1e293b; 
-        margin: 0; 
-        letter-spacing: -0.01em;
-    }
-    .sidebar { 
-        background: var(--bg); 
-        color: white; 
-        width: var(--sidebar-w); 
-        position: fixed; 
-        height: 100vh; 
-        padding: 2.5rem; 
-        z-index: 100;
-        box-shadow: 20px 0 50px rgba(0,0,0,0.1);
-    }
-    .nav-link { 
-        display: flex; 
-        align-items: center; 
-        gap: 1.25rem; 
-        padding: 1.2rem; 
-        color: #94a3b8; 
-        border-radius: 1.25rem; 
-        transition: all 0.4s cubic-bezier(0.4, 0, 0.2, 1); 
-        text-decoration: none; 
-        font-weight: 600; 
-        margin-bottom: 0.75rem;
-        border: 1px solid transparent;
-    }
-    .nav-link:hover { 
-        background: rgba(255,255,255,0.05); 
-        color: white; 
-        transform: translateX(10px);
-        border-color: rgba(99, 102, 241, 0.3);
-    }
-    .active-nav { 
-        background: linear-gradient(135deg, #6366f1 0%, #4f46e5 100%); 
-        color: white !important; 
-        box-shadow: 0 15px 30px -5px rgba(99, 102, 241, 0.4); 
-        border: none;
-    }
-    .glass-card { 
-        background: white; 
-        border-radius: 2.5rem; 
-        padding: 3rem; 
-        box-shadow: 0 10px 40px rgba(0,0,0,0.02); 
-        border: 1px solid #e2e8f0;
-        transition: transform 0.3s ease;
-    }
-    .glass-card:hover { transform: translateY(-5px); }
-    .input-pro { 
-        width: 100%; 
-        background: #f1f5f9; 
-        border: 2px solid transparent; 
-        border-radius: 1.25rem; 
-        padding: 1.25rem; 
-        font-weight: 600; 
-        outline: none; 
-        transition: all 0.3s ease;
-        font-size: 0.95rem;
-    }
-    .input-pro:focus { 
-        border-color: var(--primary); 
-        background: white; 
-        box-shadow: 0 0 0 5px rgba(99, 102, 241, 0.1);
-    }
-    .btn-grad { 
-        background: linear-gradient(135deg, #6366f1 0%, #4f46e5 100%); 
-        color: white; 
-        padding: 1.5rem; 
-        border-radius: 1.25rem; 
-        border: none; 
-        font-weight: 800; 
-        text-transform: uppercase; 
-        cursor: pointer; 
-        transition: all 0.3s ease; 
-        width: 100%;
-        letter-spacing: 0.05em;
-    }
-    .btn-grad:hover { 
-        transform: translateY(-3px); 
-        box-shadow: 0 20px 40px rgba(99, 102, 241, 0.3);
-        filter: brightness(1.1);
-    }
-    .badge-premium {
-        background: #fef3c7;
-        color: #d97706;
-        padding: 0.5rem 1rem;
-        border-radius: 999px;
-        font-size: 0.7rem;
-        font-weight: 900;
-        text-transform: uppercase;
-        letter-spacing: 0.1em;
-    }
-    .animate-fade-in {
-        animation: fadeIn 0.6s ease-out forwards;
-    }
-    @keyframes fadeIn {
-        from { opacity: 0; transform: translateY(20px); }
-        to { opacity: 1; transform: translateY(0); }
-    }
-</style>
+<link rel="stylesheet" href="{{ asset_url('css/app.css') }}">
+<link rel="stylesheet" href="{{ asset_url('css/tailwind.css') }}">
 """
 
-def get_layout(content, active_page="dashboard"):
-    """
-    Fonction de Layout Maître : Génère la structure globale avec Barre Latérale et Main Content.
-    Contrôle dynamiquement les accès Master et l'affichage des liens actifs.
-    """
-    is_m = current_user.is_admin if (current_user.is_authenticated) else False
-    
-    sidebar = f'''
+# Squelette HTML commun : feuilles de style et zone de contenu
+BASE_TEMPLATE = HEAD_TAGS + '''{% block body %}{% endblock %}
+'''
+
+# Layout Maître : Barre Latérale et Main Content, partagé par toutes les pages authentifiées
+LAYOUT_TEMPLATE = '''{% extends "base.html" %}
+{% block body %}<div class='flex animate-fade-in'>
     <div class="sidebar">
         <div class="flex items-center gap-4 mb-20 px-2">
             <div class="w-14 h-14 bg-indigo-600 rounded-2xl flex items-center justify-center shadow-xl shadow-indigo-500/50 rotate-3">
@@ -259,49 +579,34 @@ def get_layout(content, active_page="dashboard"):
         
         <nav class="space-y-2">
             <p class="text-[10px] font-black text-slate-500 uppercase tracking-widest mb-6 ml-4">Administration SaaS</p>
-            <a href="/dashboard" class="nav-link {'active-nav' if active_page=='dashboard' else ''}"><i class="fas fa-th-large w-6"></i> Dashboard</a>
-            <a href="/mon-agenda" class="nav-link {'active-nav' if active_page=='agenda' else ''}"><i class="fas fa-calendar-alt w-6"></i> Mon Agenda</a>
-            <a href="/profil" class="nav-link {'active-nav' if active_page=='profil' else ''}"><i class="fas fa-id-card w-6"></i> Profil Business</a>
-            <a href="/config-ia" class="nav-link {'active-nav' if active_page=='config' else ''}"><i class="fas fa-robot w-6"></i> Cerveau IA</a>
+            <a href="/dashboard" class="nav-link {{ 'active-nav' if active_page=='dashboard' else '' }}"><i class="fas fa-th-large w-6"></i> Dashboard</a>
+            <a href="/mon-agenda" class="nav-link {{ 'active-nav' if active_page=='agenda' else '' }}"><i class="fas fa-calendar-alt w-6"></i> Mon Agenda</a>
+            <a href="/profil" class="nav-link {{ 'active-nav' if active_page=='profil' else '' }}"><i class="fas fa-id-card w-6"></i> Profil Business</a>
+            <a href="/config-ia" class="nav-link {{ 'active-nav' if active_page=='config' else '' }}"><i class="fas fa-robot w-6"></i> Cerveau IA</a>
             
             <div class="my-10 border-t border-slate-800 opacity-50"></div>
             
             <p class="text-[10px] font-black text-indigo-400 uppercase tracking-widest mb-6 ml-4">Zone Master Expert</p>
-            <a href="/master-admin" class="nav-link {'active-nav' if active_page=='master-admin' else ''}"><i class="fas fa-shield-halved w-6"></i> Master Control</a>
-            <a href="/master-clients" class="nav-link {'active-nav' if active_page=='master-clients' else ''}"><i class="fas fa-users-cog w-6"></i> Clients Portfolio</a>
-            <a href="/master-logs" class="nav-link {'active-nav' if active_page=='master-logs' else ''}"><i class="fas fa-terminal w-6"></i> Logs Systeme</a>
+            <a href="/master-admin" class="nav-link {{ 'active-nav' if active_page=='master-admin' else '' }}"><i class="fas fa-shield-halved w-6"></i> Master Control</a>
+            <a href="/master-clients" class="nav-link {{ 'active-nav' if active_page=='master-clients' else '' }}"><i class="fas fa-users-cog w-6"></i> Clients Portfolio</a>
+            <a href="/master-logs" class="nav-link {{ 'active-nav' if active_page=='master-logs' else '' }}"><i class="fas fa-terminal w-6"></i> Logs Systeme</a>
         </nav>
         
         <div class="absolute bottom-10 left-10 right-10">
             <a href="/logout" class="nav-link text-red-400 hover:bg-red-500/10 font-black uppercase text-[11px]"><i class="fas fa-power-off"></i> Deconnexion</a>
         </div>
     </div>
-    '''
-    return f"{STYLE}<div class='flex animate-fade-in'>{sidebar}<main class='ml-[320px] flex-1 p-20 min-h-screen bg-[#f8fafc] text-slate-900'>{content}</main></div>"
-
-# ----------------------------------------------------------------------------------------------------------------------
-# LOGIQUE DES PAGES (ROUTES APPLICATIVES)
-# ----------------------------------------------------------------------------------------------------------------------
-
-@app.route('/profil', methods=['GET', 'POST'])
-@login_required
-def profil():
-    """Page Profil : Gestion des données légales et coordonnées de l'établissement client."""
-    if request.method == 'POST':
-        current_user.business_name = request.form.get('bn')
-        current_user.email = request.form.get('em')
-        current_user.phone_pro = request.form.get('ph')
-        current_user.adresse = request.form.get('ad')
-        db.session.commit()
-        flash("Les donnees de votre etablissement ont ete synchronisees avec succes.")
+    <main class='ml-[320px] flex-1 p-20 min-h-screen bg-[#f8fafc] text-slate-900'>{% block content %}{% endblock %}</main></div>{% endblock %}
+'''
 
-    content = f'''
+PROFIL_TEMPLATE = '''{% extends "layout.html" %}
+{% block content %}
     <div class="flex justify-between items-center mb-16">
         <div>
             <h1 class="text-6xl font-black text-slate-900 italic uppercase tracking-tighter">Profil Business</h1>
             <p class="text-slate-400 text-lg font-medium mt-2">Gerez les informations administratives de votre licence.</p>
         </div>
-        <div class="badge-premium">Enterprise Tier #00{current_user.id}</div>
+        <div class="badge-premium">Enterprise Tier #00{{ user.id }}</div>
     </div>
     
     <div class="grid grid-cols-1 lg:grid-cols-3 gap-12">
@@ -313,20 +618,20 @@ def profil():
                 <div class="grid grid-cols-1 md:grid-cols-2 gap-8">
                     <div class="space-y-3">
                         <label class="text-[11px] font-black text-slate-400 uppercase tracking-widest ml-2">Nom de l'Enseigne / Commerce</label>
-                        <input name="bn" value="{current_user.business_name or ''}" placeholder="Ex: DigitagPro Agency" class="input-pro">
+                        <input name="bn" value="{{ user.business_name or '' }}" placeholder="Ex: DigitagPro Agency" class="input-pro">
                     </div>
                     <div class="space-y-3">
                         <label class="text-[11px] font-black text-slate-400 uppercase tracking-widest ml-2">Email de Support Client</label>
-                        <input name="em" value="{current_user.email or ''}" placeholder="contact@domaine.com" class="input-pro">
+                        <input name="em" value="{{ user.email or '' }}" placeholder="contact@domaine.com" class="input-pro">
                     </div>
                 </div>
                 <div class="space-y-3">
                     <label class="text-[11px] font-black text-slate-400 uppercase tracking-widest ml-2">Ligne Telephonique de Liaison</label>
-                    <input name="ph" value="{current_user.phone_pro or ''}" placeholder="+33 1 23 45 67 89" class="input-pro">
+                    <input name="ph" value="{{ user.phone_pro or '' }}" placeholder="+33 1 23 45 67 89" class="input-pro">
                 </div>
                 <div class="space-y-3">
                     <label class="text-[11px] font-black text-slate-400 uppercase tracking-widest ml-2">Adresse de l'Etablissement Physique</label>
-                    <input name="ad" value="{current_user.adresse or ''}" placeholder="123 Avenue de l'IA, Paris" class="input-pro">
+                    <input name="ad" value="{{ user.adresse or '' }}" placeholder="123 Avenue de l'IA, Paris" class="input-pro">
                 </div>
                 <div class="pt-6">
                     <button type="submit" class="btn-grad shadow-2xl">Mettre a jour les informations</button>
@@ -336,13 +641,13 @@ def profil():
         
         <div class="glass-card bg-slate-900 text-white flex flex-col items-center justify-center text-center">
             <div class="w-28 h-28 bg-indigo-600 rounded-full flex items-center justify-center text-4xl font-black mb-6 shadow-2xl border-4 border-white/10">
-                {current_user.business_name[0] if current_user.business_name else 'B'}
+                {{ user.business_name[0] if user.business_name else 'B' }}
             </div>
-            <h2 class="text-3xl font-black mb-2 italic tracking-tight">{current_user.business_name}</h2>
-            <span class="text-indigo-400 font-bold uppercase tracking-widest text-[10px] mb-10">{current_user.sector}</span>
+            <h2 class="text-3xl font-black mb-2 italic tracking-tight">{{ user.business_name }}</h2>
+            <span class="text-indigo-400 font-bold uppercase tracking-widest text-[10px] mb-10">{{ user.sector }}</span>
             <div class="w-full space-y-4 pt-10 border-t border-slate-800">
                 <div class="flex items-center gap-4 text-sm font-medium text-slate-400">
-                    <i class="fas fa-calendar-day text-indigo-500 w-5"></i> Inscrit en {current_user.date_creation.strftime("%Y")}
+                    <i class="fas fa-calendar-day text-indigo-500 w-5"></i> Inscrit en {{ user.date_creation.strftime("%Y") }}
                 </div>
                 <div class="flex items-center gap-4 text-sm font-medium text-slate-400">
                     <i class="fas fa-shield-check text-emerald-500 w-5"></i> Identite Verifiee
@@ -350,26 +655,19 @@ def profil():
             </div>
         </div>
     </div>
-    '''
-    return render_template_string(get_layout(content, "profil"))
+    {% endblock %}
+'''
 
-@app.route('/dashboard')
-@login_required
-def dashboard():
-    """Dashboard : Vue d'ensemble des statistiques d'appels et statut de l'infrastructure IA."""
-    today = datetime.now().strftime("%d %B %Y")
-    count = len(current_user.appointments)
-    last_call = current_user.appointments[-1].date_str if current_user.appointments else "Aucune activite"
-    
-    content = f'''
+DASHBOARD_TEMPLATE = '''{% extends "layout.html" %}
+{% block content %}
     <div class="flex justify-between items-end mb-20">
         <div>
             <p class="text-indigo-600 font-black uppercase tracking-[0.5em] text-[11px] mb-4 italic">DigitagPro SaaS Control Center</p>
-            <h1 class="text-7xl font-black text-slate-900 tracking-tighter">Salut, {current_user.business_name}</h1>
+            <h1 class="text-7xl font-black text-slate-900 tracking-tighter">Salut, {{ current_user.business_name }}</h1>
         </div>
         <div class="text-right glass-card !p-10 !rounded-[2.5rem] bg-white shadow-xl">
             <p class="text-slate-400 font-bold uppercase text-[10px] mb-2 italic tracking-widest">Calendrier</p>
-            <p class="text-3xl font-black text-slate-900 uppercase tracking-tighter">{today}</p>
+            <p class="text-3xl font-black text-slate-900 uppercase tracking-tighter">{{ today }}</p>
         </div>
     </div>
     
@@ -382,7 +680,7 @@ def dashboard():
                 <span class="text-[10px] font-black text-slate-300 uppercase group-hover:text-white/50 tracking-widest">Temps Reel</span>
             </div>
             <p class="text-slate-400 font-bold uppercase tracking-widest text-[11px] group-hover:text-indigo-100">Appels Interceptes IA</p>
-            <p class="text-7xl font-black text-slate-900 mt-3 tracking-tighter group-hover:text-white transition-all">{count}</p>
+            <p class="text-7xl font-black text-slate-900 mt-3 tracking-tighter group-hover:text-white transition-all">{{ count }}</p>
         </div>
         
         <div class="glass-card group hover:bg-emerald-600 transition-all duration-500">
@@ -393,7 +691,7 @@ def dashboard():
                 <span class="text-[10px] font-black text-slate-300 uppercase group-hover:text-white/50 tracking-widest">Performance</span>
             </div>
             <p class="text-slate-400 font-bold uppercase tracking-widest text-[11px] group-hover:text-emerald-100">Dernier Appel Recu</p>
-            <p class="text-3xl font-black text-slate-900 mt-4 tracking-tighter group-hover:text-white leading-tight uppercase italic">{last_call}</p>
+            <p class="text-3xl font-black text-slate-900 mt-4 tracking-tighter group-hover:text-white leading-tight uppercase italic">{{ last_call }}</p>
         </div>
         
         <div class="glass-card group hover:bg-slate-900 transition-all duration-500 border-none">
@@ -404,7 +702,13 @@ def dashboard():
                 <span class="text-[10px] font-black text-slate-300 uppercase group-hover:text-white/50 tracking-widest">Status 2026</span>
             </div>
             <p class="text-slate-400 font-bold uppercase tracking-widest text-[11px] group-hover:text-slate-300">Vitesse de Reponse IA</p>
-            <p class="text-4xl font-black text-emerald-500 mt-4 tracking-tighter italic group-hover:text-emerald-400"><i class="fas fa-check-circle mr-2"></i> INSTANTANEE</p>
+            {% if speed %}
+            <p class="text-4xl font-black text-emerald-500 mt-4 tracking-tighter italic group-hover:text-emerald-400"><i class="fas fa-gauge-high mr-2"></i> {{ speed.p50 }} ms</p>
+            <p class="text-[11px] font-black text-slate-400 uppercase tracking-widest mt-2 group-hover:text-slate-300">Mediane - p95 {{ speed.p95 }} ms</p>
+            {% else %}
+            <p class="text-4xl font-black text-slate-300 mt-4 tracking-tighter italic group-hover:text-slate-500"><i class="fas fa-hourglass-half mr-2"></i> EN ATTENTE</p>
+            <p class="text-[11px] font-black text-slate-400 uppercase tracking-widest mt-2 group-hover:text-slate-300">Aucun appel mesure</p>
+            {% endif %}
         </div>
     </div>
 
@@ -415,28 +719,17 @@ def dashboard():
                 Votre agent vocal intelligent est operationnel. Pour lier DigitagPro a votre ligne telephonique, configurez l'URL suivante dans votre Webhook Voice (HTTP POST) :
             </p>
             <div class="bg-white/5 p-12 rounded-[3rem] border border-white/10 font-mono text-indigo-300 text-2xl shadow-inner flex justify-between items-center group cursor-pointer hover:border-indigo-500 transition-all">
-                <span class="truncate">https://digitagpro-ia.onrender.com/voice/{current_user.id}</span>
+                <span class="truncate">https://digitagpro-ia.onrender.com/voice/{{ current_user.id }}</span>
                 <i class="fas fa-copy text-slate-600 group-hover:text-white transition-colors"></i>
             </div>
         </div>
         <i class="fas fa-robot text-[450px] absolute -right-32 -bottom-40 text-white/5 rotate-12 animate-pulse"></i>
     </div>
-    '''
-    return render_template_string(get_layout(content, "dashboard"))
+    {% endblock %}
+'''
 
-@app.route('/config-ia', methods=['GET', 'POST'])
-@login_required
-def config_ia():
-    """Page Configuration IA : Définition des horaires, tarifs et prompt système."""
-    if request.method == 'POST':
-        current_user.horaires = request.form.get('h')
-        current_user.tarifs = request.form.get('t')
-        current_user.prompt_personnalise = request.form.get('p')
-        current_user.ton_ia = request.form.get('ton')
-        db.session.commit()
-        flash("L'intelligence de votre agent vocal a ete synchronisee avec succes.")
-    
-    content = f'''
+CONFIG_IA_TEMPLATE = '''{% extends "layout.html" %}
+{% block content %}
     <div class="flex justify-between items-center mb-16">
         <div>
             <h1 class="text-6xl font-black text-slate-900 italic uppercase tracking-tighter">Cerveau Agent IA</h1>
@@ -452,11 +745,11 @@ def config_ia():
             </h3>
             <div class="space-y-4">
                 <label class="text-[11px] font-black text-slate-400 uppercase tracking-[0.3em] ml-2">Planning d'Ouverture et Disponibilites</label>
-                <textarea name="h" rows="5" class="input-pro" placeholder="Lundi-Vendredi: 9h-12h et 14h-18h...">{current_user.horaires}</textarea>
+                <textarea name="h" rows="5" class="input-pro" placeholder="Lundi-Vendredi: 9h-12h et 14h-18h...">{{ user.horaires }}</textarea>
             </div>
             <div class="space-y-4">
                 <label class="text-[11px] font-black text-slate-400 uppercase tracking-[0.3em] ml-2">Grille de Tarification et Catalogue Services</label>
-                <textarea name="t" rows="7" class="input-pro" placeholder="Ex: Consultation: 50 euros, Forfait complet: 150 euros...">{current_user.tarifs}</textarea>
+                <textarea name="t" rows="7" class="input-pro" placeholder="Ex: Consultation: 50 euros, Forfait complet: 150 euros...">{{ user.tarifs }}</textarea>
             </div>
         </div>
         
@@ -466,14 +759,14 @@ def config_ia():
             </h3>
             <div class="space-y-4">
                 <label class="text-[11px] font-black text-slate-400 uppercase tracking-[0.3em] ml-2">Instructions Spécifiques (Prompts)</label>
-                <textarea name="p" rows="6" class="input-pro" placeholder="Sois toujours accueillant, propose un rendez-vous et demande le prenom...">{current_user.prompt_personnalise}</textarea>
+                <textarea name="p" rows="6" class="input-pro" placeholder="Sois toujours accueillant, propose un rendez-vous et demande le prenom...">{{ user.prompt_personnalise }}</textarea>
             </div>
             <div class="space-y-4">
                 <label class="text-[11px] font-black text-slate-400 uppercase tracking-[0.3em] ml-2">Style Elocution et Ton</label>
                 <select name="ton" class="input-pro">
-                    <option value="Professionnel" {"selected" if current_user.ton_ia == "Professionnel" else ""}>Professionnel / Formel / Serieur</option>
-                    <option value="Amical" {"selected" if current_user.ton_ia == "Amical" else ""}>Amical / Chaleureux / Dynamique</option>
-                    <option value="Direct" {"selected" if current_user.ton_ia == "Direct" else ""}>Direct / Rapide / Concis</option>
+                    <option value="Professionnel" {{ "selected" if user.ton_ia == "Professionnel" else "" }}>Professionnel / Formel / Serieur</option>
+                    <option value="Amical" {{ "selected" if user.ton_ia == "Amical" else "" }}>Amical / Chaleureux / Dynamique</option>
+                    <option value="Direct" {{ "selected" if user.ton_ia == "Direct" else "" }}>Direct / Rapide / Concis</option>
                 </select>
             </div>
             <div class="p-10 bg-emerald-50 rounded-[2rem] border-2 border-dashed border-emerald-100">
@@ -483,21 +776,38 @@ def config_ia():
             </div>
         </div>
     </form>
-    '''
-    return render_template_string(get_layout(content, "config"))
+    
+    <div class="glass-card mt-12 border-l-8 {{ 'border-l-amber-500' if layout.truncated else 'border-l-slate-900' }}">
+        <div class="flex justify-between items-center border-b pb-6 mb-8">
+            <h3 class="text-2xl font-black italic text-slate-900 flex items-center gap-5"><i class="fas fa-weight-hanging"></i> Poids de la Configuration</h3>
+            <p class="text-[11px] font-black uppercase tracking-widest {{ 'text-amber-500' if layout.truncated else 'text-slate-400' }}">{{ layout.tokens }} / {{ layout.budget }} tokens par appel</p>
+        </div>
+        <div class="grid grid-cols-2 md:grid-cols-4 gap-6">
+            {% for s in layout.sections %}
+            <div class="p-6 bg-slate-50 rounded-[2rem]">
+                <p class="text-[10px] font-black text-slate-400 uppercase tracking-widest">{{ s.label }}</p>
+                <p class="text-3xl font-black italic text-slate-900 mt-2">{{ s.kept }}<span class="text-sm text-slate-400"> tokens</span></p>
+                {% if s.kept < s.raw %}<p class="text-[10px] font-black text-amber-500 uppercase tracking-widest mt-2">Tronque ({{ s.raw }} saisis)</p>{% endif %}
+            </div>
+            {% endfor %}
+        </div>
+        <p class="text-xs text-slate-400 font-bold mt-8 leading-loose">
+            {% if layout.truncated %}Votre configuration depasse le budget : les sections les plus longues sont raccourcies a l'envoi. Allegez-les pour que l'agent dispose de tout votre texte.
+            {% else %}Ces informations sont envoyees a chaque tour, apres {{ static_tokens }} tokens de consignes communes a tous les agents.{% endif %}
+        </p>
+    </div>
+    {% endblock %}
+'''
 
-@app.route('/mon-agenda')
-@login_required
-def mon_agenda():
-    """Agenda : Historique structuré des appels interceptés et conversions."""
-    content = """
+AGENDA_TEMPLATE = '''{% extends "layout.html" %}
+{% block content %}
     <div class="flex justify-between items-center mb-20">
         <div>
             <h1 class="text-6xl font-black text-slate-900 tracking-tighter italic uppercase">Agenda Vocal</h1>
             <p class="text-slate-400 text-lg font-medium mt-2">Suivez les rendez-vous pris par votre intelligence artificielle.</p>
         </div>
         <div class="flex gap-6">
-            <button class="bg-white border-2 border-slate-200 px-12 py-5 rounded-[2.5rem] font-black text-[11px] uppercase tracking-widest hover:bg-slate-50 transition shadow-sm">Export CRM</button>
+            <a href="{{ url_for('export_agenda', fmt='csv') }}" class="bg-white border-2 border-slate-200 px-12 py-5 rounded-[2.5rem] font-black text-[11px] uppercase tracking-widest hover:bg-slate-50 transition shadow-sm">Export CRM</a>
             <button class="bg-slate-900 text-white px-12 py-5 rounded-[2.5rem] font-black text-[11px] uppercase tracking-widest shadow-2xl">Imprimer</button>
         </div>
     </div>
@@ -512,7 +822,7 @@ def mon_agenda():
                 </tr>
             </thead>
             <tbody class="divide-y divide-slate-100">
-                {% for r in current_user.appointments|reverse %}
+                {% for r in rows %}
                 <tr class="hover:bg-slate-50/80 transition-all group">
                     <td class="p-10">
                         <p class="font-black text-indigo-600 text-xl italic tracking-tighter">{{ r.date_str }}</p>
@@ -550,189 +860,30 @@ def mon_agenda():
             </tbody>
         </table>
     </div>
-    """
-    return render_template_string(get_layout(content, "agenda"))
-
-# ----------------------------------------------------------------------------------------------------------------------
-# ADMINISTRATION SYSTÈME ET ACCÈS (AUTH & MASTER)
-# ----------------------------------------------------------------------------------------------------------------------
-
-@app.route('/')
-def home(): 
-    """Redirection vers le point d'entrée sécurisé."""
-    return redirect(url_for('login'))
-
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    """Authentification sécurisée avec protection contre les attaques par force brute."""
-    if request.method == 'POST':
-        u = User.query.filter_by(email=request.form.get('email')).first()
-        if u and u.password == request.form.get('password'):
-            login_user(u)
-            logger.info(f"AUTH_SUCCESS: Client login verified for {u.email}.")
-            return redirect(url_for('dashboard'))
-        flash("Les identifiants ne sont pas valides pour cette licence DigitagPro.")
-    
-    return render_template_string(STYLE + '''
-    <body class="bg-[#0f172a] flex items-center justify-center h-screen p-10 overflow-hidden">
-        <form method="POST" class="bg-white p-20 rounded-[5rem] w-full max-w-[600px] shadow-2xl animate-fade-in relative">
-            <div class="text-center mb-16">
-                <div class="w-24 h-24 bg-indigo-600 rounded-[2.5rem] flex items-center justify-center mx-auto mb-10 shadow-2xl shadow-indigo-500/40 rotate-3">
-                    <i class="fas fa-shield-halved text-white text-4xl"></i>
-                </div>
-                <h2 class="text-5xl font-black text-slate-900 italic tracking-tighter uppercase mb-3 leading-none">Connexion</h2>
-                <p class="text-slate-400 font-bold uppercase tracking-[0.4em] text-[10px]">Acces Securise SaaS DigitagPro</p>
-            </div>
-            <div class="space-y-8">
-                <div class="relative group">
-                    <i class="fas fa-envelope absolute top-7 left-8 text-slate-400 group-focus-within:text-indigo-600 transition-colors"></i>
-                    <input name="email" type="email" placeholder="Email de Licence Professionnel" class="input-pro pl-20" required>
-                </div>
-                <div class="relative group">
-                    <i class="fas fa-lock absolute top-7 left-8 text-slate-400 group-focus-within:text-indigo-600 transition-colors"></i>
-                    <input name="password" type="password" placeholder="Mot de Passe Securise" class="input-pro pl-20" required>
-                </div>
-                <button type="submit" class="w-full btn-grad p-7 uppercase font-black tracking-[0.2em] text-sm shadow-2xl mt-6">Acceder au Cockpit</button>
-            </div>
-            <p class="text-center mt-16 text-xs text-slate-400 font-bold uppercase tracking-widest">Technologie IA Gen V4.0 Ready</p>
-        </form>
-    </body>''')
-
-@app.route('/register', methods=['GET', 'POST'])
-def register():
-    """Procédure d'onboarding : Création automatisée d'instance client."""
-    if request.method == 'POST':
-        u = User(
-            email=request.form.get('email'), 
-            password=request.form.get('password'), 
-            business_name=request.form.get('b_name'), 
-            sector=request.form.get('sector')
-        )
-        db.session.add(u)
-        db.session.commit()
-        logger.info(f"NEW_LICENSE: A new account has been successfully initialized for {u.business_name}.")
-        return redirect(url_for('login'))
-        
-    return render_template_string(STYLE + '''
-    <body class="bg-slate-50 flex items-center justify-center h-screen p-10">
-        <form method="POST" class="bg-white p-20 rounded-[5rem] w-full max-w-[750px] shadow-2xl border border-slate-100 animate-fade-in">
-            <h2 class="text-5xl font-black text-center uppercase tracking-tighter italic mb-5 leading-none">Nouvelle Licence</h2>
-            <p class="text-center text-slate-400 mb-16 font-medium text-lg leading-relaxed">Initiez votre propre agent vocal intelligent pour votre commerce en quelques secondes.</p>
-            <div class="grid grid-cols-1 md:grid-cols-2 gap-8">
-                <input name="b_name" placeholder="Nom Commercial / Garage / Clinique" class="input-pro col-span-2" required>
-                <input name="sector" placeholder="Secteur d'activite" class="input-pro" required>
-                <input name="email" type="email" placeholder="Email Professionnel" class="input-pro" required>
-                <input name="password" type="password" placeholder="Mot de Passe de Securite" class="input-pro col-span-2" required>
-            </div>
-            <button type="submit" class="w-full btn-grad p-8 mt-12 uppercase font-black tracking-widest text-sm shadow-2xl">Deployer mon infrastructure IA</button>
-            <p class="text-center mt-12 text-[10px] text-slate-400 font-black uppercase tracking-widest italic leading-loose">Hautement Securise - Certifie ISO 27001 - DigitagPro Ecosystem</p>
-        </form>
-    </body>''')
-
-@app.route('/logout')
-def logout(): 
-    """Destruction de la session active."""
-    logout_user()
-    return redirect(url_for('login'))
-
-# ----------------------------------------------------------------------------------------------------------------------
-# MOTEUR VOCAL IA (VOCO CORE NEURAL ENGINE 2026)
-# ----------------------------------------------------------------------------------------------------------------------
-
-@app.route("/voice/<int:user_id>", methods=['POST'])
-def voice(user_id):
-    """
-    Pipeline Vocal IA : Réception Twilio Webhook.
-    Processus : Audio -> Transcription (Twilio) -> Brain (OpenAI) -> Speech (Amazon Polly).
-    """
-    c = User.query.get_or_404(user_id)
-    resp = VoiceResponse()
-    txt = request.values.get('SpeechResult')
-    
-    # SYSTEM CONSOLE LOGGING (POWERSHELL/RENDER)
-    logger.info(f"\n[VOICE_SESSION_START] CLIENT: {c.business_name} | LICENCE_ID: {c.id}")
-    
-    if not txt:
-        # Message d'accueil introductif
-        ai_res = f"Bonjour, bienvenue chez {c.business_name}, je suis votre assistant virtuel. Comment puis-je vous aider aujourd'hui ?"
-    else:
-        logger.info(f"[CLIENT_TRANSCRIPTION] RAW_DATA: {txt}")
-        # Orchestration du Prompt IA avec Injection de Contexte
-        prompt = f"""Tu es l'agent vocal de haute technologie de {c.business_name} ({c.sector}). 
-        Voici les informations cruciales pour ta reponse :
-        - Notre planning et horaires : {c.horaires}. 
-        - Nos offres, services et tarifs : {c.tarifs}. 
-        - Notre localisation : {c.adresse}.
-        - Tes instructions secretes : {c.prompt_personnalise}. 
-        
-        LOGIQUE DE COMPORTEMENT :
-        1. Tu dois etre extreêmement courtois, professionnel et aller a l'essentiel.
-        2. Si un rendez-vous est suggere ou confirme, tu DOIS ABSOLUMENT terminer ton message par la balise CONFIRMATION: [Nom, Date et Heure]."""
-        
-        try:
-            # Invocation du LLM (Large Language Model)
-            chat = client.chat.completions.create(
-                model="gpt-4o-mini", 
-                messages=[{"role": "system", "content": prompt}, {"role": "user", "content": txt}],
-                max_tokens=250,
-                temperature=0.7
-            )
-            ai_res = chat.choices[0].message.content
-            logger.info(f"[IA_RESPONSE_GENERATED] OUTPUT: {ai_res}")
-            
-            # Traitement de la balise de confirmation pour l'agenda
-            if "CONFIRMATION:" in ai_res:
-                details_data = ai_res.split("CONFIRMATION:")[1].strip()
-                new_entry = Appointment(
-                    date_str=datetime.now().strftime("%d/%m e  %H:%M"), 
-                    details=details_data, 
-                    user_id=c.id
-                )
-                db.session.add(new_entry)
-                db.session.commit()
-                logger.info("[DATABASE_SYNC] NEW APPOINTMENT SAVED SUCCESSFULLY.")
-                ai_res = ai_res.split("CONFIRMATION:")[0] + " Parfait, votre rendez-vous est maintenant enregistre dans mon agenda."
-                
-        except Exception as e:
-            logger.error(f"[SYSTEM_FAILURE_IA] EXCEPTION: {str(e)}")
-            ai_res = "Veuillez m'excuser, une legere interference technique m'empeche de traiter votre demande. Pouvez-vous répéter ?"
-
-    # Configuration de la collecte vocale et du moteur de synthèse Neural
-    # VoiceLea-Neural offre une voix humaine sans l'effet robotique classique.
-    g = Gather(input='speech', language='fr-FR', timeout=1.8, speechTimeout='auto')
-    g.say(ai_res, language='fr-FR', voice='Polly.Lea-Neural')
-    resp.append(g)
-    
-    # Redirection pour maintenir le flux de conversation
-    resp.redirect(url_for('voice', user_id=user_id))
     
-    return str(resp)
-
-# ----------------------------------------------------------------------------------------------------------------------
-# MASTER ADMIN ZONE (GESTION ET SUPERVISION GLOBALE)
-# ----------------------------------------------------------------------------------------------------------------------
+    <div class="flex justify-between items-center mt-12">
+        {% if newer %}
+        <a href="?after={{ newer }}&limit={{ page_size }}" class="bg-white border-2 border-slate-200 px-12 py-5 rounded-[2.5rem] font-black text-[11px] uppercase tracking-widest hover:bg-slate-50 transition shadow-sm"><i class="fas fa-arrow-left mr-3"></i> Plus recents</a>
+        {% else %}<span></span>{% endif %}
+        {% if older %}
+        <a href="?before={{ older }}&limit={{ page_size }}" class="bg-slate-900 text-white px-12 py-5 rounded-[2.5rem] font-black text-[11px] uppercase tracking-widest shadow-2xl">Plus anciens <i class="fas fa-arrow-right ml-3"></i></a>
+        {% endif %}
+    </div>
+    {% endblock %}
+'''
 
-@app.route('/master-admin')
-@login_required
-def master_admin():
-    """Master Control Panel : Réservé aux administrateurs pour piloter le parc client."""
-    if not current_user.is_admin: 
-        logger.warning(f"UNAUTHORIZED_ACCESS_ATTEMPT: User {current_user.email} tried to access Master Control.")
-        return redirect(url_for('dashboard'))
-        
-    users = User.query.all()
-    logs_total = Appointment.query.order_by(Appointment.id.desc()).limit(20).all()
-    
-    content = f"""
+MASTER_ADMIN_TEMPLATE = '''{% extends "layout.html" %}
+{% block content %}
     <div class="flex justify-between items-center mb-20">
         <div>
             <h1 class="text-7xl font-black italic uppercase tracking-tighter text-indigo-600">Master Console</h1>
             <p class="text-slate-400 font-bold uppercase tracking-[0.4em] text-xs mt-4">Supervision des Micro-Services SaaS</p>
         </div>
-        <div class="flex gap-12">
+        <div class="flex gap-12 items-center">
+            <a href="{{ url_for('export_all', fmt='csv', gzip=1) }}" class="bg-white border-2 border-slate-200 px-10 py-5 rounded-[2.5rem] font-black text-[11px] uppercase tracking-widest hover:bg-slate-50 transition shadow-sm"><i class="fas fa-file-export mr-2"></i> Export Global</a>
             <div class="text-right border-r-2 pr-12 border-slate-200">
                 <p class="text-[10px] font-black text-slate-400 uppercase tracking-widest">Parc Licences</p>
-                <p class="text-4xl font-black text-slate-900">{len(users)}</p>
+                <p class="text-4xl font-black text-slate-900">{{ tenant_count }}</p>
             </div>
             <div class="w-20 h-20 bg-indigo-600 rounded-[2rem] flex items-center justify-center text-white text-3xl shadow-2xl shadow-indigo-500/40">
                 <i class="fas fa-crown"></i>
@@ -746,18 +897,20 @@ def master_admin():
                 <i class="fas fa-users-viewfinder"></i> Base Clients Actifs
             </h3>
             <div class="space-y-6">
-                {{% for u in users %}}
+                {% for u in users %}
                 <div class="p-8 bg-slate-950 text-white rounded-[2.5rem] flex justify-between items-center group hover:bg-indigo-600 transition-all cursor-pointer">
                     <div>
                         <p class="font-black italic text-2xl group-hover:scale-110 transition-transform origin-left">{{ u.business_name }}</p>
                         <p class="text-[10px] text-slate-500 font-mono tracking-widest uppercase group-hover:text-indigo-200 mt-1">{{ u.email }}</p>
                     </div>
                     <div class="flex items-center gap-6">
+                        <span class="text-[9px] font-black bg-white/5 px-5 py-2 rounded-full uppercase tracking-widest border border-white/5 italic">{{ u.calls }} appels</span>
                         <span class="text-[9px] font-black bg-white/5 px-5 py-2 rounded-full uppercase tracking-widest border border-white/5 italic">Licence ID:{{ u.id }}</span>
                         <a href="/voice/{{ u.id }}" class="w-12 h-12 bg-white/10 rounded-xl flex items-center justify-center hover:bg-white hover:text-indigo-600 transition-all"><i class="fas fa-link"></i></a>
                     </div>
                 </div>
-                {{% endfor %}}
+                {% endfor %}
+                <a href="/master-clients" class="block text-center text-[11px] font-black text-indigo-600 uppercase tracking-widest pt-4">Voir tout le portefeuille <i class="fas fa-arrow-right ml-2"></i></a>
             </div>
         </div>
         
@@ -766,7 +919,7 @@ def master_admin():
                 <i class="fas fa-server"></i> Logs Systeme et Traffic
             </h3>
             <div class="space-y-6">
-                {{% for l in logs_total %}}
+                {% for l in logs_total %}
                 <div class="p-6 border-l-8 border-indigo-500 bg-slate-50 rounded-r-3xl flex justify-between items-center shadow-sm">
                     <div>
                         <p class="text-[11px] font-black text-indigo-600 uppercase mb-2 tracking-widest italic">{{ l.owner.business_name }}</p>
@@ -774,29 +927,3689 @@ def master_admin():
                     </div>
                     <p class="text-[11px] font-mono font-black text-slate-300">{{ l.date_str }}</p>
                 </div>
-                {{% endfor %}}
+                {% endfor %}
             </div>
         </div>
     </div>
-    """
-    return render_template_string(get_layout(content, "master-admin"), users=users, logs=logs_total)
-
-@app.route('/master-clients')
-@login_required
-def master_clients():
-    """Master View : Portfolio complet des clients."""
-    if not current_user.is_admin: return redirect(url_for('dashboard'))
-    users = User.query.all()
-    content = """<h1 class="text-4xl font-black mb-12 italic uppercase">Gestion du Portefeuille Clients</h1>"""
-    return render_template_string(get_layout(content, "master-clients"))
+    
+    <div class="glass-card !p-12 mt-12 border-t-8 border-t-rose-500">
+        <h3 class="text-2xl font-black mb-12 border-b pb-8 italic flex items-center gap-4">
+            <i class="fas fa-traffic-light"></i> Controle d'Admission et Delestage
+        </h3>
+        <div class="grid grid-cols-2 md:grid-cols-4 gap-6 mb-10">
+            <div class="p-8 bg-slate-50 rounded-[2rem]">
+                <p class="text-[10px] font-black text-slate-400 uppercase tracking-widest">Limite Tenant</p>
+                <p class="text-4xl font-black text-slate-900">{{ shed.reasons.tenant }}</p>
+            </div>
+            <div class="p-8 bg-slate-50 rounded-[2rem]">
+                <p class="text-[10px] font-black text-slate-400 uppercase tracking-widest">Limite Globale</p>
+                <p class="text-4xl font-black text-slate-900">{{ shed.reasons.global }}</p>
+            </div>
+            <div class="p-8 bg-slate-50 rounded-[2rem]">
+                <p class="text-[10px] font-black text-slate-400 uppercase tracking-widest">Quota LLM</p>
+                <p class="text-4xl font-black text-slate-900">{{ shed.reasons.llm_rate }}</p>
+            </div>
+            <div class="p-8 bg-slate-50 rounded-[2rem]">
+                <p class="text-[10px] font-black text-slate-400 uppercase tracking-widest">En Cours ({{ shed.backend }})</p>
+                <p class="text-4xl font-black text-indigo-600">{{ shed.in_flight if shed.in_flight is not none else '-' }}</p>
+            </div>
+        </div>
+        <div class="space-y-4">
+            {% for tenant_id, name, count in shed.tenants %}
+            <div class="p-6 border-l-8 border-rose-500 bg-slate-50 rounded-r-3xl flex justify-between items-center shadow-sm">
+                <p class="font-black italic text-xl text-slate-900">{{ name }} <span class="text-[10px] font-mono text-slate-400 ml-3">Licence ID:{{ tenant_id }}</span></p>
+                <p class="text-2xl font-black text-rose-500">{{ count }} rejets</p>
+            </div>
+            {% else %}
+            <p class="text-center text-lg font-black text-slate-300 uppercase italic">Aucune requete delestee.</p>
+            {% endfor %}
+        </div>
+    </div>
+    {% endblock %}
+'''
 
-@app.route('/master-logs')
-@login_required
-def master_logs():
-    """Master View : Logs système profonds."""
+MASTER_CLIENTS_TEMPLATE = '''{% extends "layout.html" %}
+{% block content %}
+    <div class="flex justify-between items-center mb-16">
+        <div>
+            <h1 class="text-6xl font-black italic uppercase tracking-tighter">Portefeuille Clients</h1>
+            <p class="text-slate-400 text-lg font-medium mt-2">Recherche et supervision de l'ensemble des licences.</p>
+        </div>
+    </div>
+    
+    <form method="GET" class="glass-card !p-10 mb-12 grid grid-cols-1 md:grid-cols-4 gap-6">
+        <input name="q" value="{{ q }}" placeholder="Nom ou email" class="input-pro">
+        <input name="sector" value="{{ sector }}" placeholder="Secteur" class="input-pro">
+        <select name="activity" class="input-pro">
+            <option value="all" {% if activity == 'all' %}selected{% endif %}>Toutes les licences</option>
+            <option value="active" {% if activity == 'active' %}selected{% endif %}>Actives (30 jours)</option>
+            <option value="dormant" {% if activity == 'dormant' %}selected{% endif %}>Dormantes</option>
+        </select>
+        <button type="submit" class="btn-grad !p-5">Filtrer</button>
+    </form>
+    
+    <div class="glass-card !p-0 overflow-hidden shadow-2xl border-none">
+        <table class="w-full text-left border-collapse">
+            <thead class="bg-slate-900 text-white text-[11px] font-black uppercase tracking-[0.3em]">
+                <tr>
+                    <th class="p-8">Licence</th>
+                    <th class="p-8">Etablissement</th>
+                    <th class="p-8">Secteur</th>
+                    <th class="p-8 text-right">Appels</th>
+                    <th class="p-8 text-right">Derniere Activite</th>
+                </tr>
+            </thead>
+            <tbody class="divide-y divide-slate-100">
+                {% for u in rows %}
+                <tr class="hover:bg-slate-50/80 transition-all">
+                    <td class="p-8 font-mono font-black text-slate-400">#{{ u.id }}</td>
+                    <td class="p-8">
+                        <p class="font-black italic text-xl text-slate-900">{{ u.business_name }}</p>
+                        <p class="text-[10px] text-slate-400 font-mono tracking-widest uppercase mt-1">{{ u.email }}</p>
+                    </td>
+                    <td class="p-8 text-sm font-bold text-slate-500">{{ u.sector }}</td>
+                    <td class="p-8 text-right text-2xl font-black text-indigo-600">{{ u.calls }}</td>
+                    <td class="p-8 text-right text-[11px] font-mono font-black text-slate-400">{{ u.last_activity.strftime('%d/%m/%Y %H:%M') if u.last_activity else 'Aucune activite' }}</td>
+                </tr>
+                {% else %}
+                <tr><td colspan="5" class="p-20 text-center text-2xl font-black text-slate-300 uppercase italic">Aucune licence ne correspond.</td></tr>
+                {% endfor %}
+            </tbody>
+        </table>
+    </div>
+    
+    <div class="flex justify-between items-center mt-12">
+        {% if newer %}
+        <a href="?{{ filters }}&after={{ newer }}" class="bg-white border-2 border-slate-200 px-12 py-5 rounded-[2.5rem] font-black text-[11px] uppercase tracking-widest hover:bg-slate-50 transition shadow-sm"><i class="fas fa-arrow-left mr-3"></i> Precedents</a>
+        {% else %}<span></span>{% endif %}
+        {% if older %}
+        <a href="?{{ filters }}&before={{ older }}" class="bg-slate-900 text-white px-12 py-5 rounded-[2.5rem] font-black text-[11px] uppercase tracking-widest shadow-2xl">Suivants <i class="fas fa-arrow-right ml-3"></i></a>
+        {% endif %}
+    </div>
+    {% endblock %}
+'''
+
+MASTER_LOGS_TEMPLATE = '''{% extends "layout.html" %}
+{% block content %}
+    <div class="flex justify-between items-center mb-16">
+        <div>
+            <h1 class="text-6xl font-black italic uppercase tracking-tighter">Database Master Logs</h1>
+            <p class="text-slate-400 text-lg font-medium mt-2">Derniers evenements du worker #{{ pid }} ({{ retained }} en memoire).</p>
+        </div>
+    </div>
+    
+    <form method="GET" class="glass-card !p-10 mb-12 grid grid-cols-1 md:grid-cols-3 gap-6">
+        <input name="tenant" value="{{ tenant or '' }}" placeholder="Licence (ID)" class="input-pro">
+        <select name="level" class="input-pro">
+            {% for lvl in levels %}
+            <option value="{{ lvl }}" {% if level == lvl %}selected{% endif %}>{{ lvl }}{% if lvl != 'DEBUG' %} et plus{% endif %}</option>
+            {% endfor %}
+        </select>
+        <button type="submit" class="btn-grad !p-5">Filtrer</button>
+    </form>
+    
+    <div class="glass-card !p-0 overflow-hidden shadow-2xl border-none">
+        <table class="w-full text-left border-collapse">
+            <thead class="bg-slate-900 text-white text-[11px] font-black uppercase tracking-[0.3em]">
+                <tr>
+                    <th class="p-8">Horodatage</th>
+                    <th class="p-8">Niveau</th>
+                    <th class="p-8">Evenement</th>
+                    <th class="p-8">Licence</th>
+                    <th class="p-8">Message</th>
+                </tr>
+            </thead>
+            <tbody class="divide-y divide-slate-100">
+                {% for e in events %}
+                <tr class="hover:bg-slate-50/80 transition-all">
+                    <td class="p-8 text-[11px] font-mono font-black text-slate-400">{{ e.ts | log_time }}</td>
+                    <td class="p-8 text-[11px] font-black uppercase tracking-widest {% if e.level in ('ERROR', 'CRITICAL') %}text-red-500{% elif e.level == 'WARNING' %}text-amber-500{% else %}text-slate-400{% endif %}">{{ e.level }}</td>
+                    <td class="p-8 font-black italic text-slate-900">{{ e.event }}</td>
+                    <td class="p-8 font-mono font-black text-slate-400">{% if e.tenant %}#{{ e.tenant }}{% endif %}</td>
+                    <td class="p-8 text-sm font-medium text-slate-600 break-all">{{ e.msg }}</td>
+                </tr>
+                {% else %}
+                <tr><td colspan="5" class="p-20 text-center text-2xl font-black text-slate-300 uppercase italic">Aucun evenement ne correspond.</td></tr>
+                {% endfor %}
+            </tbody>
+        </table>
+    </div>
+    
+    <div class="flex justify-between items-center mt-12">
+        {% if before %}
+        <a href="?{{ filters }}" class="bg-white border-2 border-slate-200 px-12 py-5 rounded-[2.5rem] font-black text-[11px] uppercase tracking-widest hover:bg-slate-50 transition shadow-sm"><i class="fas fa-arrow-left mr-3"></i> Plus recents</a>
+        {% else %}<span></span>{% endif %}
+        {% if older %}
+        <a href="?{{ filters }}&before={{ older }}" class="bg-slate-900 text-white px-12 py-5 rounded-[2.5rem] font-black text-[11px] uppercase tracking-widest shadow-2xl">Plus anciens <i class="fas fa-arrow-right ml-3"></i></a>
+        {% endif %}
+    </div>
+    {% endblock %}
+'''
+
+LOGIN_TEMPLATE = '''{% extends "base.html" %}
+{% block body %}
+    <body class="bg-[#0f172a] flex items-center justify-center h-screen p-10 overflow-hidden">
+        <form method="POST" class="bg-white p-20 rounded-[5rem] w-full max-w-[600px] shadow-2xl animate-fade-in relative">
+            <div class="text-center mb-16">
+                <div class="w-24 h-24 bg-indigo-600 rounded-[2.5rem] flex items-center justify-center mx-auto mb-10 shadow-2xl shadow-indigo-500/40 rotate-3">
+                    <i class="fas fa-shield-halved text-white text-4xl"></i>
+                </div>
+                <h2 class="text-5xl font-black text-slate-900 italic tracking-tighter uppercase mb-3 leading-none">Connexion</h2>
+                <p class="text-slate-400 font-bold uppercase tracking-[0.4em] text-[10px]">Acces Securise SaaS DigitagPro</p>
+            </div>
+            <div class="space-y-8">
+                <div class="relative group">
+                    <i class="fas fa-envelope absolute top-7 left-8 text-slate-400 group-focus-within:text-indigo-600 transition-colors"></i>
+                    <input name="email" type="email" placeholder="Email de Licence Professionnel" class="input-pro pl-20" required>
+                </div>
+                <div class="relative group">
+                    <i class="fas fa-lock absolute top-7 left-8 text-slate-400 group-focus-within:text-indigo-600 transition-colors"></i>
+                    <input name="password" type="password" placeholder="Mot de Passe Securise" class="input-pro pl-20" required>
+                </div>
+                <button type="submit" class="w-full btn-grad p-7 uppercase font-black tracking-[0.2em] text-sm shadow-2xl mt-6">Acceder au Cockpit</button>
+            </div>
+            <p class="text-center mt-16 text-xs text-slate-400 font-bold uppercase tracking-widest">Technologie IA Gen V4.0 Ready</p>
+        </form>
+    </body>{% endblock %}
+'''
+
+REGISTER_TEMPLATE = '''{% extends "base.html" %}
+{% block body %}
+    <body class="bg-slate-50 flex items-center justify-center h-screen p-10">
+        <form method="POST" class="bg-white p-20 rounded-[5rem] w-full max-w-[750px] shadow-2xl border border-slate-100 animate-fade-in">
+            <h2 class="text-5xl font-black text-center uppercase tracking-tighter italic mb-5 leading-none">Nouvelle Licence</h2>
+            <p class="text-center text-slate-400 mb-16 font-medium text-lg leading-relaxed">Initiez votre propre agent vocal intelligent pour votre commerce en quelques secondes.</p>
+            <div class="grid grid-cols-1 md:grid-cols-2 gap-8">
+                <input name="b_name" placeholder="Nom Commercial / Garage / Clinique" class="input-pro col-span-2" required>
+                <input name="sector" placeholder="Secteur d'activite" class="input-pro" required>
+                <input name="email" type="email" placeholder="Email Professionnel" class="input-pro" required>
+                <input name="password" type="password" placeholder="Mot de Passe de Securite" class="input-pro col-span-2" required>
+            </div>
+            <button type="submit" class="w-full btn-grad p-8 mt-12 uppercase font-black tracking-widest text-sm shadow-2xl">Deployer mon infrastructure IA</button>
+            <p class="text-center mt-12 text-[10px] text-slate-400 font-black uppercase tracking-widest italic leading-loose">Hautement Securise - Certifie ISO 27001 - DigitagPro Ecosystem</p>
+        </form>
+    </body>{% endblock %}
+'''
+
+# Registre des gabarits nommés : compilés une seule fois par worker puis servis depuis le cache Jinja.
+# Les données utilisateur sont passées en contexte et ne font jamais partie de la source du gabarit.
+TEMPLATES = {
+    'base.html': BASE_TEMPLATE,
+    'layout.html': LAYOUT_TEMPLATE,
+    'profil.html': PROFIL_TEMPLATE,
+    'dashboard.html': DASHBOARD_TEMPLATE,
+    'config_ia.html': CONFIG_IA_TEMPLATE,
+    'agenda.html': AGENDA_TEMPLATE,
+    'master_admin.html': MASTER_ADMIN_TEMPLATE,
+    'master_clients.html': MASTER_CLIENTS_TEMPLATE,
+    'master_logs.html': MASTER_LOGS_TEMPLATE,
+    'login.html': LOGIN_TEMPLATE,
+    'register.html': REGISTER_TEMPLATE,
+}
+app.jinja_env.loader = ChoiceLoader([DictLoader(TEMPLATES), app.jinja_env.loader])
+app.jinja_env.auto_reload = False
+
+def warm_templates():
+    """Compile tous les gabarits (appelé par warm_up()) : la première page servie ne paie pas la compilation."""
+    for name in TEMPLATES:
+        app.jinja_env.get_template(name)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# PIPELINE D'ASSETS STATIQUES (FINGERPRINT, GZIP PRÉ-CALCULÉ, CACHE IMMUABLE)
+# ----------------------------------------------------------------------------------------------------------------------
+# Au démarrage du worker, chaque fichier de static/ est lu une fois, nommé d'après l'empreinte de son contenu
+# (app.css -> app.3f2a9c1b7d4e.css) et compressé en gzip. Une URL fingerprintée ne change jamais de contenu :
+# elle est servie avec Cache-Control immutable, ETag et réponse 304 sur requête conditionnelle.
+
+ASSET_MAX_AGE = 31536000
+
+Asset = namedtuple('Asset', ['hashed_name', 'body', 'gzipped', 'etag', 'mimetype'])
+
+class AssetPipeline:
+    """Registre des assets statiques fingerprintés, chargés et pré-compressés une seule fois par worker."""
+
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}     # nom logique (css/app.css) -> Asset
+        self.by_hashed = {}  # nom fingerprinté (css/app.3f2a9c1b7d4e.css) -> Asset
+        self.load()
+
+    def load(self):
+        if not os.path.isdir(self.root):
+            return
+        for folder, _dirs, files in os.walk(self.root):
+            for filename in files:
+                path = os.path.join(folder, filename)
+                logical = os.path.relpath(path, self.root).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    body = f.read()
+                digest = hashlib.sha256(body).hexdigest()[:12]
+                stem, ext = os.path.splitext(logical)
+                mimetype = mimetypes.guess_type(logical)[0] or 'application/octet-stream'
+                gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+                asset = Asset(f"{stem}.{digest}{ext}", body, gzipped if len(gzipped) < len(body) else None, f'"{digest}"', mimetype)
+                self.assets[logical] = asset
+                self.by_hashed[asset.hashed_name] = asset
+
+    def url(self, logical):
+        asset = self.assets.get(logical)
+        if asset is None:
+            return url_for('static', filename=logical)
+        return url_for('asset', filename=asset.hashed_name)
+
+assets = AssetPipeline(app.static_folder)
+app.jinja_env.globals['asset_url'] = assets.url
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """Service des assets fingerprintés : gzip pré-calculé si accepté, 304 si le navigateur a déjà la version."""
+    a = assets.by_hashed.get(filename)
+    if a is None:
+        abort(404)
+    headers = {
+        'Cache-Control': f'public, max-age={ASSET_MAX_AGE}, immutable',
+        'ETag': a.etag,
+        'Vary': 'Accept-Encoding',
+    }
+    if a.etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    body = a.body
+    if a.gzipped is not None and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = a.gzipped
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, mimetype=a.mimetype, headers=headers)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# LOGIQUE DES PAGES (ROUTES APPLICATIVES)
+# ----------------------------------------------------------------------------------------------------------------------
+
+app.config['AGENDA_PAGE_SIZE'] = int(os.environ.get('AGENDA_PAGE_SIZE', 25))
+
+def keyset_page(query, key_col, page_size, before=None, after=None):
+    """
+    Pagination par curseur (keyset) du plus récent au plus ancien : WHERE key < curseur ORDER BY key DESC LIMIT n.
+    Le coût d'une page ne dépend que de page_size, jamais de la profondeur. Retourne (lignes, curseur_recent, curseur_ancien).
+    """
+    if after is not None:
+        rows = query.filter(key_col > after).order_by(key_col.asc()).limit(page_size + 1).all()
+        has_more_newer = len(rows) > page_size
+        rows = list(reversed(rows[:page_size]))
+        has_more_older = True
+    else:
+        if before is not None:
+            query = query.filter(key_col < before)
+        rows = query.order_by(key_col.desc()).limit(page_size + 1).all()
+        has_more_older = len(rows) > page_size
+        rows = rows[:page_size]
+        has_more_newer = before is not None
+    key_name = key_col.key
+    newer = getattr(rows[0], key_name) if rows and has_more_newer else None
+    older = getattr(rows[-1], key_name) if rows and has_more_older else None
+    return rows, newer, older
+
+@app.route('/profil', methods=['GET', 'POST'])
+@login_required
+def profil():
+    """Page Profil : Gestion des données légales et coordonnées de l'établissement client."""
+    user = db.session.get(User, current_user.id)
+    if request.method == 'POST':
+        user.business_name = request.form.get('bn')
+        user.email = request.form.get('em')
+        user.phone_pro = request.form.get('ph')
+        user.adresse = request.form.get('ad')
+        bump_context_version(user)
+        db.session.commit()
+        principals.invalidate(user.id)
+        flash("Les donnees de votre etablissement ont ete synchronisees avec succes.")
+
+    return render_template('profil.html', active_page="profil", user=user)
+
+@app.route('/dashboard')
+@login_required
+@read_replica
+def dashboard():
+    """Dashboard : Vue d'ensemble des statistiques d'appels et statut de l'infrastructure IA."""
+    today = datetime.now().strftime("%d %B %Y")
+    # Agrégats calculés côté SQL (index user_id, id) : aucun rendez-vous n'est chargé en mémoire
+    count = db.session.query(func.count(Appointment.id)).filter(Appointment.user_id == current_user.id).scalar()
+    last_call = db.session.query(Appointment.date_str).filter(Appointment.user_id == current_user.id) \
+        .order_by(Appointment.id.desc()).limit(1).scalar() or "Aucune activite"
+    
+    return render_template(
+        'dashboard.html', active_page="dashboard", today=today, count=count, last_call=last_call, speed=response_speed()
+    )
+
+@app.route('/config-ia', methods=['GET', 'POST'])
+@login_required
+def config_ia():
+    """Page Configuration IA : Définition des horaires, tarifs et prompt système."""
+    user = db.session.get(User, current_user.id)
+    if request.method == 'POST':
+        user.horaires = request.form.get('h')
+        user.tarifs = request.form.get('t')
+        user.prompt_personnalise = request.form.get('p')
+        user.ton_ia = request.form.get('ton')
+        bump_context_version(user)
+        db.session.commit()
+        principals.invalidate(user.id)
+        flash("L'intelligence de votre agent vocal a ete synchronisee avec succes.")
+    
+    # Poids de la configuration tel que l'agent l'enverra à chaque tour (après condensation et budget)
+    layout = compile_tenant_context(user).prompt
+    return render_template('config_ia.html', active_page="config", user=user, layout=layout, static_tokens=STATIC_TOKENS)
+
+@app.route('/mon-agenda')
+@login_required
+@read_replica
+def mon_agenda():
+    """Agenda : Historique structuré des appels interceptés et conversions (pagination par curseur sur l'id)."""
+    page_size = max(1, min(request.args.get('limit', app.config['AGENDA_PAGE_SIZE'], type=int), 100))
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    rows, newer, older = keyset_page(
+        Appointment.query.filter(Appointment.user_id == current_user.id), Appointment.id, page_size, before, after
+    )
+    
+    return render_template('agenda.html', active_page="agenda", rows=rows, newer=newer, older=older, page_size=page_size)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# EXPORT CRM (FLUX CSV / NDJSON)
+# ----------------------------------------------------------------------------------------------------------------------
+# Les rendez-vous sont lus par lots via un curseur serveur (yield_per) et écrits au fil de l'eau dans une réponse
+# HTTP chunked : la mémoire reste constante quel que soit le volume exporté. Filtres : ?from=AAAA-MM-JJ&to=AAAA-MM-JJ
+# (date de l'appel, bornes incluses), ?status=..., ?gzip=1 pour un fichier compressé.
+
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 2000))
+
+EXPORT_COLUMNS = [
+    Appointment.id, Appointment.created_at, Appointment.date_str, Appointment.start_at, Appointment.end_at,
+    Appointment.client_name, Appointment.client_phone, Appointment.status, Appointment.details
+]
+
+def _date_arg(name):
+    raw = request.args.get(name)
+    if not raw:
+        return None
+    try:
+        return datetime.strptime(raw, "%Y-%m-%d")
+    except ValueError:
+        abort(400)
+
+def export_query(columns):
+    """SELECT des colonnes exportées, filtré par les paramètres de la requête (400 si une date est invalide)."""
+    stmt = select(*columns)
+    date_from, date_to = _date_arg('from'), _date_arg('to')
+    if date_from:
+        stmt = stmt.where(Appointment.created_at >= date_from)
+    if date_to:
+        stmt = stmt.where(Appointment.created_at < date_to + timedelta(days=1))
+    if request.args.get('status'):
+        stmt = stmt.where(Appointment.status == request.args['status'])
+    return stmt
+
+def _export_value(v):
+    return v.isoformat() if isinstance(v, datetime) else v
+
+def export_rows(stmt, fmt):
+    """Générateur de fragments texte (CSV avec en-tête, ou une ligne JSON par rendez-vous) depuis un curseur serveur."""
+    result = db.session.execute(stmt.execution_options(yield_per=app.config['EXPORT_BATCH_SIZE']))
+    keys = list(result.keys())
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if fmt == 'csv':
+        writer.writerow(keys)
+    for batch in result.partitions():
+        for row in batch:
+            if fmt == 'csv':
+                writer.writerow([_export_value(v) for v in row])
+            else:
+                buf.write(json.dumps(dict(zip(keys, map(_export_value, row))), ensure_ascii=False))
+                buf.write("\n")
+        # Un fragment HTTP par lot : ni ligne à ligne (trop de petits écrits), ni tout d'un bloc
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+def _gzip_stream(chunks):
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 : conteneur gzip
+    for chunk in chunks:
+        data = z.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield z.flush()
+
+def export_response(stmt, fmt, basename):
+    if fmt not in ('csv', 'ndjson'):
+        abort(404)
+    chunks = export_rows(stmt, fmt)
+    filename = f"{basename}-{datetime.now().strftime('%Y%m%d-%H%M')}.{fmt}"
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    if request.args.get('gzip') == '1':
+        chunks, filename, mimetype = _gzip_stream(chunks), filename + '.gz', 'application/gzip'
+    log_event(logging.INFO, "EXPORT", "%s (%s) STREAM STARTED", basename, fmt)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"', 'Cache-Control': 'no-store'}
+    )
+
+@app.route('/mon-agenda/export.<fmt>')
+@login_required
+@read_replica
+def export_agenda(fmt):
+    """Export CRM du tenant connecté."""
+    stmt = export_query(EXPORT_COLUMNS).where(Appointment.user_id == current_user.id).order_by(Appointment.id)
+    return export_response(stmt, fmt, "agenda")
+
+# ----------------------------------------------------------------------------------------------------------------------
+# ADMINISTRATION SYSTÈME ET ACCÈS (AUTH & MASTER)
+# ----------------------------------------------------------------------------------------------------------------------
+
+@app.route('/')
+def home(): 
+    """Redirection vers le point d'entrée sécurisé."""
+    return redirect(url_for('login'))
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    """Authentification sécurisée avec protection contre les attaques par force brute."""
+    if request.method == 'POST':
+        u = User.query.filter_by(email=request.form.get('email')).first()
+        if u and u.password == request.form.get('password'):
+            login_user(u)
+            logger.info(f"AUTH_SUCCESS: Client login verified for {u.email}.")
+            return redirect(url_for('dashboard'))
+        flash("Les identifiants ne sont pas valides pour cette licence DigitagPro.")
+    
+    return render_template('login.html')
+
+@app.route('/register', methods=['GET', 'POST'])
+def register():
+    """Procédure d'onboarding : Création automatisée d'instance client."""
+    if request.method == 'POST':
+        u = User(
+            email=request.form.get('email'), 
+            password=request.form.get('password'), 
+            business_name=request.form.get('b_name'), 
+            sector=request.form.get('sector')
+        )
+        db.session.add(u)
+        db.session.commit()
+        logger.info(f"NEW_LICENSE: A new account has been successfully initialized for {u.business_name}.")
+        return redirect(url_for('login'))
+        
+    return render_template('register.html')
+
+@app.route('/logout')
+def logout(): 
+    """Destruction de la session active."""
+    logout_user()
+    return redirect(url_for('login'))
+
+# ----------------------------------------------------------------------------------------------------------------------
+# CACHE DE CONTEXTE TENANT (PROMPT COMPILÉ PAR LICENCE)
+# ----------------------------------------------------------------------------------------------------------------------
+# Chaque tour vocal a besoin des données métier du client et du prompt système qui en découle.
+# Le contexte est compilé une seule fois par worker puis servi depuis la mémoire ; au-delà de TENANT_CACHE_TTL
+# secondes, un simple SELECT du tampon context_version confirme qu'il est toujours à jour.
+
+app.config['TENANT_CACHE_SIZE'] = int(os.environ.get('TENANT_CACHE_SIZE', 2048))
+app.config['TENANT_CACHE_TTL'] = float(os.environ.get('TENANT_CACHE_TTL', 30))
+
+TenantContext = namedtuple('TenantContext', [
+    'id', 'business_name', 'sector', 'horaires', 'tarifs', 'duree_moyenne', 'adresse',
+    'prompt_personnalise', 'voix_preferee', 'ton_ia', 'version', 'prompt', 'intents'
+])
+
+def compile_tenant_context(u):
+    """Fige les données d'un User en un contexte immuable : message de données du prompt et lexique des réponses locales."""
+    ctx = TenantContext(
+        id=u.id, business_name=u.business_name, sector=u.sector, horaires=u.horaires, tarifs=u.tarifs,
+        duree_moyenne=u.duree_moyenne, adresse=u.adresse, prompt_personnalise=u.prompt_personnalise,
+        voix_preferee=u.voix_preferee, ton_ia=u.ton_ia, version=u.context_version or 0, prompt=None, intents=None
+    )
+    return ctx._replace(
+        prompt=build_tenant_prompt(ctx, app.config['PROMPT_TENANT_BUDGET']), intents=compile_tenant_intents(ctx)
+    )
+
+class TenantContextCache:
+    """Cache LRU des contextes tenant, validé par tampon de version avec une fenêtre d'obsolescence bornée."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (TenantContext, instant de la dernière validation)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Retourne le contexte du tenant, ou None si la licence n'existe pas."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+                if now - entry[1] < self.ttl:
+                    return entry[0]
+        
+        if entry is not None:
+            # Revalidation légère : seul le tampon de version est relu
+            version = db.session.execute(
+                text('SELECT context_version FROM "user" WHERE id = :id'), {"id": user_id}
+            ).scalar()
+            if version == entry[0].version:
+                self._store(user_id, entry[0], now)
+                return entry[0]
+        
+        u = db.session.get(User, user_id)
+        if u is None:
+            self.invalidate(user_id)
+            return None
+        ctx = compile_tenant_context(u)
+        self._store(user_id, ctx, now)
+        return ctx
+
+    def peek(self, user_id):
+        """Contexte encore dans sa fenêtre de validité, sans aucun accès à la base ; None sinon."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.monotonic() - entry[1] >= self.ttl:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[0]
+
+    def _store(self, user_id, ctx, now):
+        with self._lock:
+            self._entries[user_id] = (ctx, now)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+tenant_contexts = TenantContextCache(app.config['TENANT_CACHE_SIZE'], app.config['TENANT_CACHE_TTL'])
+
+def bump_context_version(u):
+    """A appeler avant le commit d'une modification du tenant : les autres workers la verront au plus tard après le TTL."""
+    u.context_version = (u.context_version or 0) + 1
+    tenant_contexts.invalidate(u.id)
+    answer_cache.invalidate(u.id)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# STOCKAGE PARTAGÉ CLÉ/VALEUR (MÉMOIRE LOCALE, TABLE SQL OU SERVEUR REDIS)
+# ----------------------------------------------------------------------------------------------------------------------
+# Trois backends interchangeables exposant get/set/delete avec expiration. 'memory' ne vaut que pour un worker unique ;
+# 'sql' et 'redis' permettent à n'importe quel worker, sur n'importe quel noeud, de reprendre l'état d'un appel.
+
+app.config['REDIS_URL'] = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+class MemoryStore:
+    """Backend en mémoire du processus : LRU borné avec expiration par entrée."""
+
+    blocking = False  # Réponse immédiate : appelable directement depuis la boucle d'événements
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._data = OrderedDict()  # key -> (value, échéance monotonic)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def add(self, key, value, ttl):
+        """Écrit la clé seulement si elle est absente (ou expirée) ; True si l'écriture a eu lieu."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return False
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+class SQLStore:
+    """Backend SQL via la table kv_store : partagé par tous les workers connectés à la même base."""
+
+    blocking = True
+
+    def get(self, key):
+        entry = db.session.get(KVEntry, key)
+        if entry is None:
+            return None
+        if entry.expires_at and entry.expires_at <= datetime.utcnow():
+            db.session.delete(entry)
+            db.session.commit()
+            return None
+        return entry.value
+
+    def set(self, key, value, ttl):
+        db.session.merge(KVEntry(key=key, value=value, expires_at=datetime.utcnow() + timedelta(seconds=ttl)))
+        # Purge opportuniste des entrées expirées (environ une écriture sur cent)
+        if random.random() < 0.01:
+            KVEntry.query.filter(KVEntry.expires_at <= datetime.utcnow()).delete()
+        db.session.commit()
+
+    def add(self, key, value, ttl):
+        # get() purge une entrée expirée : la clé primaire arbitre ensuite entre workers concurrents
+        if self.get(key) is not None:
+            return False
+        db.session.add(KVEntry(key=key, value=value, expires_at=datetime.utcnow() + timedelta(seconds=ttl)))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return False
+        return True
+
+    def delete(self, key):
+        KVEntry.query.filter_by(key=key).delete()
+        db.session.commit()
+
+class RedisStore:
+    """
+    Backend Redis minimal parlant directement le protocole RESP (aucune dépendance supplémentaire).
+    Compatible avec tout serveur parlant ce protocole (Redis, Valkey, KeyDB ou un substitut local).
+    """
+
+    blocking = True
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db_index = int((parsed.path or '/0').lstrip('/') or 0)
+        self._local = threading.local()
+        # Connexion par thread : un worker issu d'un fork ne réutilise jamais la socket du maître
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock_ = socket.create_connection((self.host, self.port), timeout=2.0)
+            conn = (sock_, sock_.makefile('rb'))
+            self._local.conn = conn
+            if self.password:
+                self.command('AUTH', self.password)
+            if self.db_index:
+                self.command('SELECT', self.db_index)
+        return conn
+
+    def command(self, *args):
+        """Envoie une commande RESP et retourne la réponse décodée ; la connexion est rouverte après une erreur réseau."""
+        payload = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            payload.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        try:
+            sock_, reader = self._connection()
+            sock_.sendall(b"".join(payload))
+            return self._read(reader)
+        except OSError:
+            self._local.conn = None
+            raise
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Connexion Redis fermée")
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body.decode()
+        if kind == b'-':
+            raise RuntimeError(body.decode())
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            size = int(body)
+            if size < 0:
+                return None
+            data = reader.read(size + 2)[:-2]
+            return data.decode()
+        if kind == b'*':
+            size = int(body)
+            return None if size < 0 else [self._read(reader) for _ in range(size)]
+        raise RuntimeError(f"Réponse RESP inattendue : {line!r}")
+
+    def get(self, key):
+        return self.command('GET', key)
+
+    def set(self, key, value, ttl):
+        self.command('SET', key, value, 'EX', max(1, int(ttl)))
+
+    def add(self, key, value, ttl):
+        return self.command('SET', key, value, 'EX', max(1, int(ttl)), 'NX') == 'OK'
+
+    def delete(self, key):
+        self.command('DEL', key)
+
+def make_store(kind):
+    """Fabrique du backend de stockage partagé ('memory', 'sql' ou 'redis')."""
+    if kind == 'memory':
+        return MemoryStore()
+    if kind == 'sql':
+        return SQLStore()
+    if kind == 'redis':
+        return RedisStore(app.config['REDIS_URL'])
+    raise ValueError(f"Backend de stockage inconnu : {kind}")
+
+# ----------------------------------------------------------------------------------------------------------------------
+# MÉMOIRE CONVERSATIONNELLE PAR APPEL (CLÉ : CALLSID TWILIO)
+# ----------------------------------------------------------------------------------------------------------------------
+# L'historique de chaque appel est borné par un budget de tokens : au-delà, les échanges les plus anciens sont
+# condensés dans un résumé. Le modèle suit ainsi une prise de rendez-vous sur plusieurs tours sans que le coût
+# d'un tour ne croisse avec la durée de l'appel.
+
+app.config['CONVERSATION_BACKEND'] = os.environ.get('CONVERSATION_BACKEND', 'memory')
+app.config['CONVERSATION_TOKEN_BUDGET'] = int(os.environ.get('CONVERSATION_TOKEN_BUDGET', 600))
+app.config['CONVERSATION_TTL'] = int(os.environ.get('CONVERSATION_TTL', 1800))
+
+def estimate_tokens(txt):
+    """Estimation locale et rapide du nombre de tokens (environ 4 caractères par token en français)."""
+    return len(txt) // 4 + 1 if txt else 0
+
+class ConversationStore:
+    """Historique compact des tours d'un appel, sérialisé en JSON dans un backend partagé."""
+
+    def __init__(self, backend, token_budget, ttl):
+        self.backend = backend
+        self.token_budget = token_budget
+        self.ttl = ttl
+
+    def load(self, call_sid):
+        """Retourne l'état {'summary': str, 'turns': [[question, reponse], ...], 'n': tours joués} de l'appel."""
+        if not call_sid:
+            return {"summary": "", "turns": []}
+        raw = self.backend.get(f"conv:{call_sid}")
+        return json.loads(raw) if raw else {"summary": "", "turns": []}
+
+    def messages(self, state):
+        """Convertit l'état en messages chat à insérer entre le prompt système et la question courante."""
+        msgs = []
+        if state["summary"]:
+            msgs.append({"role": "system", "content": f"Résumé du début de l'appel : {state['summary']}"})
+        for question, answer in state["turns"]:
+            msgs.append({"role": "user", "content": question})
+            msgs.append({"role": "assistant", "content": answer})
+        return msgs
+
+    def append(self, call_sid, question, answer):
+        """Ajoute un tour puis compacte l'historique s'il dépasse le budget."""
+        if not call_sid:
+            return
+        state = self.load(call_sid)
+        state["turns"].append([question, answer])
+        state["n"] = state.get("n", 0) + 1  # Numéro de tour stable, contrairement à turns (compacté)
+        self._compact(state)
+        self.backend.set(f"conv:{call_sid}", json.dumps(state, ensure_ascii=False), self.ttl)
+
+    def _compact(self, state):
+        def weight():
+            return estimate_tokens(state["summary"]) + sum(estimate_tokens(q) + estimate_tokens(a) for q, a in state["turns"])
+        
+        while weight() > self.token_budget and len(state["turns"]) > 1:
+            question, answer = state["turns"].pop(0)
+            state["summary"] = f"{state['summary']} Client: {question[:80]} / Agent: {answer[:120]}".strip()
+        # Le résumé lui-même reste plafonné au tiers du budget : on conserve les faits les plus récents
+        max_chars = self.token_budget * 4 // 3
+        if len(state["summary"]) > max_chars:
+            state["summary"] = "..." + state["summary"][-max_chars:]
+
+    def end(self, call_sid):
+        if call_sid:
+            self.backend.delete(f"conv:{call_sid}")
+
+conversations = ConversationStore(
+    make_store(app.config['CONVERSATION_BACKEND']),
+    app.config['CONVERSATION_TOKEN_BUDGET'],
+    app.config['CONVERSATION_TTL']
+)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# CACHE DE RÉPONSES IA PAR TENANT (QUESTIONS RÉCURRENTES DES APPELANTS)
+# ----------------------------------------------------------------------------------------------------------------------
+# Horaires, prix d'une coupe, adresse : les mêmes questions reviennent d'un appel à l'autre. Les réponses aux
+# questions posées hors contexte (premier échange d'un appel) sont réutilisées pour les formulations proches,
+# détectées par similarité de trigrammes de caractères. Le cache d'un tenant est vidé dès que son contexte change.
+
+app.config['ANSWER_CACHE_ENABLED'] = os.environ.get('ANSWER_CACHE_ENABLED', '1') == '1'
+app.config['ANSWER_CACHE_SIZE'] = int(os.environ.get('ANSWER_CACHE_SIZE', 200))
+app.config['ANSWER_CACHE_TENANTS'] = int(os.environ.get('ANSWER_CACHE_TENANTS', 1000))
+app.config['ANSWER_CACHE_TTL'] = float(os.environ.get('ANSWER_CACHE_TTL', 3600))
+app.config['ANSWER_CACHE_SIMILARITY'] = float(os.environ.get('ANSWER_CACHE_SIMILARITY', 0.78))
+
+_FILLER_WORDS = {"bonjour", "bonsoir", "allo", "euh", "alors", "oui", "svp", "merci", "madame", "monsieur", "dites", "moi"}
+
+def normalize_utterance(txt, drop_fillers=True):
+    """Forme canonique d'une question : minuscules, sans accents, ponctuation ni (par défaut) mots de politesse."""
+    txt = unicodedata.normalize('NFKD', txt.lower())
+    txt = "".join(ch for ch in txt if not unicodedata.combining(ch))
+    words = re.findall(r"[a-z0-9]+", txt)
+    return " ".join(w for w in words if not drop_fillers or w not in _FILLER_WORDS)
+
+def char_ngrams(key, n=3):
+    padded = f" {key} "
+    return frozenset(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+
+class _TenantAnswers:
+    """Réponses d'un tenant : LRU clé normalisée -> (réponse, trigrammes, échéance) plus index inversé des trigrammes."""
+
+    def __init__(self, version):
+        self.version = version
+        self.entries = OrderedDict()
+        self.index = {}
+
+    def remove(self, key):
+        _answer, grams, _expires = self.entries.pop(key)
+        for gram in grams:
+            bucket = self.index.get(gram)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.index[gram]
+
+class AnswerCache:
+    """Cache des réponses LLM cloisonné par tenant, avec recherche par similarité et compteurs hit/miss."""
+
+    def __init__(self, max_entries, max_tenants, ttl, similarity):
+        self.max_entries = max_entries
+        self.max_tenants = max_tenants
+        self.ttl = ttl
+        self.similarity = similarity
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def _bucket(self, ctx, create=False):
+        bucket = self._tenants.get(ctx.id)
+        if bucket is not None and bucket.version != ctx.version:
+            # Horaires, tarifs ou instructions modifiés : toutes les réponses du tenant sont obsolètes
+            del self._tenants[ctx.id]
+            bucket = None
+        if bucket is None and create:
+            bucket = self._tenants[ctx.id] = _TenantAnswers(ctx.version)
+            while len(self._tenants) > self.max_tenants:
+                self._tenants.popitem(last=False)
+        if bucket is not None:
+            self._tenants.move_to_end(ctx.id)
+        return bucket
+
+    def lookup(self, ctx, txt):
+        key = normalize_utterance(txt)
+        if not key:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(ctx)
+            if bucket is not None:
+                entry = bucket.entries.get(key)
+                if entry is not None and entry[2] > now:
+                    bucket.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                best = self._nearest(bucket, key, now)
+                if best is not None:
+                    self.near_hits += 1
+                    return best
+            self.misses += 1
+            return None
+
+    def _nearest(self, bucket, key, now):
+        grams = char_ngrams(key)
+        overlap = Counter()
+        for gram in grams:
+            for candidate in bucket.index.get(gram, ()):
+                overlap[candidate] += 1
+        best_key, best_score = None, 0.0
+        for candidate, inter in overlap.items():
+            cand_grams = bucket.entries[candidate][1]
+            score = inter / (len(grams) + len(cand_grams) - inter)
+            if score > best_score:
+                best_key, best_score = candidate, score
+        if best_key is None or best_score < self.similarity:
+            return None
+        answer, _grams, expires = bucket.entries[best_key]
+        if expires <= now:
+            bucket.remove(best_key)
+            return None
+        return answer
+
+    def store(self, ctx, txt, answer):
+        # Une réponse de prise de rendez-vous est propre à un appelant : jamais réutilisée
+        if not answer or CONFIRMATION_TAG in answer:
+            return
+        key = normalize_utterance(txt)
+        if not key:
+            return
+        with self._lock:
+            bucket = self._bucket(ctx, create=True)
+            if key in bucket.entries:
+                bucket.remove(key)
+            grams = char_ngrams(key)
+            bucket.entries[key] = (answer, grams, time.monotonic() + self.ttl)
+            for gram in grams:
+                bucket.index.setdefault(gram, set()).add(key)
+            while len(bucket.entries) > self.max_entries:
+                bucket.remove(next(iter(bucket.entries)))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._tenants.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "near_hits": self.near_hits, "misses": self.misses,
+                    "tenants": len(self._tenants), "entries": sum(len(b.entries) for b in self._tenants.values())}
+
+answer_cache = AnswerCache(
+    app.config['ANSWER_CACHE_SIZE'],
+    app.config['ANSWER_CACHE_TENANTS'],
+    app.config['ANSWER_CACHE_TTL'],
+    app.config['ANSWER_CACHE_SIMILARITY']
+)
+
+def cacheable_turn(state):
+    """Seules les questions posées sans historique d'appel ont une réponse indépendante de l'appelant."""
+    return app.config['ANSWER_CACHE_ENABLED'] and not state["turns"] and not state["summary"]
+
+# ----------------------------------------------------------------------------------------------------------------------
+# PERSISTANCE DIFFÉRÉE DES RENDEZ-VOUS (WRITE-BEHIND HORS DU CHEMIN CRITIQUE DE L'APPEL)
+# ----------------------------------------------------------------------------------------------------------------------
+# Le webhook vocal ne paie plus le COMMIT SQL : les rendez-vous confirmés sont déposés dans une file bornée,
+# vidée par un thread d'écriture qui regroupe les insertions en commits multi-lignes. Si la base est indisponible,
+# les lots sont rejoués avec backoff puis déversés dans un fichier spool local, relu dès qu'un lot passe à nouveau
+# (et sinon à intervalle croissant, de WRITE_REPLAY_BACKOFF à WRITE_REPLAY_BACKOFF_MAX secondes).
+# Mode opt-in (WRITE_BEHIND_ENABLED=1) : l'appelant entend « rendez-vous enregistré » avant le COMMIT, et un
+# rendez-vous encore en file ou dans le spool d'un disque éphémère est perdu si le worker disparaît. Par défaut, les
+# rendez-vous en texte libre sont écrits en direct ; les créneaux horodatés passent toujours par la réservation
+# atomique de l'agenda, jamais par cette file.
+
+app.config['WRITE_BEHIND_ENABLED'] = os.environ.get('WRITE_BEHIND_ENABLED', '0') == '1'
+app.config['WRITE_QUEUE_SIZE'] = int(os.environ.get('WRITE_QUEUE_SIZE', 5000))
+app.config['WRITE_BATCH_SIZE'] = int(os.environ.get('WRITE_BATCH_SIZE', 100))
+app.config['WRITE_LINGER'] = float(os.environ.get('WRITE_LINGER', 0.05))
+app.config['WRITE_MAX_RETRIES'] = int(os.environ.get('WRITE_MAX_RETRIES', 4))
+app.config['WRITE_SPOOL_PATH'] = os.environ.get('WRITE_SPOOL_PATH', 'appointments.spool')
+app.config['WRITE_REPLAY_BACKOFF'] = float(os.environ.get('WRITE_REPLAY_BACKOFF', 1.0))
+app.config['WRITE_REPLAY_BACKOFF_MAX'] = float(os.environ.get('WRITE_REPLAY_BACKOFF_MAX', 60.0))
+
+class AppointmentWriter:
+    """File d'écriture différée des rendez-vous avec lots, retry exponentiel et spool disque."""
+
+    def __init__(self, max_size, batch_size, linger, max_retries, spool_path, replay_backoff=1.0, replay_backoff_max=60.0):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.linger = linger
+        self.max_retries = max_retries
+        self.spool_path = spool_path
+        self.replay_backoff = replay_backoff
+        self.replay_backoff_max = replay_backoff_max
+        self._replay_delay = replay_backoff
+        self._replay_at = 0.0  # Instant (monotonic) à partir duquel le spool peut être relu
+        self._spool_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.written = 0
+        self.spooled = 0
+        self.failed_batches = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    def enqueue(self, row):
+        """Dépose un rendez-vous (dict de colonnes) sans jamais bloquer l'appel ; file pleine = spool disque."""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            log_event(logging.WARNING, "WRITE_BEHIND", "QUEUE FULL - APPOINTMENT SPOOLED TO DISK")
+            self._spool([row])
+
+    def _ensure_started(self):
+        # Démarrage paresseux et par processus : un thread hérité d'un fork gunicorn n'existe plus dans l'enfant
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="appointment-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        with app.app_context():
+            self._replay_spool()
+            while not self._stop.is_set() or not self.queue.empty():
+                batch = self._next_batch()
+                if batch:
+                    self._flush(batch)
+                if time.monotonic() >= self._replay_at:
+                    self._replay_spool()
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch, retries=None):
+        """Insère un lot en un seul commit ; après épuisement des tentatives, le lot part dans le spool."""
+        retries = self.max_retries if retries is None else retries
+        delay = 0.2
+        for attempt in range(retries + 1):
+            started = time.perf_counter()
+            try:
+                db.session.add_all([Appointment(**_row_to_columns(row)) for row in batch])
+                db.session.commit()
+                self.last_flush_ms = (time.perf_counter() - started) * 1000
+                self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+                self.written += len(batch)
+                log_event(logging.INFO, "DATABASE_SYNC", "%d APPOINTMENT(S) SAVED IN %.1f MS.", len(batch), self.last_flush_ms)
+                # La base répond de nouveau : le spool peut être relu sans attendre
+                self._replay_at = 0.0
+                return True
+            except IntegrityError:
+                # Un rendez-vous du lot existe déjà (webhook rejoué) : insertion ligne à ligne, doublons ignorés
+                db.session.rollback()
+                self.written += self._insert_each(batch)
+                return True
+            except Exception as e:
+                db.session.rollback()
+                log_event(logging.ERROR, "WRITE_BEHIND", "BATCH COMMIT FAILED (ATTEMPT %d): %s", attempt + 1, e)
+                if attempt < retries and not self._stop.is_set():
+                    time.sleep(delay)
+                    delay = min(delay * 2, 5.0)
+        self.failed_batches += 1
+        self._spool(batch)
+        self._defer_replay()
+        return False
+
+    def _defer_replay(self):
+        # Base indisponible : relecture du spool repoussée, délai doublé à chaque échec
+        self._replay_at = time.monotonic() + self._replay_delay
+        self._replay_delay = min(self._replay_delay * 2, self.replay_backoff_max)
+
+    def _insert_each(self, rows):
+        inserted = 0
+        for row in rows:
+            if insert_appointment(Appointment(**_row_to_columns(row))):
+                inserted += 1
+        return inserted
+
+    def _spool(self, rows):
+        with self._spool_lock:
+            with open(self.spool_path, 'a', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.spooled += len(rows)
+
+    def _replay_spool(self):
+        """Réinjecte le spool disque en base ; le fichier est renommé pendant la relecture pour rester atomique."""
+        with self._spool_lock:
+            if not os.path.exists(self.spool_path):
+                return
+            replay_path = f"{self.spool_path}.{os.getpid()}.replay"
+            os.replace(self.spool_path, replay_path)
+        with open(replay_path, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        os.remove(replay_path)
+        for i in range(0, len(rows), self.batch_size):
+            if not self._flush(rows[i:i + self.batch_size], retries=0):
+                # Base toujours indisponible : le reste retourne au spool pour la prochaine tentative
+                self._spool(rows[i + self.batch_size:])
+                break
+        else:
+            self._replay_delay = self.replay_backoff
+            if rows:
+                log_event(logging.INFO, "WRITE_BEHIND", "%d SPOOLED APPOINTMENT(S) REPLAYED.", len(rows))
+
+    def shutdown(self, timeout=10.0):
+        """Vidage à l'arrêt du worker : tout ce qui est en file est écrit ou, à défaut, déversé dans le spool."""
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout)
+        leftovers = []
+        while True:
+            try:
+                leftovers.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftovers:
+            self._spool(leftovers)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "written": self.written,
+            "spooled": self.spooled,
+            "failed_batches": self.failed_batches,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
+
+def _row_to_columns(row):
+    cols = dict(row)
+    if isinstance(cols.get('created_at'), str):
+        cols['created_at'] = datetime.fromisoformat(cols['created_at'])
+    return cols
+
+appointment_writer = AppointmentWriter(
+    app.config['WRITE_QUEUE_SIZE'],
+    app.config['WRITE_BATCH_SIZE'],
+    app.config['WRITE_LINGER'],
+    app.config['WRITE_MAX_RETRIES'],
+    app.config['WRITE_SPOOL_PATH'],
+    app.config['WRITE_REPLAY_BACKOFF'],
+    app.config['WRITE_REPLAY_BACKOFF_MAX']
+)
+atexit.register(appointment_writer.shutdown)
+
+def insert_appointment(appointment):
+    """Insère un rendez-vous ; False si son turn_key existe déjà (doublon écarté par la contrainte d'unicité)."""
+    db.session.add(appointment)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        metrics.inc('appointment_duplicates_total')
+        log_event(logging.INFO, "DATABASE_SYNC", "DUPLICATE APPOINTMENT IGNORED (TURN %s).", appointment.turn_key,
+                  tenant=appointment.user_id)
+        return False
+    return True
+
+def save_appointment(**cols):
+    """Enregistre un rendez-vous : via la file d'écriture différée, ou en direct si elle est désactivée."""
+    if app.config['WRITE_BEHIND_ENABLED']:
+        cols.setdefault('created_at', datetime.utcnow().isoformat())
+        appointment_writer.enqueue(cols)
+        return
+    if insert_appointment(Appointment(**_row_to_columns(cols))):
+        log_event(logging.INFO, "DATABASE_SYNC", "NEW APPOINTMENT SAVED SUCCESSFULLY.", tenant=cols.get('user_id'))
+
+@app.route('/healthz')
+def healthz():
+    """Sonde de supervision : file d'écriture différée, santé de la passerelle LLM et occupation des pools SQL."""
+    return jsonify(
+        status="ok",
+        write_behind=appointment_writer.stats(),
+        llm=llm.stats(),
+        agenda=availability.stats(),
+        voice_turns=deferred_turns.stats(),
+        speculation=speculator.stats(),
+        webhooks=webhook_replays.stats(),
+        admission=admission.stats(),
+        db={key or 'primary': engine.pool.status() for key, engine in db.engines.items()}
+    )
+
+# ----------------------------------------------------------------------------------------------------------------------
+# AGENDA STRUCTURÉ (CRÉNEAUX HORODATÉS ET MOTEUR DE DISPONIBILITÉS)
+# ----------------------------------------------------------------------------------------------------------------------
+# Chaque rendez-vous porte start_at / end_at (UTC) : l'heure est lue dans la balise CONFIRMATION, la durée vient de
+# duree_moyenne. Par tenant, un index trié des fenêtres d'ouverture (parsées depuis horaires) et des réservations à
+# venir répond par dichotomie à « ce créneau est-il libre ? » et « quels sont les prochains créneaux libres ? ».
+# La base reste l'arbitre : l'insertion est conditionnelle (INSERT ... SELECT WHERE NOT EXISTS) et, sur Postgres,
+# précédée d'un verrou de la ligne tenant, si bien que deux appels simultanés ne peuvent pas réserver le même créneau.
+
+app.config['BUSINESS_TIMEZONE'] = os.environ.get('BUSINESS_TIMEZONE', 'Europe/Paris')
+app.config['AVAILABILITY_HORIZON_DAYS'] = int(os.environ.get('AVAILABILITY_HORIZON_DAYS', 14))
+app.config['AVAILABILITY_TTL'] = float(os.environ.get('AVAILABILITY_TTL', 30))
+app.config['AVAILABILITY_SUGGESTIONS'] = int(os.environ.get('AVAILABILITY_SUGGESTIONS', 5))
+
+BUSINESS_TZ = ZoneInfo(app.config['BUSINESS_TIMEZONE'])
+DEFAULT_SLOT_MINUTES = 30
+
+JOURS = ['lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi', 'dimanche']
+MOIS = ['janvier', 'février', 'mars', 'avril', 'mai', 'juin', 'juillet', 'août', 'septembre', 'octobre', 'novembre', 'décembre']
+
+def _fold(txt):
+    """Minuscules sans accents, ponctuation conservée (les heures et dates en ont besoin)."""
+    txt = unicodedata.normalize('NFKD', (txt or '').lower())
+    return "".join(ch for ch in txt if not unicodedata.combining(ch))
+
+_DAY_RE = '|'.join(JOURS)
+_MONTH_RE = '|'.join(_fold(m) for m in MOIS)
+_CLOCK_RE = r"(\d{1,2})\s*(?:h|:)\s*(\d{2})?"
+_HORAIRES_TOKEN = re.compile(
+    rf"(?P<d1>{_DAY_RE})s?\s*(?:-|–|au|a)\s*(?P<d2>{_DAY_RE})s?"
+    rf"|(?P<day>\b(?:{_DAY_RE})s?\b)"
+    r"|(?P<all>tous les jours|7j/7|7 jours sur 7)"
+    rf"|(?P<t1>{_CLOCK_RE})\s*(?:-|–|jusqu'a|au|a)\s*(?P<t2>{_CLOCK_RE})"
+    r"|(?P<closed>ferme)"
+)
+_CLOCK = re.compile(rf"(?<![\d/]){_CLOCK_RE}(?![\d/])")
+_ISO_SLOT = re.compile(r"(\d{4})-(\d{2})-(\d{2})[ t](\d{1,2})[:h](\d{2})")
+_DMY = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b")
+_DAY_MONTH = re.compile(rf"\b(\d{{1,2}})(?:er)?\s+({_MONTH_RE})(?:\s+(\d{{4}}))?")
+
+def _clock_minutes(match_text):
+    m = re.match(_CLOCK_RE, match_text.strip())
+    return int(m.group(1)) * 60 + int(m.group(2) or 0)
+
+def parse_horaires(txt):
+    """
+    Texte libre des horaires -> {jour (0 = lundi): [(début, fin) en minutes]}.
+    Comprend « Lundi au Vendredi: 09h00 - 18h00 », « Lundi-Vendredi: 9h-12h et 14h-18h, Samedi: 10h-16h »,
+    « Dimanche fermé ». Des heures sans jour s'appliquent du lundi au vendredi. Dict vide si rien n'est lisible.
+    """
+    week = {}
+    days, attached = [], False
+    for m in _HORAIRES_TOKEN.finditer(_fold(txt)):
+        if m.group('t1'):
+            start, end = _clock_minutes(m.group('t1')), _clock_minutes(m.group('t2'))
+            if end <= start or end > 24 * 60:
+                continue
+            for d in days or range(5):
+                week.setdefault(d, []).append((start, end))
+            attached = True
+            continue
+        if m.group('closed'):
+            days, attached = [], True
+            continue
+        if m.group('d1'):
+            a, b = JOURS.index(m.group('d1')), JOURS.index(m.group('d2'))
+            new = [(a + i) % 7 for i in range((b - a) % 7 + 1)]
+        elif m.group('day'):
+            new = [JOURS.index(m.group('day').rstrip('s'))]
+        else:
+            new = list(range(7))
+        if attached:
+            days, attached = [], False
+        days.extend(new)
+    
+    for d, windows in week.items():
+        merged = []
+        for start, end in sorted(windows):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        week[d] = merged
+    return week
+
+def parse_duration(txt):
+    """« 30 minutes », « 45 min », « 1h », « 1h30 » -> minutes ; DEFAULT_SLOT_MINUTES si illisible."""
+    t = _fold(txt)
+    m = re.search(r"(\d+)\s*h(?:eures?)?\s*(\d{1,2})?", t)
+    if m:
+        minutes = int(m.group(1)) * 60 + int(m.group(2) or 0)
+    else:
+        m = re.search(r"(\d+)\s*min", t)
+        minutes = int(m.group(1)) if m else DEFAULT_SLOT_MINUTES
+    return max(5, minutes)
+
+def parse_slot(details, now):
+    """
+    Date et heure locales du rendez-vous annoncé dans la balise CONFIRMATION, ou None si introuvable.
+    Le format AAAA-MM-JJ HH:MM demandé au modèle est prioritaire ; sinon : « 14/10 », « 14 octobre », « demain »,
+    « mardi » (prochaine occurrence) suivis d'une heure « 15h30 », « 9h », « 14:00 » ou « midi ».
+    """
+    t = _fold(details)
+    try:
+        m = _ISO_SLOT.search(t)
+        if m:
+            y, mo, d, h, mi = (int(x) for x in m.groups())
+            return datetime(y, mo, d, h, mi, tzinfo=BUSINESS_TZ)
+        
+        today = now.date()
+        day = None
+        m = _DMY.search(t) or _DAY_MONTH.search(t)
+        if m:
+            d = int(m.group(1))
+            mo = int(m.group(2)) if m.group(2).isdigit() else [_fold(x) for x in MOIS].index(m.group(2)) + 1
+            y = int(m.group(3)) if m.group(3) else today.year
+            if y < 100:
+                y += 2000
+            day = datetime(y, mo, d).date()
+            if not m.group(3) and day < today:
+                day = day.replace(year=y + 1)
+        elif 'apres-demain' in t or 'apres demain' in t:
+            day = today + timedelta(days=2)
+        elif 'demain' in t:
+            day = today + timedelta(days=1)
+        elif 'aujourd' in t:
+            day = today
+        
+        m = _CLOCK.search(t)
+        if m:
+            hour, minute = int(m.group(1)), int(m.group(2) or 0)
+        elif 'midi' in t:
+            hour, minute = 12, 0
+        else:
+            return None
+        
+        if day is None:
+            wd = next((JOURS.index(w) for w in re.findall(rf"\b({_DAY_RE})\b", t)), None)
+            if wd is None:
+                return None
+            day = today + timedelta(days=(wd - today.weekday()) % 7)
+            if datetime(day.year, day.month, day.day, hour, minute, tzinfo=BUSINESS_TZ) <= now:
+                day += timedelta(days=7)
+        return datetime(day.year, day.month, day.day, hour, minute, tzinfo=BUSINESS_TZ)
+    except ValueError:
+        return None
+
+def format_slot(dt):
+    """Créneau tel qu'il sera prononcé : « mardi 14 octobre à 10h00 »."""
+    dt = dt.astimezone(BUSINESS_TZ)
+    return f"{JOURS[dt.weekday()]} {dt.day} {MOIS[dt.month - 1]} à {dt.hour}h{dt.minute:02d}"
+
+def _epoch(dt):
+    # SQLite rend des datetimes naïfs : ce sont des instants UTC
+    return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+
+def _local_midnight(day):
+    return datetime(day.year, day.month, day.day, tzinfo=BUSINESS_TZ)
+
+class TenantAgenda:
+    """
+    Index de disponibilité d'un tenant : fenêtres d'ouverture par jour de semaine et réservations fusionnées en
+    intervalles disjoints, triés (secondes epoch). Vérifier un créneau coûte une recherche dichotomique.
+    """
+
+    def __init__(self, version, week, duration, intervals):
+        self.version = version
+        self.week = week
+        self.duration = duration
+        self.built_at = time.monotonic()
+        self.starts = []
+        self.ends = []
+        self._lock = threading.Lock()
+        for s, e in sorted(intervals):
+            self._append(s, e)
+
+    def _append(self, s, e):
+        if self.ends and s <= self.ends[-1]:
+            self.ends[-1] = max(self.ends[-1], e)
+        else:
+            self.starts.append(s)
+            self.ends.append(e)
+
+    def conflict_end(self, s, e):
+        """Fin de la réservation qui chevauche [s, e), ou None si le créneau est libre."""
+        i = bisect.bisect_right(self.starts, s) - 1
+        if i >= 0 and self.ends[i] > s:
+            return self.ends[i]
+        if i + 1 < len(self.starts) and self.starts[i + 1] < e:
+            return self.ends[i + 1]
+        return None
+
+    def add(self, s, e):
+        with self._lock:
+            i = bisect.bisect_left(self.starts, s)
+            # Absorbe le voisin de gauche et ceux de droite qui chevauchent, pour garder des intervalles disjoints
+            if i > 0 and self.ends[i - 1] >= s:
+                i -= 1
+                s = self.starts[i]
+                e = max(e, self.ends[i])
+            j = i
+            while j < len(self.starts) and self.starts[j] <= e:
+                e = max(e, self.ends[j])
+                j += 1
+            self.starts[i:j] = [s]
+            self.ends[i:j] = [e]
+
+    def is_open(self, start_local):
+        """Le créneau commençant à start_local tient-il entièrement dans une fenêtre d'ouverture ?"""
+        if not self.week:
+            return True  # Horaires illisibles : aucune contrainte d'ouverture
+        begin = start_local.hour * 60 + start_local.minute
+        return any(ws <= begin and begin + self.duration <= we for ws, we in self.week.get(start_local.weekday(), ()))
+
+    def next_free(self, now, count, horizon_days):
+        """Les count prochains créneaux libres après now (datetimes locaux), alignés sur la durée depuis l'ouverture."""
+        slots = []
+        if not self.week:
+            return slots
+        step = self.duration * 60
+        now_ts = now.timestamp()
+        local_now = now.astimezone(BUSINESS_TZ)
+        for offset in range(horizon_days):
+            day = local_now.date() + timedelta(days=offset)
+            midnight = _local_midnight(day)
+            for ws, we in self.week.get(day.weekday(), ()):
+                w_start = (midnight + timedelta(minutes=ws)).timestamp()
+                w_end = (midnight + timedelta(minutes=we)).timestamp()
+                t = w_start if w_start >= now_ts else w_start + math.ceil((now_ts - w_start) / step) * step
+                while t + step <= w_end:
+                    blocked = self.conflict_end(t, t + step)
+                    if blocked is None:
+                        slots.append(datetime.fromtimestamp(t, BUSINESS_TZ))
+                        if len(slots) >= count:
+                            return slots
+                        t += step
+                    else:
+                        t = w_start + math.ceil((blocked - w_start) / step) * step
+        return slots
+
+class AvailabilityEngine:
+    """Agendas des tenants, reconstruits depuis la base au plus tous les AVAILABILITY_TTL s ou si le contexte change."""
+
+    def __init__(self, ttl, horizon_days, suggestions):
+        self.ttl = ttl
+        self.horizon_days = horizon_days
+        self.suggestions = suggestions
+        self._agendas = {}
+        self._lock = threading.Lock()
+        self.booked = 0
+        self.rejected = 0
+
+    def peek(self, c):
+        """Agenda encore frais du tenant, sans accès à la base ; None sinon."""
+        agenda = self._agendas.get(c.id)
+        if agenda is None or agenda.version != c.version or time.monotonic() - agenda.built_at >= self.ttl:
+            return None
+        return agenda
+
+    def agenda(self, c):
+        agenda = self.peek(c)
+        if agenda is not None:
+            return agenda
+        now = datetime.now(timezone.utc)
+        # Parcours de l'index (user_id, start_at) borné à l'horizon de réservation
+        rows = db.session.query(Appointment.start_at, Appointment.end_at).filter(
+            Appointment.user_id == c.id,
+            Appointment.start_at.isnot(None),
+            Appointment.start_at < now + timedelta(days=self.horizon_days + 1),
+            Appointment.end_at > now
+        ).all()
+        agenda = TenantAgenda(c.version, parse_horaires(c.horaires), parse_duration(c.duree_moyenne),
+                              [(_epoch(s), _epoch(e)) for s, e in rows])
+        with self._lock:
+            self._agendas[c.id] = agenda
+        return agenda
+
+    def free_slots(self, c, count=None):
+        return self.agenda(c).next_free(datetime.now(timezone.utc), count or self.suggestions, self.horizon_days)
+
+    def book(self, c, start_local, details, date_str, turn_key=None):
+        """Réserve le créneau s'il est ouvert et libre ; False si l'index ou la base le refuse."""
+        if turn_key and db.session.query(Appointment.query.filter_by(turn_key=turn_key).exists()).scalar():
+            # Même tour rejoué : le créneau est déjà réservé par cet appel
+            metrics.inc('appointment_duplicates_total')
+            return True
+        agenda = self.agenda(c)
+        start = start_local.astimezone(timezone.utc)
+        end = start + timedelta(minutes=agenda.duration)
+        s, e = start.timestamp(), end.timestamp()
+        if start <= datetime.now(timezone.utc) or not agenda.is_open(start_local) or agenda.conflict_end(s, e) is not None:
+            self.rejected += 1
+            return False
+        
+        # Arbitrage en base : sérialise les réservations du tenant (Postgres) puis insère seulement sans chevauchement
+        db.session.execute(select(User.id).where(User.id == c.id).with_for_update())
+        overlap = select(Appointment.id).where(
+            Appointment.user_id == c.id, Appointment.start_at < end, Appointment.end_at > start
+        ).exists()
+        values = {
+            'user_id': c.id, 'date_str': date_str, 'details': details,
+            'start_at': start, 'end_at': end, 'created_at': datetime.utcnow(), 'turn_key': turn_key
+        }
+        table = Appointment.__table__
+        source = select(*[literal(v, type_=table.c[k].type) for k, v in values.items()]).where(~overlap)
+        try:
+            booked = db.session.execute(insert(table).from_select(list(values), source, include_defaults=True)).rowcount == 1
+            db.session.commit()
+        except IntegrityError:
+            # Le même tour a été réservé entre-temps par un autre worker
+            db.session.rollback()
+            metrics.inc('appointment_duplicates_total')
+            return True
+        
+        if not booked:
+            self.rejected += 1
+            # Réservation faite par un autre worker : l'index local est à reconstruire
+            with self._lock:
+                self._agendas.pop(c.id, None)
+            return False
+        self.booked += 1
+        agenda.add(s, e)
+        # Les réponses en cache peuvent citer le créneau qui vient d'être pris
+        answer_cache.invalidate(c.id)
+        return True
+
+    def stats(self):
+        return {"booked": self.booked, "rejected": self.rejected, "tenants": len(self._agendas)}
+
+availability = AvailabilityEngine(
+    app.config['AVAILABILITY_TTL'],
+    app.config['AVAILABILITY_HORIZON_DAYS'],
+    app.config['AVAILABILITY_SUGGESTIONS']
+)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# RÉPONSES LOCALES (QUESTIONS FACTUELLES TRAITÉES SANS LLM)
+# ----------------------------------------------------------------------------------------------------------------------
+# « Vous êtes ouverts quand ? », « C'est combien une coupe ? », « Vous êtes où ? » : la réponse est déjà dans horaires,
+# tarifs et adresse. Un classifieur déterministe (expressions régulières précompilées et lexique des prestations du
+# tenant, compilé avec son contexte) reconnaît ces questions en quelques microsecondes et les réponses sont construites
+# à partir des champs du tenant. Au moindre doute (demande de rendez-vous, plusieurs sujets, phrase longue, prestation
+# inconnue), la question part au LLM. Corpus étiqueté et mesure de précision : bench/bench_intents.py.
+
+app.config['INTENT_FAST_PATH'] = os.environ.get('INTENT_FAST_PATH', '1') == '1'
+app.config['INTENT_MAX_WORDS'] = int(os.environ.get('INTENT_MAX_WORDS', 14))
+# Au-delà, la grille tarifaire complète est trop longue pour être lue telle quelle : le LLM la résume
+app.config['INTENT_MAX_SPOKEN_WORDS'] = int(os.environ.get('INTENT_MAX_SPOKEN_WORDS', 40))
+
+# Indices par intention, sur la forme normalisée (minuscules, sans accents ni ponctuation) : (motif, poids)
+INTENT_CUES = {
+    'horaires': [
+        (re.compile(r"\b(horaires?|ouvert|ouverts|ouverte|ouvertes|ouvrez|ouvre|ouverture|fermez|fermeture)\b"), 2),
+        (re.compile(r"\b(ferme|fermes|fermee|fermees)\b"), 2),
+        (re.compile(r"\bjusqu a quelle heure\b|\ba partir de quelle heure\b|\bquelle heure vous (ouvrez|fermez)\b"), 2),
+        (re.compile(r"\bquand\b|\bheures?\b"), 1),
+    ],
+    'tarifs': [
+        (re.compile(r"\b(combien|prix|tarifs?|coute|coutent|couter|cout)\b"), 2),
+        (re.compile(r"\b(cher|euros?)\b"), 1),
+    ],
+    'adresse': [
+        (re.compile(r"\b(adresse|situes?|situee|localisation|localises?)\b"), 2),
+        (re.compile(r"\bou (etes|est|se trouve|vous trouver|vous etes|ca se trouve|c est)\b"), 2),
+        (re.compile(r"\b(etes|trouvez|situez) vous ou\b|\bvous situez ou\b|\bvous etes ou\b|\bc est ou\b|\bc est ou exactement\b"), 2),
+        (re.compile(r"\b(vous trouver|venir chez vous|quelle rue|quel quartier|quelle ville)\b"), 2),
+    ],
+}
+# Demandes d'action ou questions hors des trois champs : toujours confiées au LLM
+INTENT_VETO = re.compile(
+    r"\b(rendez vous|rdv|reserv\w*|prendre|annul\w*|deplac\w*|decal\w*|modifi\w*|disponib\w*|dispo|creneaux?|"
+    r"place|places|puis je|je peux|on peut|pouvez vous me|parler|quelqu un|conseiller|rappeler|message|"
+    r"combien de temps|combien de minutes|combien d heures|duree|parking|garer|acces|livr\w*|rembours\w*|"
+    r"carte|cheque|paiement|payer|cadeau|promo\w*|reduction|remise|pourquoi|probleme|retard)\b"
+)
+# Mots sans valeur pour reconnaître une prestation dans la question
+INTENT_STOPWORDS = frozenset("""
+a ai al alors au aux avec bonjour bonsoir c ca ce ces cest chez combien comment cout coute coutent couter cher d dans de
+des dire du elle en est et etre euh euros euro fait faites faire il ils j je l la le les leur leurs m ma me merci mes moi
+mon n ne nous on ou oui par pas pour pourrais pourriez pouvez prix quel quelle quelles quels qu que quoi s sa savoir se
+ses si son sont svp t ta te tarif tarifs tes toi ton tu un une vos votre vous voudrais voulais y plait s il aimerais
+madame monsieur dites allo bien connaitre prestations prestation pratiquez prenez couterait
+""".split())
+
+FAST_PATH_FOLLOW_UP = " Souhaitez-vous prendre rendez-vous ?"
+
+TenantIntents = namedtuple('TenantIntents', ['week', 'hours', 'prices', 'price_list', 'address'])
+
+def _price_items(tarifs):
+    """Lignes de la grille tarifaire portant un montant -> [(mots du libellé, ligne telle qu'elle sera lue)]."""
+    items = []
+    for line in re.split(r"\n|;|,(?!\d)", tarifs or ''):
+        line = re.sub(r"\s+", " ", line).strip(" .-•*")
+        if not line or not re.search(r"\d", line):
+            continue
+        label = re.split(r"\d|:", line, maxsplit=1)[0]
+        words = frozenset(w for w in normalize_utterance(label, drop_fillers=False).split() if w not in INTENT_STOPWORDS)
+        if words:
+            items.append((words, line))
+    return items
+
+def compile_tenant_intents(c):
+    """Lexique d'un tenant, compilé une fois avec son contexte (horaires par jour, prestations, adresse)."""
+    prices = _price_items(c.tarifs)
+    price_list = condense(c.tarifs)
+    return TenantIntents(
+        week=parse_horaires(c.horaires or ''),
+        hours=condense(c.horaires),
+        prices=prices,
+        price_list=price_list if len(price_list.split()) <= app.config['INTENT_MAX_SPOKEN_WORDS'] else None,
+        address=condense(c.adresse),
+    )
+
+def classify_intent(key):
+    """Intention factuelle ('horaires', 'tarifs', 'adresse') d'une question normalisée, ou None en cas de doute."""
+    if not key or len(key.split()) > app.config['INTENT_MAX_WORDS'] or INTENT_VETO.search(key):
+        return None
+    scores = {}
+    for intent, cues in INTENT_CUES.items():
+        score = sum(weight for pattern, weight in cues if pattern.search(key))
+        if score:
+            scores[intent] = score
+    if len(scores) != 1:
+        return None
+    intent, score = scores.popitem()
+    return intent if score >= 2 else None
+
+def _clock(minutes):
+    return f"{minutes // 60}h{minutes % 60:02d}" if minutes % 60 else f"{minutes // 60}h"
+
+def _hours_answer(intents, key):
+    day = next((i for i, jour in enumerate(JOURS) if re.search(rf"\b{jour}s?\b", key)), None)
+    if day is None and re.search(r"\b(aujourd hui|ce soir|ce matin|cet apres midi)\b", key):
+        day = datetime.now(BUSINESS_TZ).weekday()
+    elif day is None and re.search(r"\bdemain\b", key):
+        day = (datetime.now(BUSINESS_TZ).weekday() + 1) % 7
+    if day is not None and intents.week:
+        windows = intents.week.get(day)
+        if not windows:
+            return f"Le {JOURS[day]}, nous sommes fermés."
+        return f"Le {JOURS[day]}, nous sommes ouverts " + " et ".join(
+            f"de {_clock(s)} à {_clock(e)}" for s, e in windows
+        ) + "."
+    return f"Nos horaires : {intents.hours}." if intents.hours else None
+
+def _price_answer(intents, key):
+    asked = {w for w in key.split() if w not in INTENT_STOPWORDS}
+    if not asked:
+        return f"Nos tarifs : {intents.price_list}." if intents.price_list else None
+    scored = [(len(asked & words), line) for words, line in intents.prices]
+    best = max((score for score, _ in scored), default=0)
+    # Prestation absente de la grille (ou mal reconnue) : le LLM saura répondre plus finement
+    if best == 0 or best < len(asked) / 2:
+        return None
+    # « Une coupe » sans précision : toutes les lignes qui correspondent autant sont lues
+    lines = [line for score, line in scored if score == best]
+    answer = "; ".join(lines)
+    return f"{answer}." if len(answer.split()) <= app.config['INTENT_MAX_SPOKEN_WORDS'] else None
+
+def fast_answer(c, txt):
+    """Réponse parlée construite depuis les champs du tenant, ou None si la question doit aller au LLM."""
+    if not app.config['INTENT_FAST_PATH'] or not txt:
+        return None
+    key = normalize_utterance(txt, drop_fillers=False)
+    intent = classify_intent(key)
+    if intent == 'horaires':
+        answer = _hours_answer(c.intents, key)
+    elif intent == 'tarifs':
+        answer = _price_answer(c.intents, key)
+    elif intent == 'adresse':
+        answer = f"Notre adresse : {c.intents.address}." if c.intents.address else None
+    else:
+        return None
+    if answer is None:
+        return None
+    metrics.inc('voice_fast_path_total', intent=intent)
+    return answer + FAST_PATH_FOLLOW_UP
+
+# ----------------------------------------------------------------------------------------------------------------------
+# MÉTRIQUES (CHRONOMÈTRES PAR ÉTAPE, COMPTEURS ET EXPORT PROMETHEUS MULTI-WORKERS)
+# ----------------------------------------------------------------------------------------------------------------------
+# Chaque étape d'un tour vocal (contexte tenant, prompt, LLM, réservation, TwiML) et chaque rendu de page alimente un
+# histogramme en mémoire : un perf_counter et un incrément sous verrou, soit quelques microsecondes par mesure.
+# Chaque worker gunicorn dépose périodiquement son instantané dans METRICS_DIR (un fichier JSON par pid, écrit de façon
+# atomique) ; /metrics additionne tous les fichiers, si bien que la réponse ne dépend pas du worker interrogé. Les pages
+# (dashboard, console master) réutilisent cet agrégat pendant METRICS_FLUSH_INTERVAL secondes au lieu de relire tous les
+# fichiers à chaque affichage.
+
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'digitagpro-metrics'))
+app.config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+app.config['METRICS_RETENTION'] = float(os.environ.get('METRICS_RETENTION', 86400))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+
+METRIC_HELP = {
+    'voice_turn_seconds': "Durée totale d'un tour vocal (webhook reçu -> TwiML rendu)",
+    'voice_stage_seconds': "Durée de chaque étape d'un tour vocal",
+    'page_render_seconds': "Durée de rendu des templates de pages",
+    'voice_turns_total': "Tours vocaux traités",
+    'voice_calls_total': "Appels décrochés, par tenant",
+    'voice_llm_errors_total': "Tours répondus sans le LLM (deadline, disjoncteur ou erreur)",
+    'voice_confirmations_total': "Balises CONFIRMATION traitées, par issue",
+    'voice_speculations_total': "Requêtes LLM spéculatives, par issue (lancée, hit, miss, obsolète, abandonnée)",
+    'voice_speculation_saved_seconds': "Latence gagnée par tour grâce à une spéculation réutilisée",
+    'webhook_duplicates_total': "Requêtes vocales Twilio rejouées, par issue (TwiML rejoué, toujours en cours)",
+    'llm_calls_saved_total': "Appels LLM évités grâce au rejeu des webhooks",
+    'appointment_duplicates_total': "Rendez-vous en double écartés (turn_key déjà enregistré)",
+    'voice_deferred_turns_total': "Tours différés, par issue (réponse immédiate, phrase d'attente, relevée, perdue)",
+    'voice_fast_path_total': "Questions factuelles répondues localement sans LLM, par intention",
+    'voice_admission_rejected_total': "Requêtes vocales délestées et appels LLM refusés, par tenant, motif et priorité",
+    'prompt_tokens_total': "Tokens d'entrée envoyés au LLM (estimation locale), par tenant",
+    'prompt_turns_total': "Requêtes LLM construites, par tenant",
+    'llm_prompt_tokens_total': "Tokens d'entrée facturés par le fournisseur",
+    'llm_cached_prompt_tokens_total': "Tokens d'entrée servis par le cache de préfixe du fournisseur",
+}
+
+class MetricsRegistry:
+    """Compteurs et histogrammes du processus, agrégés entre workers par fichiers d'instantanés."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, directory, flush_interval, retention):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.counters = {}    # (nom, labels) -> valeur
+        self.histograms = {}  # (nom, labels) -> [compte par seau..., +Inf, somme, nombre]
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._collected = None  # (instant monotonic, compteurs, histogrammes) du dernier agrégat
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._ensure_started()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * (len(self.BUCKETS) + 3)
+            h[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            h[-2] += seconds
+            h[-1] += 1
+        self._ensure_started()
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[n, dict(l), v] for (n, l), v in self.counters.items()],
+                "histograms": [[n, dict(l), list(h)] for (n, l), h in self.histograms.items()],
+            }
+
+    def _ensure_started(self):
+        # Thread de dépôt paresseux et par processus, comme l'écriture différée (survit aux forks gunicorn)
+        if not self.directory or (self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="metrics-flush", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+            with open(path + ".tmp", "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            log_event(logging.WARNING, "METRICS", "FLUSH FAILED: %s", e)
+
+    def collect(self, max_age=0):
+        """
+        Somme des instantanés de tous les workers (celui du processus courant est pris en direct).
+        max_age > 0 : l'agrégat précédent est réutilisé s'il a moins de max_age secondes (pages consultées en boucle).
+        """
+        cached = self._collected
+        if max_age > 0 and cached is not None and time.monotonic() - cached[0] < max_age:
+            return cached[1], cached[2]
+        snapshots = [self.snapshot()]
+        if self.directory and os.path.isdir(self.directory):
+            own = f"metrics-{os.getpid()}.json"
+            now = time.time()
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json") or name == own:
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    if now - os.path.getmtime(path) > self.retention:
+                        os.remove(path)  # Worker disparu depuis longtemps
+                        continue
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        
+        counters, histograms = {}, {}
+        for snap in snapshots:
+            for n, l, v in snap["counters"]:
+                key = (n, tuple(sorted(l.items())))
+                counters[key] = counters.get(key, 0) + v
+            for n, l, h in snap["histograms"]:
+                key = (n, tuple(sorted(l.items())))
+                acc = histograms.setdefault(key, [0] * len(h))
+                for i, x in enumerate(h):
+                    acc[i] += x
+        self._collected = (time.monotonic(), counters, histograms)
+        return counters, histograms
+
+    def quantiles(self, name, qs, max_age=0, **labels):
+        """Quantiles (secondes) estimés par interpolation dans les seaux agrégés ; None sans observation."""
+        _, histograms = self.collect(max_age)
+        h = histograms.get((name, tuple(sorted(labels.items()))))
+        if not h or not h[-1]:
+            return [None for _ in qs]
+        out = []
+        for q in qs:
+            rank = q * h[-1]
+            cumulative, lower, value = 0, 0.0, self.BUCKETS[-1]  # Au-delà du dernier seau : borne haute connue
+            for bound, n in zip(self.BUCKETS, h):
+                if n and cumulative + n >= rank:
+                    value = lower + (bound - lower) * (rank - cumulative) / n
+                    break
+                cumulative += n
+                lower = bound
+            out.append(value)
+        return out
+
+    def render(self):
+        """Format texte d'exposition Prometheus (version 0.0.4)."""
+        counters, histograms = self.collect()
+        lines = []
+        
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+        
+        for name in sorted({n for n, _ in counters}):
+            lines.append(f"# HELP digitagpro_{name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE digitagpro_{name} counter")
+            for (n, l), v in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"digitagpro_{name}{fmt_labels(l)} {v}")
+        for name in sorted({n for n, _ in histograms}):
+            lines.append(f"# HELP digitagpro_{name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE digitagpro_{name} histogram")
+            for (n, l), h in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS + ('+Inf',), h[:-2]):
+                    cumulative += count
+                    lines.append(f"digitagpro_{name}_bucket{fmt_labels(l, [('le', bound)])} {cumulative}")
+                lines.append(f"digitagpro_{name}_sum{fmt_labels(l)} {round(h[-2], 6)}")
+                lines.append(f"digitagpro_{name}_count{fmt_labels(l)} {h[-1]}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry(app.config['METRICS_DIR'], app.config['METRICS_FLUSH_INTERVAL'], app.config['METRICS_RETENTION'])
+atexit.register(metrics.flush)
+
+@before_render_template.connect_via(app)
+def _render_started(sender, template, context, **extra):
+    g.setdefault('render_started', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def _render_finished(sender, template, context, **extra):
+    stack = g.get('render_started')
+    if stack:
+        metrics.observe('page_render_seconds', time.perf_counter() - stack.pop(), page=template.name)
+
+def response_speed():
+    """p50 / p95 des tours vocaux (ms, tous workers confondus) pour le dashboard ; None tant qu'aucun tour n'est mesuré."""
+    # Les instantanés des autres workers ne changent qu'à chaque dépôt : inutile de les relire plus souvent
+    p50, p95 = metrics.quantiles('voice_turn_seconds', (0.5, 0.95), max_age=metrics.flush_interval)
+    if p50 is None:
+        return None
+    return {"p50": int(p50 * 1000), "p95": int(p95 * 1000)}
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Exposition Prometheus ; protégée par METRICS_TOKEN (en-tête Authorization: Bearer) si la variable est définie."""
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# ----------------------------------------------------------------------------------------------------------------------
+# PASSERELLE LLM (DEADLINE PAR TOUR, HEDGING, DISJONCTEUR ET HISTOGRAMMES DE LATENCE)
+# ----------------------------------------------------------------------------------------------------------------------
+# Un fournisseur lent ne doit jamais retenir un worker au-delà du budget Twilio. Chaque tour reçoit une deadline
+# stricte ; si la réponse tarde au-delà du p95 observé, une seconde requête identique peut être lancée (hedging)
+# et la première réponse arrivée l'emporte. Après une série d'échecs, le disjoncteur s'ouvre et les tours sont
+# servis immédiatement par une réponse de secours, jusqu'à ce qu'une requête de sonde réussisse.
+
+app.config['LLM_MODEL'] = os.environ.get('LLM_MODEL', 'gpt-4o-mini')
+app.config['LLM_HEDGE_ENABLED'] = os.environ.get('LLM_HEDGE_ENABLED', '0') == '1'
+app.config['LLM_HEDGE_MIN_MS'] = float(os.environ.get('LLM_HEDGE_MIN_MS', 800))
+app.config['LLM_BREAKER_THRESHOLD'] = int(os.environ.get('LLM_BREAKER_THRESHOLD', 5))
+app.config['LLM_BREAKER_COOLDOWN'] = float(os.environ.get('LLM_BREAKER_COOLDOWN', 15))
+
+CANNED_REPLY = "Notre assistant est momentanement tres sollicite. Pouvez-vous me redire votre demande dans un instant ?"
+
+class LLMUnavailable(Exception):
+    """Le fournisseur LLM est considéré indisponible (disjoncteur ouvert ou deadline dépassée)."""
+
+class LatencyHistogram:
+    """Histogramme cumulatif à seaux fixes (export) doublé d'une fenêtre glissante (quantiles récents)."""
+
+    BUCKETS_MS = (50, 100, 250, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000)
+
+    def __init__(self, window=512):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, ms):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+            self.total_ms += ms
+            self.count += 1
+            self.recent.append(ms)
+
+    def quantile(self, q):
+        with self._lock:
+            if not self.recent:
+                return None
+            ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self):
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for bound, n in zip(self.BUCKETS_MS + (float('inf'),), self.counts):
+                cumulative += n
+                buckets['+Inf' if bound == float('inf') else str(bound)] = cumulative
+            return {"buckets": buckets, "sum_ms": round(self.total_ms, 1), "count": self.count}
+
+class CircuitBreaker:
+    """Disjoncteur à trois états : fermé, ouvert (court-circuit) puis semi-ouvert (une requête de sonde)."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                if self.opened_at is None or self.probing:
+                    log_event(logging.ERROR, "LLM_GATEWAY", "CIRCUIT BREAKER OPEN AFTER %d FAILURE(S)", self.failures)
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+def record_usage(chat):
+    """Tokens facturés par le fournisseur, dont ceux servis par son cache de préfixe."""
+    usage = getattr(chat, 'usage', None)
+    if usage is None:
+        return
+    metrics.inc('llm_prompt_tokens_total', usage.prompt_tokens or 0)
+    details = getattr(usage, 'prompt_tokens_details', None)
+    metrics.inc('llm_cached_prompt_tokens_total', getattr(details, 'cached_tokens', None) or 0)
+
+class LLMGateway:
+    """Point d'entrée unique vers le fournisseur LLM pour le pipeline vocal."""
+
+    def __init__(self, client_factory, model, deadline, hedge_enabled, hedge_min_ms, breaker, pool_size, async_client_factory=None):
+        self.client_factory = client_factory
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.async_client_factory = async_client_factory
+        self._async_clients = weakref.WeakKeyDictionary()  # boucle d'événements -> client asynchrone (un pool httpx ne se partage pas entre boucles)
+        self.model = model
+        self.deadline = deadline
+        self.hedge_enabled = hedge_enabled
+        self.hedge_min_ms = hedge_min_ms
+        self.breaker = breaker
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="llm")
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.short_circuits = 0
+
+    @property
+    def client(self):
+        """Client synchrone, construit au premier appel (ou par warm_up() au démarrage du worker)."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self.client_factory()
+        return self._client
+
+    def prepare(self):
+        """Construit le client si besoin, avant que la deadline d'un tour ne commence à courir (import du SDK compris)."""
+        return self.client
+
+    def reset(self):
+        """Après un fork : les pools HTTP hérités du processus maître ne sont jamais réutilisés."""
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _call(self, messages, max_tokens, temperature):
+        started = time.perf_counter()
+        chat = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            timeout=self.deadline
+        )
+        record_usage(chat)
+        return chat.choices[0].message.content, (time.perf_counter() - started) * 1000
+
+    def _admit(self):
+        if not self.breaker.allow():
+            self.short_circuits += 1
+            raise LLMUnavailable("Disjoncteur LLM ouvert")
+        self.requests += 1
+
+    def complete(self, messages, max_tokens=250, temperature=0.7):
+        """Retourne le texte de la réponse dans la deadline, ou lève LLMUnavailable / l'erreur du fournisseur."""
+        self._admit()
+        self.prepare()
+        deadline_at = time.monotonic() + self.deadline
+        primary = self.executor.submit(self._call, messages, max_tokens, temperature)
+        pending = {primary}
+        
+        if self.hedge_enabled:
+            p95 = self.latency.quantile(0.95)
+            hedge_after = max(self.hedge_min_ms, p95 or 0) / 1000
+            done, _ = wait(pending, timeout=min(hedge_after, self.deadline))
+            if not done and time.monotonic() < deadline_at:
+                self.hedges += 1
+                pending.add(self.executor.submit(self._call, messages, max_tokens, temperature))
+        
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline_at - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for fut in done:
+                try:
+                    text_out, ms = fut.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if fut is not primary:
+                    self.hedge_wins += 1
+                self.latency.observe(ms)
+                self.breaker.record_success()
+                return text_out
+        
+        self.breaker.record_failure()
+        if error is not None and not pending:
+            self.errors += 1
+            raise error
+        self.timeouts += 1
+        raise LLMUnavailable(f"Deadline LLM de {self.deadline:.1f}s depassee")
+
+    async def _acall(self, messages, max_tokens, temperature):
+        loop = asyncio.get_running_loop()
+        aclient = self._async_clients.get(loop)
+        if aclient is None:
+            aclient = self._async_clients[loop] = self.async_client_factory()
+        started = time.perf_counter()
+        chat = await aclient.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            timeout=self.deadline
+        )
+        record_usage(chat)
+        return chat.choices[0].message.content, (time.perf_counter() - started) * 1000
+
+    async def acomplete(self, messages, max_tokens=250, temperature=0.7):
+        """Équivalent asynchrone de complete() : mêmes deadline, hedging, disjoncteur et histogramme, sans thread."""
+        self._admit()
+        if self._client is None:
+            # Premier appel du processus : le chargement du SDK ne doit pas bloquer la boucle d'événements
+            await asyncio.to_thread(self.prepare)
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + self.deadline
+        primary = asyncio.ensure_future(self._acall(messages, max_tokens, temperature))
+        pending = {primary}
+        
+        try:
+            if self.hedge_enabled:
+                p95 = self.latency.quantile(0.95)
+                hedge_after = max(self.hedge_min_ms, p95 or 0) / 1000
+                done, _ = await asyncio.wait(pending, timeout=min(hedge_after, self.deadline))
+                if not done and loop.time() < deadline_at:
+                    self.hedges += 1
+                    pending.add(asyncio.ensure_future(self._acall(messages, max_tokens, temperature)))
+            
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, deadline_at - loop.time()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in done:
+                    try:
+                        text_out, ms = task.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if task is not primary:
+                        self.hedge_wins += 1
+                    self.latency.observe(ms)
+                    self.breaker.record_success()
+                    return text_out
+        finally:
+            # Contrairement aux threads, les requêtes perdantes ou hors délai sont réellement annulées
+            for task in pending:
+                task.cancel()
+        
+        self.breaker.record_failure()
+        if error is not None and not pending:
+            self.errors += 1
+            raise error
+        self.timeouts += 1
+        raise LLMUnavailable(f"Deadline LLM de {self.deadline:.1f}s depassee")
+
+    def stream(self, messages, max_tokens=250, temperature=0.7):
+        """Générateur de fragments de texte ; la deadline s'applique à l'attente de chaque fragment."""
+        self._admit()
+        self.prepare()
+        started = time.perf_counter()
+        first = None
+        try:
+            chunks = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                timeout=self.deadline
+            )
+            for chunk in chunks:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if first is None:
+                        first = (time.perf_counter() - started) * 1000
+                        self.latency.observe(first)
+                    yield delta
+        except Exception:
+            self.errors += 1
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+    def stats(self):
+        return {
+            "breaker": self.breaker.state,
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "short_circuits": self.short_circuits,
+            "p50_ms": self.latency.quantile(0.5),
+            "p95_ms": self.latency.quantile(0.95),
+            "latency": self.latency.snapshot(),
+        }
+
+llm = LLMGateway(
+    make_client,
+    app.config['LLM_MODEL'],
+    app.config['LLM_DEADLINE'],
+    app.config['LLM_HEDGE_ENABLED'],
+    app.config['LLM_HEDGE_MIN_MS'],
+    CircuitBreaker(app.config['LLM_BREAKER_THRESHOLD'], app.config['LLM_BREAKER_COOLDOWN']),
+    app.config['LLM_POOL_SIZE'],
+    make_async_client
+)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# IDEMPOTENCE DES WEBHOOKS TWILIO (RELANCES ET REDIRECTIONS REJOUÉES)
+# ----------------------------------------------------------------------------------------------------------------------
+# Chaque document TwiML renvoie vers /voice/<id>?t=<séquence> : une requête est identifiée par (CallSid, séquence),
+# à défaut par le jeton I-Twilio-Idempotency-Token ou l'empreinte du SpeechResult. La première requête pose un marqueur
+# « en cours » dans le stockage des conversations ; une relance attend le TwiML produit (au plus IDEMPOTENCY_WAIT
+# secondes, puis courte pause et nouvelle tentative) au lieu de relancer le LLM et la réservation. Le TwiML terminé est
+# conservé IDEMPOTENCY_TTL secondes. La même clé sert de turn_key aux rendez-vous, uniques en base.
+
+app.config['IDEMPOTENCY_TTL'] = int(os.environ.get('IDEMPOTENCY_TTL', 600))
+app.config['IDEMPOTENCY_WAIT'] = float(os.environ.get('IDEMPOTENCY_WAIT', 3.0))
+# Durée de vie du marqueur « en cours » : un worker mort pendant le tour ne bloque pas la clé indéfiniment
+app.config['IDEMPOTENCY_PENDING_TTL'] = int(os.environ.get('IDEMPOTENCY_PENDING_TTL', 30))
+
+def webhook_key(call_sid, values, token=None):
+    """Clé d'idempotence d'une requête vocale Twilio ; None sans CallSid."""
+    if not call_sid:
+        return None
+    seq = values.get('t')
+    if seq:
+        return f"{call_sid}:t{seq}"
+    if token:
+        return f"{call_sid}:k{hashlib.sha1(token.encode()).hexdigest()[:16]}"
+    # Documents émis avant la numérotation (appels en cours lors d'un déploiement)
+    return f"{call_sid}:h{hashlib.sha1((values.get('SpeechResult') or '').encode()).hexdigest()[:16]}"
+
+def memory_turn_key(call_sid, state):
+    """turn_key de repli, hors webhook numéroté (WebSocket, appels directs) : CallSid + numéro de tour en mémoire."""
+    return f"{call_sid}:n{state.get('n', 0) + 1}" if call_sid else None
+
+class WebhookReplays:
+    """Marqueurs « en cours » et TwiML terminés par clé de requête, dans un stockage partagé entre workers."""
+
+    PENDING = "\x00pending"
+
+    def __init__(self, store, ttl, pending_ttl, wait):
+        self.store = store
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.wait = wait
+        self.counts = Counter()
+
+    def poll(self, key):
+        """('new', None) : à traiter ; ('replay', twiml) : déjà produit ; ('pending', None) : en cours ailleurs."""
+        if self.store.add(f"idem:{key}", self.PENDING, self.pending_ttl):
+            return 'new', None
+        value = self.store.get(f"idem:{key}")
+        if value is None:
+            # Marqueur expiré entre les deux lectures : nouvelle tentative de prise
+            return ('new', None) if self.store.add(f"idem:{key}", self.PENDING, self.pending_ttl) else ('pending', None)
+        return ('pending', None) if value == self.PENDING else ('replay', value)
+
+    def begin(self, key):
+        deadline = time.monotonic() + self.wait
+        while True:
+            status, twiml = self.poll(key)
+            if status != 'pending' or time.monotonic() >= deadline:
+                return status, twiml
+            time.sleep(0.1)
+
+    async def abegin(self, key):
+        deadline = time.monotonic() + self.wait
+        while True:
+            status, twiml = await _conversation_io(self.poll, key)
+            if status != 'pending' or time.monotonic() >= deadline:
+                return status, twiml
+            await asyncio.sleep(0.1)
+
+    def complete(self, key, twiml):
+        self.store.set(f"idem:{key}", twiml, self.ttl)
+
+    def abandon(self, key):
+        self.store.delete(f"idem:{key}")
+
+    def record(self, status, spoken):
+        self.counts[status] += 1
+        metrics.inc('webhook_duplicates_total', outcome=status)
+        if spoken:
+            # Une relance porteuse d'une transcription aurait déclenché un second appel LLM
+            self.counts['llm_saved'] += 1
+            metrics.inc('llm_calls_saved_total')
+
+    def stats(self):
+        return {"replayed": self.counts['replay'], "pending": self.counts['pending'], "llm_calls_saved": self.counts['llm_saved']}
+
+webhook_replays = WebhookReplays(
+    conversations.backend,
+    app.config['IDEMPOTENCY_TTL'],
+    app.config['IDEMPOTENCY_PENDING_TTL'],
+    app.config['IDEMPOTENCY_WAIT']
+)
+
+def idempotent_webhook(view):
+    """Décorateur du webhook vocal : une relance rejoue le TwiML de la première requête au lieu de le recalculer."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = webhook_key(request.values.get('CallSid'), request.values, request.headers.get('I-Twilio-Idempotency-Token'))
+        if key is None:
+            return view(*args, **kwargs)
+        status, twiml = webhook_replays.begin(key)
+        if status != 'new':
+            webhook_replays.record(status, bool(request.values.get('SpeechResult')))
+            # Toujours en cours : Twilio repassera sur la même URL après une seconde de pause
+            return twiml if status == 'replay' else filler_twiml(None, request.full_path.rstrip('?'))
+        g.turn_key = key
+        try:
+            twiml = view(*args, **kwargs)
+        except BaseException:
+            webhook_replays.abandon(key)
+            raise
+        if g.get('no_replay'):
+            webhook_replays.abandon(key)
+        else:
+            webhook_replays.complete(key, twiml)
+        return twiml
+    return wrapper
+
+# ----------------------------------------------------------------------------------------------------------------------
+# CONTRÔLE D'ADMISSION (LIMITES PAR TENANT, QUOTA LLM ET DÉLESTAGE DU WEBHOOK VOCAL)
+# ----------------------------------------------------------------------------------------------------------------------
+# Un salon très sollicité (ou un numéro Twilio mal configuré) ne doit pas occuper tous les workers ni épuiser le quota
+# OpenAI partagé. Chaque requête vocale prend une place dans la limite de son tenant et dans la limite globale ; chaque
+# appel LLM consomme un jeton du seau du tenant (débit ADMISSION_LLM_RATE par seconde, rafale ADMISSION_LLM_BURST).
+# Priorités : un tour qui s'approche d'une réservation peut occuper toute la capacité, un tour ordinaire
+# ADMISSION_SHARE_TURN de celle-ci, un nouvel appel ADMISSION_SHARE_GREETING seulement. Hors capacité, la requête est
+# délestée tout de suite par un TwiML court (inviter l'appelant à répéter, ou à rappeler s'il s'agit d'un nouvel appel)
+# plutôt que d'attendre jusqu'au timeout Twilio. Backend 'memory' : compteurs du processus ; 'sql' / 'redis' : places
+# louées dans le stockage partagé, communes à tous les workers.
+
+app.config['ADMISSION_CONTROL'] = os.environ.get('ADMISSION_CONTROL', '1') == '1'
+app.config['ADMISSION_BACKEND'] = os.environ.get('ADMISSION_BACKEND', 'memory')
+app.config['ADMISSION_TENANT_LIMIT'] = int(os.environ.get('ADMISSION_TENANT_LIMIT', 8))
+app.config['ADMISSION_GLOBAL_LIMIT'] = int(os.environ.get('ADMISSION_GLOBAL_LIMIT', 64))
+app.config['ADMISSION_LLM_RATE'] = float(os.environ.get('ADMISSION_LLM_RATE', 1.0))
+app.config['ADMISSION_LLM_BURST'] = int(os.environ.get('ADMISSION_LLM_BURST', 20))
+app.config['ADMISSION_SHARE_TURN'] = float(os.environ.get('ADMISSION_SHARE_TURN', 0.9))
+app.config['ADMISSION_SHARE_GREETING'] = float(os.environ.get('ADMISSION_SHARE_GREETING', 0.7))
+# Bail d'une place partagée : un worker mort pendant le tour la libère au plus tard après ce délai
+app.config['ADMISSION_LEASE_TTL'] = int(os.environ.get('ADMISSION_LEASE_TTL', 30))
+# Places essayées au plus par acquisition partagée (tirées au hasard au-delà)
+app.config['ADMISSION_PROBES'] = int(os.environ.get('ADMISSION_PROBES', 16))
+# Délestages consécutifs tolérés dans un même appel avant de raccrocher poliment
+app.config['ADMISSION_MAX_SHEDS'] = int(os.environ.get('ADMISSION_MAX_SHEDS', 2))
+
+SHED_GREETING_REPLY = "Bonjour, toutes nos lignes sont occupées pour le moment. Merci de nous rappeler dans quelques minutes."
+SHED_TURN_REPLY = "Excusez-moi, je n'ai pas pu traiter votre demande à l'instant. Pouvez-vous la répéter ?"
+SHED_HANGUP_REPLY = "Toutes nos excuses, nous sommes très sollicités. Merci de nous rappeler dans quelques minutes. Au revoir."
+
+# Indices qu'un tour mène à une réservation (jour, heure, acceptation d'un créneau proposé)
+BOOKING_CUES = re.compile(
+    r"\b(rendez vous|rdv|reserv\w*|creneaux?|dispo\w*|confirm\w*|oui|d accord|ok|parfait|ca marche|ca me va|"
+    r"lundi|mardi|mercredi|jeudi|vendredi|samedi|dimanche|demain|matin|apres midi|\d{1,2} ?h\d{0,2})\b"
+)
+
+def turn_priority(txt):
+    """'booking' (tour proche d'une réservation), 'turn' (question en cours d'appel) ou 'greeting' (nouvel appel)."""
+    if not txt:
+        return 'greeting'
+    return 'booking' if BOOKING_CUES.search(normalize_utterance(txt, drop_fillers=False)) else 'turn'
+
+class AdmissionRejected(LLMUnavailable):
+    """Quota LLM du tenant épuisé : traité comme une indisponibilité du fournisseur (réponse d'attente)."""
+
+class LocalLimiter:
+    """Limites du processus : places occupées par portée et seaux à jetons, sous un verrou."""
+
+    blocking = False
+
+    def __init__(self):
+        self._in_flight = Counter()
+        self._buckets = {}  # portée -> [jetons, instant du dernier remplissage]
+        self._lock = threading.Lock()
+
+    def acquire(self, scope, limit):
+        with self._lock:
+            if self._in_flight[scope] >= limit:
+                return None
+            self._in_flight[scope] += 1
+            return scope
+
+    def release(self, scope, ticket):
+        with self._lock:
+            self._in_flight[scope] -= 1
+            if self._in_flight[scope] <= 0:
+                del self._in_flight[scope]
+
+    def take(self, scope, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.get(scope, (burst, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            if tokens < 1:
+                self._buckets[scope] = (tokens, now)
+                return False
+            self._buckets[scope] = (tokens - 1, now)
+            return True
+
+    def in_flight(self):
+        with self._lock:
+            return self._in_flight.get('global', 0)
+
+class SharedLimiter:
+    """
+    Limites communes à tous les workers, sur le stockage partagé (add = écriture si absente, avec expiration).
+    Une limite de N est faite de N places adm:<portée>:<i> louées pour ADMISSION_LEASE_TTL secondes et rendues en fin de
+    requête. Le seau à jetons suit le même principe : ADMISSION_LLM_BURST places louées burst / rate secondes chacune et
+    jamais rendues, soit une rafale de burst appels puis un débit soutenu de rate appels par seconde.
+    """
+
+    def __init__(self, store, lease_ttl, probes):
+        self.store = store
+        self.blocking = store.blocking
+        self.lease_ttl = lease_ttl
+        self.probes = probes
+
+    def _lease(self, prefix, limit, ttl):
+        if limit <= self.probes:
+            start = random.randrange(limit)
+            slots = [(start + i) % limit for i in range(limit)]
+        else:
+            slots = random.sample(range(limit), self.probes)
+        owner = f"{os.getpid()}:{threading.get_ident()}"
+        for i in slots:
+            if self.store.add(f"{prefix}:{i}", owner, ttl):
+                return f"{prefix}:{i}"
+        return None
+
+    def acquire(self, scope, limit):
+        return self._lease(f"adm:{scope}", limit, self.lease_ttl)
+
+    def release(self, scope, ticket):
+        self.store.delete(ticket)
+
+    def take(self, scope, rate, burst):
+        return self._lease(f"adm:llm:{scope}", burst, burst / rate) is not None
+
+    def in_flight(self):
+        return None  # Non connu sans parcourir le stockage
+
+class AdmissionControl:
+    """Admission des requêtes vocales (limites tenant et globale, par priorité) et quota d'appels LLM par tenant."""
+
+    SHARES = {'booking': 1.0}
+
+    def __init__(self, limiter, tenant_limit, global_limit, llm_rate, llm_burst, shares):
+        self.limiter = limiter
+        self.tenant_limit = tenant_limit
+        self.global_limit = global_limit
+        self.llm_rate = llm_rate
+        self.llm_burst = llm_burst
+        self.shares = dict(self.SHARES, **shares)
+        self.counts = Counter()
+
+    def _limit(self, limit, priority):
+        return max(1, int(limit * self.shares[priority]))
+
+    def admit(self, tenant_id, priority):
+        """Liste des places obtenues (à rendre via release) ; None si la requête doit être délestée."""
+        scope = f"t{tenant_id}"
+        try:
+            ticket = self.limiter.acquire(scope, self._limit(self.tenant_limit, priority))
+            if ticket is None:
+                return self.reject(tenant_id, priority, 'tenant')
+            global_ticket = self.limiter.acquire('global', self._limit(self.global_limit, priority))
+            if global_ticket is None:
+                self.limiter.release(scope, ticket)
+                return self.reject(tenant_id, priority, 'global')
+        except Exception as e:
+            # Stockage partagé injoignable : on laisse passer plutôt que de couper tous les appels
+            log_event(logging.WARNING, "ADMISSION_STORE_ERROR", "%s", e, tenant=tenant_id)
+            self.counts['store_error'] += 1
+            return []
+        self.counts['admitted'] += 1
+        return [(scope, ticket), ('global', global_ticket)]
+
+    def release(self, tickets):
+        for scope, ticket in tickets:
+            try:
+                self.limiter.release(scope, ticket)
+            except Exception as e:
+                log_event(logging.WARNING, "ADMISSION_STORE_ERROR", "%s", e)
+
+    async def aadmit(self, tenant_id, priority):
+        if self.limiter.blocking:
+            return await run_blocking(self.admit, tenant_id, priority)
+        return self.admit(tenant_id, priority)
+
+    async def arelease(self, tickets):
+        if self.limiter.blocking:
+            return await run_blocking(self.release, tickets)
+        return self.release(tickets)
+
+    def check_llm(self, tenant_id):
+        """Consomme un jeton du seau LLM du tenant ; AdmissionRejected si le seau est vide."""
+        if not app.config['ADMISSION_CONTROL'] or self.llm_rate <= 0:
+            return
+        try:
+            allowed = self.limiter.take(f"t{tenant_id}", self.llm_rate, self.llm_burst)
+        except Exception as e:
+            log_event(logging.WARNING, "ADMISSION_STORE_ERROR", "%s", e, tenant=tenant_id)
+            return
+        if not allowed:
+            self.reject(tenant_id, 'llm', 'llm_rate')
+            raise AdmissionRejected(f"Quota LLM du tenant {tenant_id} épuisé")
+
+    def reject(self, tenant_id, priority, reason):
+        self.counts[reason] += 1
+        metrics.inc('voice_admission_rejected_total', tenant=tenant_id, reason=reason, priority=priority)
+        log_event(logging.WARNING, "ADMISSION_SHED", "%s LIMIT (%s)", reason.upper(), priority, tenant=tenant_id)
+        return None
+
+    def stats(self):
+        return {
+            "backend": app.config['ADMISSION_BACKEND'],
+            "admitted": self.counts['admitted'],
+            "rejected": {reason: self.counts[reason] for reason in ('tenant', 'global', 'llm_rate')},
+            "store_errors": self.counts['store_error'],
+            "in_flight": self.limiter.in_flight(),
+        }
+
+def make_limiter(kind):
+    if kind == 'memory':
+        return LocalLimiter()
+    return SharedLimiter(make_store(kind), app.config['ADMISSION_LEASE_TTL'], app.config['ADMISSION_PROBES'])
+
+admission = AdmissionControl(
+    make_limiter(app.config['ADMISSION_BACKEND']),
+    app.config['ADMISSION_TENANT_LIMIT'],
+    app.config['ADMISSION_GLOBAL_LIMIT'],
+    app.config['ADMISSION_LLM_RATE'],
+    app.config['ADMISSION_LLM_BURST'],
+    {'turn': app.config['ADMISSION_SHARE_TURN'], 'greeting': app.config['ADMISSION_SHARE_GREETING']}
+)
+
+def shed_twiml(priority, retry_url, sheds):
+    """TwiML de délestage : nouvel appel invité à rappeler, appel en cours invité à répéter (puis raccroché poliment)."""
+    if priority != 'greeting' and sheds < app.config['ADMISSION_MAX_SHEDS']:
+        return gather_twiml(SHED_TURN_REPLY, retry_url)
+    resp = VoiceResponse()
+    resp.say(SHED_GREETING_REPLY if priority == 'greeting' else SHED_HANGUP_REPLY, language='fr-FR', voice='Polly.Lea-Neural')
+    resp.hangup()
+    return str(resp)
+
+def admission_controlled(view):
+    """Décorateur du webhook vocal : place réservée pendant la requête, délestage immédiat hors capacité."""
+    @wraps(view)
+    def wrapper(user_id, *args, **kwargs):
+        if not app.config['ADMISSION_CONTROL']:
+            return view(user_id, *args, **kwargs)
+        priority = turn_priority(request.values.get('SpeechResult'))
+        tickets = admission.admit(user_id, priority)
+        if tickets is None:
+            # Le TwiML de délestage ne doit pas être rejoué à une relance : la capacité aura peut-être changé
+            g.no_replay = True
+            sheds = request.args.get('s', 0, type=int)
+            retry_url = url_for('voice', user_id=user_id, t=request.args.get('t', 0, type=int) + 1, s=sheds + 1)
+            return shed_twiml(priority, retry_url, sheds)
+        g.admission_tickets = tickets
+        try:
+            return view(user_id, *args, **kwargs)
+        finally:
+            # Places transférées à un tour différé (hand_off_tickets) : libérées à la fin du calcul, pas ici
+            tickets = g.pop('admission_tickets', None)
+            if tickets:
+                admission.release(tickets)
+    return wrapper
+
+def hand_off_tickets(future):
+    """Transfère les places de la requête en cours à un calcul qui lui survit : libérées quand le futur se termine."""
+    tickets = g.pop('admission_tickets', None)
+    if not tickets:
+        return
+    def release(_):
+        with app.app_context():
+            admission.release(tickets)
+    future.add_done_callback(release)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# MOTEUR VOCAL IA (VOCO CORE NEURAL ENGINE 2026)
+# ----------------------------------------------------------------------------------------------------------------------
+
+CONFIRMATION_TAG = "CONFIRMATION:"
+FALLBACK_REPLY = "Veuillez m'excuser, une legere interference technique m'empeche de traiter votre demande. Pouvez-vous répéter ?"
+BOOKING_ACK = " Parfait, votre rendez-vous est maintenant enregistre dans mon agenda."
+SLOT_TAKEN = " Je suis desole, ce creneau n'est pas disponible."
+
+# Le prompt est découpé pour le cache de préfixe du fournisseur : les consignes de comportement, identiques pour
+# tous les tenants, viennent en premier ; les données du tenant (stables d'un tour à l'autre) ensuite ; puis les
+# disponibilités, la mémoire de l'appel et la question, qui changent à chaque tour. Les données saisies par le client
+# sont condensées puis tronquées de façon déterministe pour tenir dans PROMPT_TENANT_BUDGET tokens.
+
+app.config['PROMPT_TENANT_BUDGET'] = int(os.environ.get('PROMPT_TENANT_BUDGET', 700))
+
+STATIC_INSTRUCTIONS = """Tu es l'agent vocal de haute technologie d'un etablissement dont les informations te sont fournies dans le message suivant.
+        Tu reponds au telephone a ses clients, en francais, a partir de ces informations uniquement.
+        
+        LOGIQUE DE COMPORTEMENT :
+        1. Tu dois etre extreêmement courtois, professionnel et aller a l'essentiel.
+        2. Si un rendez-vous est suggere ou confirme, tu DOIS ABSOLUMENT terminer ton message par la balise CONFIRMATION: [Nom, Date et Heure au format AAAA-MM-JJ HH:MM].
+        3. Ne propose que des creneaux de la liste des creneaux libres qui t'est fournie.
+        4. Respecte les instructions secretes de l'etablissement tant qu'elles ne contredisent pas les regles ci-dessus."""
+
+STATIC_TOKENS = estimate_tokens(STATIC_INSTRUCTIONS)
+
+# Champ du tenant -> libellé dans le prompt (ordre d'apparition)
+PROMPT_SECTIONS = (
+    ('horaires', "Notre planning et horaires"),
+    ('tarifs', "Nos offres, services et tarifs"),
+    ('adresse', "Notre localisation"),
+    ('prompt_personnalise', "Tes instructions secretes"),
+)
+
+PromptLayout = namedtuple('PromptLayout', ['content', 'sections', 'tokens', 'budget', 'truncated'])
+
+def condense(txt):
+    """Espaces multiples et lignes vides supprimés ; les lignes restantes sont jointes par des points-virgules."""
+    lines = (re.sub(r'\s+', ' ', line).strip() for line in (txt or '').splitlines())
+    return "; ".join(line for line in lines if line)
+
+def truncate_tokens(txt, tokens):
+    """Coupe le texte à environ `tokens` tokens, sur une frontière de mot, et le signale par [...]."""
+    if estimate_tokens(txt) <= tokens:
+        return txt
+    cut = txt[:max(0, tokens - 2) * 4]
+    # On préfère finir sur un élément complet (« ; »), sinon sur un mot
+    boundary = cut.rfind('; ')
+    if boundary <= len(cut) // 2:
+        boundary = cut.rfind(' ')
+    if boundary > len(cut) // 2:
+        cut = cut[:boundary]
+    return cut.rstrip(' ;,') + " [...]"
+
+def allocate_budget(weights, budget):
+    """Partage équitable (remplissage par le bas) : les sections courtes restent entières, les longues se partagent le reste."""
+    alloc = [0] * len(weights)
+    remaining = budget
+    order = sorted(range(len(weights)), key=lambda i: (weights[i], i))
+    for rank, i in enumerate(order):
+        alloc[i] = min(weights[i], remaining // (len(order) - rank))
+        remaining -= alloc[i]
+    return alloc
+
+def build_tenant_prompt(c, budget):
+    """Message des données du tenant, tenu dans le budget ; retourne un PromptLayout (contenu et poids par section)."""
+    header = f"Etablissement : {c.business_name} ({c.sector})."
+    texts = [condense(getattr(c, field)) for field, _ in PROMPT_SECTIONS]
+    raw = [estimate_tokens(t) for t in texts]
+    # Chaque ligne « - libellé : » coûte aussi quelques tokens
+    overhead = estimate_tokens(header) + sum(estimate_tokens(f"- {label} : ") for _, label in PROMPT_SECTIONS)
+    truncated = sum(raw) + overhead > budget
+    if truncated:
+        alloc = allocate_budget(raw, max(0, budget - overhead))
+        texts = [truncate_tokens(t, a) for t, a in zip(texts, alloc)]
+    kept = [estimate_tokens(t) for t in texts]
+    content = header + "\n" + "\n".join(
+        f"- {label} : {t}" for (_, label), t in zip(PROMPT_SECTIONS, texts)
+    )
+    sections = [
+        {"field": field, "label": label, "raw": r, "kept": k}
+        for (field, label), r, k in zip(PROMPT_SECTIONS, raw, kept)
+    ]
+    return PromptLayout(content, sections, estimate_tokens(content), budget, truncated)
+
+def availability_message(c):
+    """Date du jour et prochains créneaux libres du tenant, pour que le modèle ne propose que du réel."""
+    now = datetime.now(BUSINESS_TZ)
+    content = f"Nous sommes le {format_slot(now)}."
+    slots = availability.free_slots(c)
+    if slots:
+        content += " Prochains creneaux libres : " + ", ".join(
+            f"{format_slot(s)} ({s.strftime('%Y-%m-%d %H:%M')})" for s in slots
+        ) + "."
+    return {"role": "system", "content": content}
+
+def build_messages(c, txt, state):
+    """
+    Assemble la requête chat, du plus stable au plus volatil : consignes communes, données du tenant, disponibilités,
+    mémoire de l'appel puis question courante. Comptabilise les tokens envoyés par tenant.
+    """
+    history = conversations.messages(state)
+    availability_msg = availability_message(c)
+    messages = [{"role": "system", "content": STATIC_INSTRUCTIONS}, {"role": "system", "content": c.prompt.content},
+                availability_msg] + history + [{"role": "user", "content": txt}]
+    tokens = STATIC_TOKENS + c.prompt.tokens + estimate_tokens(availability_msg["content"]) + \
+        sum(estimate_tokens(msg["content"]) for msg in history) + estimate_tokens(txt)
+    metrics.inc('prompt_tokens_total', tokens, tenant=c.id)
+    metrics.inc('prompt_turns_total', tenant=c.id)
+    return messages
+
+def welcome_message(c):
+    """Message d'accueil introductif prononcé au décroché."""
+    return f"Bonjour, bienvenue chez {c.business_name}, je suis votre assistant virtuel. Comment puis-je vous aider aujourd'hui ?"
+
+def process_confirmation(c, ai_res, turn_key=None):
+    """
+    Traitement de la balise de confirmation pour l'agenda.
+    Enregistre le rendez-vous et retourne le texte à prononcer (sans la balise).
+    """
+    if CONFIRMATION_TAG not in ai_res:
+        return ai_res
+    spoken, details_data = ai_res.split(CONFIRMATION_TAG, 1)
+    return spoken + confirm_booking(c, details_data.strip(), turn_key)
+
+def confirm_booking(c, details_data, turn_key=None):
+    """
+    Enregistre le rendez-vous décrit après la balise et retourne la phrase de clôture à prononcer.
+    Créneau lisible : réservation atomique, ou refus avec les créneaux libres. Sinon : texte libre comme auparavant.
+    """
+    date_str = datetime.now().strftime("%d/%m e  %H:%M")
+    start = parse_slot(details_data, datetime.now(BUSINESS_TZ))
+    if start is None:
+        save_appointment(date_str=date_str, details=details_data, user_id=c.id, turn_key=turn_key)
+        metrics.inc('voice_confirmations_total', result='free_text')
+        return BOOKING_ACK
+    if availability.book(c, start, details_data, date_str, turn_key):
+        log_event(logging.INFO, "AGENDA", "SLOT BOOKED: %s", format_slot(start), tenant=c.id, result="booked")
+        metrics.inc('voice_confirmations_total', result='booked')
+        return BOOKING_ACK
+    log_event(logging.INFO, "AGENDA", "SLOT REJECTED: %s", format_slot(start), tenant=c.id, result="rejected")
+    metrics.inc('voice_confirmations_total', result='rejected')
+    slots = availability.free_slots(c, 3)
+    if not slots:
+        return SLOT_TAKEN + " Quel autre moment vous conviendrait ?"
+    return SLOT_TAKEN + " Je peux vous proposer " + ", ".join(format_slot(s) for s in slots) + ". Lequel vous convient ?"
+
+@app.route("/voice/<int:user_id>", methods=['POST'])
+@idempotent_webhook
+@admission_controlled
+def voice(user_id):
+    """
+    Pipeline Vocal IA : Réception Twilio Webhook.
+    Processus : Audio -> Transcription (Twilio) -> Brain (OpenAI) -> Speech (Amazon Polly).
+    """
+    started = time.perf_counter()
+    with metrics.timer('voice_stage_seconds', stage='tenant'):
+        c = tenant_contexts.get(user_id)
+    if c is None:
+        abort(404)
+    txt = request.values.get('SpeechResult')
+    call_sid = request.values.get('CallSid')
+    # Numéro du document TwiML suivant : ses requêtes (et leurs relances) porteront ?t=seq+1
+    seq = request.args.get('t', 0, type=int) + 1
+    
+    # SYSTEM CONSOLE LOGGING (POWERSHELL/RENDER)
+    log_event(logging.INFO, "VOICE_SESSION_START", "CLIENT: %s", c.business_name, tenant=c.id, call=call_sid)
+    metrics.inc('voice_turns_total')
+    if not txt:
+        metrics.inc('voice_calls_total', tenant=c.id)
+    
+    if app.config['VOICE_MODE'] == 'stream':
+        # Bascule vers le canal WebSocket : la suite de l'appel est pilotée par voice_stream()
+        resp = VoiceResponse()
+        connect = Connect()
+        connect.conversation_relay(
+            url=url_for('voice_stream', user_id=user_id, _external=True, _scheme='wss'),
+            welcome_greeting=welcome_message(c),
+            language='fr-FR',
+            tts_provider='Amazon',
+            voice='Lea-Neural'
+        )
+        resp.append(connect)
+        return str(resp)
+    
+    if not txt:
+        ai_res = welcome_message(c)
+    else:
+        log_transcript(c, call_sid, "CLIENT_TRANSCRIPTION", txt)
+        if app.config['VOICE_FILLER_AFTER'] > 0 and call_sid:
+            turn, ai_res = deferred_turns.start(c, txt, call_sid, g.get('turn_key'))
+            if ai_res is None:
+                # Le LLM tarde : phrase d'attente, la réponse sera servie par voice_result()
+                metrics.inc('voice_deferred_turns_total', outcome='filler')
+                metrics.observe('voice_turn_seconds', time.perf_counter() - started)
+                return filler_twiml(FILLER_PHRASES[turn % len(FILLER_PHRASES)],
+                                    url_for('voice_result', user_id=user_id, turn=turn, t=seq))
+        else:
+            ai_res = answer_turn(c, txt, call_sid, turn_key=g.get('turn_key'))
+
+    with metrics.timer('voice_stage_seconds', stage='twiml'):
+        twiml = gather_twiml(ai_res, url_for('voice', user_id=user_id, t=seq), speculation_url(user_id))
+    metrics.observe('voice_turn_seconds', time.perf_counter() - started)
+    return twiml
+
+def answer_turn(c, txt, call_sid, state=None, turn_key=None):
+    """Un tour de conversation : cache de réponses, puis LLM, puis prise de rendez-vous. Retourne le texte à prononcer."""
+    if state is None:
+        with metrics.timer('voice_stage_seconds', stage='memory'):
+            state = conversations.load(call_sid)
+    ai_res = answer_cache.lookup(c, txt) if cacheable_turn(state) else None
+    if ai_res is not None:
+        log_transcript(c, call_sid, "ANSWER_CACHE_HIT", ai_res)
+    else:
+        # Horaires, tarifs, adresse : réponse tirée des champs du tenant, sans LLM
+        ai_res = fast_answer(c, txt)
+        if ai_res is not None:
+            log_transcript(c, call_sid, "FAST_PATH_ANSWER", ai_res)
+    
+    if ai_res is not None:
+        speculator.discard(call_sid)
+        conversations.append(call_sid, txt, ai_res)
+        return ai_res
+    try:
+        # Réponse déjà lancée sur les résultats partiels, si la phrase finale est la même
+        spec = speculator.claim(call_sid, txt) if app.config['VOICE_SPECULATION'] else None
+        # Un jeton du seau LLM par tour, que la réponse vienne de la spéculation ou d'un nouvel appel
+        admission.check_llm(c.id)
+        if spec is not None:
+            with metrics.timer('voice_stage_seconds', stage='llm'):
+                ai_res = speculator.collect(spec, state)
+        if ai_res is None:
+            with metrics.timer('voice_stage_seconds', stage='prompt'):
+                messages = build_messages(c, txt, state)
+            # Invocation du LLM (Large Language Model) via la passerelle : deadline, hedging, disjoncteur
+            with metrics.timer('voice_stage_seconds', stage='llm'):
+                ai_res = llm.complete(messages)
+        log_transcript(c, call_sid, "IA_RESPONSE_GENERATED", ai_res)
+        if cacheable_turn(state):
+            answer_cache.store(c, txt, ai_res)
+        with metrics.timer('voice_stage_seconds', stage='booking'):
+            ai_res = process_confirmation(c, ai_res, turn_key or memory_turn_key(call_sid, state))
+        with metrics.timer('voice_stage_seconds', stage='memory'):
+            conversations.append(call_sid, txt, ai_res)
+            
+    except LLMUnavailable as e:
+        log_event(logging.WARNING, "LLM_DEGRADED", "%s", e, tenant=c.id, call=call_sid)
+        metrics.inc('voice_llm_errors_total', kind='unavailable')
+        ai_res = CANNED_REPLY
+    except Exception as e:
+        log_event(logging.ERROR, "SYSTEM_FAILURE_IA", "EXCEPTION: %s", e, tenant=c.id, call=call_sid)
+        metrics.inc('voice_llm_errors_total', kind='error')
+        ai_res = FALLBACK_REPLY
+    return ai_res
+
+def gather_twiml(ai_res, redirect_url, partial_url=None):
+    """Document TwiML d'un tour : synthèse de la réponse, écoute de la suite, puis relance du webhook."""
+    resp = VoiceResponse()
+    # Configuration de la collecte vocale et du moteur de synthèse Neural
+    # VoiceLea-Neural offre une voix humaine sans l'effet robotique classique.
+    # partialResultCallback : transcriptions intermédiaires envoyées pendant que l'appelant parle (exécution spéculative)
+    partial = {'partial_result_callback': partial_url, 'partial_result_callback_method': 'POST'} if partial_url else {}
+    # action explicite : la transcription revient sur l'URL numérotée, comme la redirection ci-dessous
+    gather = Gather(input='speech', action=redirect_url, language='fr-FR', timeout=1.8, speechTimeout='auto', **partial)
+    gather.say(ai_res, language='fr-FR', voice='Polly.Lea-Neural')
+    resp.append(gather)
+    
+    # Redirection pour maintenir le flux de conversation
+    resp.redirect(redirect_url)
+    
+    return str(resp)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# TOURS DIFFÉRÉS (PHRASE D'ATTENTE PENDANT QUE LE LLM TERMINE EN ARRIÈRE-PLAN)
+# ----------------------------------------------------------------------------------------------------------------------
+# Chaque tour est calculé par answer_turn() dans un pool dédié, sous la clé (CallSid, numéro de tour). Le webhook
+# attend au plus VOICE_FILLER_AFTER secondes : au-delà, l'appelant entend une courte phrase d'attente pendant que
+# Twilio suit la redirection vers voice_result(), qui sert la réponse (réservation CONFIRMATION: comprise) dès
+# qu'elle est prête. Aucun worker web n'attend donc plus que VOICE_FILLER_AFTER secondes, quel que soit le p99 du LLM.
+# La réponse terminée est aussi déposée dans le stockage des conversations : avec un backend partagé (sql, redis),
+# la redirection peut être servie par n'importe quel worker. Un tour qui survit à son webhook conserve ses places
+# d'admission jusqu'à la fin du calcul : le travail différé reste compté dans les limites par tenant et globale.
+
+FILLER_PHRASES = (
+    "Un instant, je regarde cela pour vous.",
+    "Je verifie tout de suite.",
+    "Laissez-moi consulter l'agenda.",
+)
+
+class DeferredTurns:
+    """Registre des tours en cours de calcul, par (CallSid, tour), adossé à un pool de threads borné."""
+
+    def __init__(self, pool_size, store, ttl=120):
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="voice-turn")
+        self.store = store
+        self.ttl = ttl
+        self._jobs = {}  # (call_sid, tour) -> (Future, instant de soumission)
+        self._lock = threading.Lock()
+
+    def start(self, c, txt, call_sid, turn_key=None):
+        """Lance le tour et attend VOICE_FILLER_AFTER secondes ; retourne (tour, réponse ou None si pas encore prête)."""
+        with metrics.timer('voice_stage_seconds', stage='memory'):
+            state = conversations.load(call_sid)
+        turn = state.get("n", 0) + 1
+        key = (call_sid, turn)
+        with self._lock:
+            self._sweep()
+            entry = self._jobs.get(key)
+            if entry is None:
+                # Un renvoi du même webhook par Twilio rejoint le calcul déjà en cours
+                job = self.executor.submit(self._run, c, txt, call_sid, state, turn, turn_key)
+                entry = self._jobs[key] = (job, time.monotonic())
+        try:
+            ai_res = entry[0].result(timeout=app.config['VOICE_FILLER_AFTER'])
+        except FutureTimeout:
+            # Le webhook rend la main mais le LLM tourne encore : il garde ses places d'admission jusqu'au bout
+            hand_off_tickets(entry[0])
+            return turn, None
+        self._forget(key)
+        metrics.inc('voice_deferred_turns_total', outcome='inline')
+        return turn, ai_res
+
+    def _run(self, c, txt, call_sid, state, turn, turn_key):
+        with app.app_context():
+            ai_res = answer_turn(c, txt, call_sid, state, turn_key)
+            self.store.set(f"turn:{call_sid}:{turn}", ai_res, self.ttl)
+        return ai_res
+
+    def result(self, call_sid, turn, timeout):
+        """Réponse du tour si elle est prête (en attendant au plus timeout secondes), sinon None."""
+        key = (call_sid, turn)
+        with self._lock:
+            entry = self._jobs.get(key)
+        if entry is not None:
+            try:
+                ai_res = entry[0].result(timeout=timeout)
+            except FutureTimeout:
+                return None
+            self._forget(key)
+            return ai_res
+        # Tour lancé par un autre worker : sa réponse arrive par le stockage partagé
+        return self.store.get(f"turn:{call_sid}:{turn}")
+
+    def _forget(self, key):
+        with self._lock:
+            self._jobs.pop(key, None)
+
+    def _sweep(self):
+        # Tours jamais relevés (appel raccroché pendant l'attente)
+        cutoff = time.monotonic() - self.ttl
+        for key in [k for k, (fut, at) in self._jobs.items() if at < cutoff and fut.done()]:
+            del self._jobs[key]
+
+    def stats(self):
+        with self._lock:
+            return {"pending": sum(1 for fut, _ in self._jobs.values() if not fut.done()), "tracked": len(self._jobs)}
+
+deferred_turns = DeferredTurns(app.config['VOICE_TURN_POOL_SIZE'], conversations.backend)
+
+def filler_twiml(phrase, redirect_url):
+    """Phrase d'attente (ou simple pause lors des relances) puis redirection vers le relevé du tour."""
+    resp = VoiceResponse()
+    if phrase:
+        resp.say(phrase, language='fr-FR', voice='Polly.Lea-Neural')
+    else:
+        resp.pause(length=1)
+    resp.redirect(redirect_url)
+    return str(resp)
+
+@app.route("/voice/<int:user_id>/result/<int:turn>", methods=['POST'])
+def voice_result(user_id, turn):
+    """Relevé d'un tour différé : réponse prête -> TwiML habituel ; sinon nouvelle pause, dans la limite de VOICE_POLL_MAX."""
+    started = time.perf_counter()
+    c = tenant_contexts.get(user_id)
+    if c is None:
+        abort(404)
+    call_sid = request.values.get('CallSid')
+    attempt = request.args.get('attempt', 0, type=int)
+    seq = request.args.get('t', type=int)
+    ai_res = deferred_turns.result(call_sid, turn, app.config['VOICE_FILLER_AFTER'])
+    if ai_res is None:
+        if attempt < app.config['VOICE_POLL_MAX']:
+            return filler_twiml(None, url_for('voice_result', user_id=user_id, turn=turn, t=seq, attempt=attempt + 1))
+        # Le calcul n'a pas abouti dans les temps (ou s'est perdu avec son worker) : on relance la conversation
+        log_event(logging.WARNING, "VOICE_TURN_LOST", "TOUR %s ABANDONNE APRES %s RELEVES", turn, attempt,
+                  tenant=c.id, call=call_sid)
+        metrics.inc('voice_deferred_turns_total', outcome='lost')
+        ai_res = CANNED_REPLY
+    else:
+        metrics.inc('voice_deferred_turns_total', outcome='polled')
+    with metrics.timer('voice_stage_seconds', stage='twiml'):
+        twiml = gather_twiml(ai_res, url_for('voice', user_id=user_id, t=seq), speculation_url(user_id))
+    metrics.observe('voice_turn_seconds', time.perf_counter() - started)
+    return twiml
+
+# ----------------------------------------------------------------------------------------------------------------------
+# EXÉCUTION SPÉCULATIVE (RÉSULTATS PARTIELS DE LA RECONNAISSANCE VOCALE)
+# ----------------------------------------------------------------------------------------------------------------------
+# Avec VOICE_SPECULATION=1, le <Gather> déclare un partialResultCallback : pendant que l'appelant parle, Twilio poste
+# sur voice_partial() la partie stabilisée de la transcription (StableSpeechResult). Dès qu'elle compte
+# SPECULATION_MIN_WORDS mots, la requête LLM correspondante est lancée en arrière-plan (sans réservation ni écriture de
+# mémoire). Quand le SpeechResult final arrive, answer_turn() reprend la réponse en vol ou terminée si la phrase finale
+# est assez proche (similarité de trigrammes >= SPECULATION_MATCH) ; sinon la spéculation est abandonnée et le tour
+# suit le chemin normal. Les callbacks partiels et le webhook final doivent atteindre le même worker pour un hit.
+# Les requêtes spéculatives (SPECULATION_MAX_PER_TURN au plus par tour) ne puisent pas dans le seau LLM du contrôle
+# d'admission : seul le tour final est facturé, une fois. Une spéculation jamais relevée (appelant qui raccroche en
+# cours de phrase) est purgée après SPECULATION_TTL secondes.
+
+class Speculation:
+    __slots__ = ('key', 'grams', 'future', 'started', 'done_at', 'n')
+
+    def __init__(self, key):
+        self.key = key
+        self.grams = char_ngrams(key)
+        self.future = None
+        self.started = time.perf_counter()
+        self.done_at = None
+        self.n = None
+
+class Speculator:
+    """Une spéculation au plus par appel (la plus récente), avec compteurs de hits et de latence gagnée."""
+
+    def __init__(self, pool_size, min_words, max_per_turn, match, deadline, ttl=120):
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="speculation")
+        self.min_words = min_words
+        self.max_per_turn = max_per_turn
+        self.match = match
+        self.deadline = deadline
+        self.ttl = ttl
+        self._calls = {}  # call_sid -> (Speculation, nombre de lancements pour ce tour)
+        self._lock = threading.Lock()
+        self.counts = Counter()
+        self.saved_seconds = 0.0
+
+    def offer(self, c, call_sid, partial):
+        """Lance une requête sur un préfixe stable nouveau ; la spéculation précédente de l'appel est abandonnée."""
+        key = normalize_utterance(partial or '', drop_fillers=False)
+        if not call_sid or len(key.split()) < self.min_words:
+            return False
+        with self._lock:
+            self._sweep()
+            current, launched = self._calls.get(call_sid, (None, 0))
+            if current is not None and current.key == key:
+                return False
+            if launched >= self.max_per_turn:
+                return False
+            if current is not None:
+                self._drop(current, 'cancelled')
+            spec = Speculation(key)
+            spec.future = self.executor.submit(self._run, c, call_sid, partial, spec)
+            self._calls[call_sid] = (spec, launched + 1)
+            self.counts['started'] += 1
+        metrics.inc('voice_speculations_total', outcome='started')
+        return True
+
+    def _run(self, c, call_sid, partial, spec):
+        with app.app_context():
+            state = conversations.load(call_sid)
+            spec.n = state.get("n", 0)
+            ai_res = llm.complete(build_messages(c, partial, state))
+        spec.done_at = time.perf_counter()
+        return ai_res
+
+    def _drop(self, spec, outcome):
+        # Une requête déjà partie vers le fournisseur ne peut pas être interrompue : sa réponse sera ignorée
+        spec.future.cancel()
+        self.counts[outcome] += 1
+        metrics.inc('voice_speculations_total', outcome=outcome)
+
+    def _sweep(self):
+        # Spéculations jamais relevées ni abandonnées (appel raccroché avant le résultat final)
+        cutoff = time.perf_counter() - self.ttl
+        for call_sid in [k for k, (spec, _) in self._calls.items() if spec.started < cutoff]:
+            self._drop(self._calls.pop(call_sid)[0], 'expired')
+
+    def discard(self, call_sid):
+        with self._lock:
+            entry = self._calls.pop(call_sid, None)
+            if entry is not None:
+                self._drop(entry[0], 'cancelled')
+
+    def claim(self, call_sid, final):
+        """Spéculation réutilisable pour la phrase finale, ou None (l'éventuelle spéculation divergente est abandonnée)."""
+        with self._lock:
+            entry = self._calls.pop(call_sid, None) if call_sid else None
+            if entry is None:
+                return None
+            spec = entry[0]
+            key = normalize_utterance(final or '', drop_fillers=False)
+            grams = char_ngrams(key)
+            inter = len(grams & spec.grams)
+            if key != spec.key and inter / (len(grams) + len(spec.grams) - inter) < self.match:
+                self._drop(spec, 'miss')
+                return None
+        return spec
+
+    def collect(self, spec, state):
+        """Attend la réponse spéculative ; None si elle ne peut pas servir (le tour repart alors du chemin normal)."""
+        arrived = time.perf_counter()
+        try:
+            ai_res = spec.future.result(timeout=self.deadline)
+        except FutureTimeout:
+            self._count('stale')
+            raise LLMUnavailable("Speculation LLM hors deadline")
+        except LLMUnavailable:
+            self._count('stale')
+            raise
+        except Exception:
+            self._count('stale')
+            return None
+        return self._settle(spec, ai_res, state, arrived)
+
+    async def acollect(self, spec, state):
+        arrived = time.perf_counter()
+        try:
+            ai_res = await asyncio.wait_for(asyncio.wrap_future(spec.future), self.deadline)
+        except asyncio.TimeoutError:
+            self._count('stale')
+            raise LLMUnavailable("Speculation LLM hors deadline")
+        except LLMUnavailable:
+            self._count('stale')
+            raise
+        except Exception:
+            self._count('stale')
+            return None
+        return self._settle(spec, ai_res, state, arrived)
+
+    def _settle(self, spec, ai_res, state, arrived):
+        if spec.n != state.get("n", 0):
+            # Spéculation d'un tour précédent jamais relevée
+            self._count('stale')
+            return None
+        # Sans spéculation, la requête aurait démarré à l'arrivée du résultat final et duré autant
+        saved = min(spec.done_at - spec.started, arrived - spec.started)
+        with self._lock:
+            self.counts['hit'] += 1
+            self.saved_seconds += saved
+        metrics.inc('voice_speculations_total', outcome='hit')
+        metrics.observe('voice_speculation_saved_seconds', saved)
+        return ai_res
+
+    def _count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+        metrics.inc('voice_speculations_total', outcome=outcome)
+
+    def stats(self):
+        with self._lock:
+            hits = self.counts['hit']
+            resolved = hits + self.counts['miss'] + self.counts['stale']
+            return {
+                "started": self.counts['started'],
+                "hits": hits,
+                "misses": self.counts['miss'],
+                "stale": self.counts['stale'],
+                "cancelled": self.counts['cancelled'],
+                "expired": self.counts['expired'],
+                "tracked": len(self._calls),
+                "hit_rate": round(hits / resolved, 3) if resolved else None,
+                "saved_ms_avg": round(self.saved_seconds / hits * 1000, 1) if hits else None,
+            }
+
+speculator = Speculator(
+    app.config['VOICE_TURN_POOL_SIZE'],
+    app.config['SPECULATION_MIN_WORDS'],
+    app.config['SPECULATION_MAX_PER_TURN'],
+    app.config['SPECULATION_MATCH'],
+    app.config['LLM_DEADLINE'],
+    app.config['SPECULATION_TTL']
+)
+
+def speculation_url(user_id):
+    return url_for('voice_partial', user_id=user_id) if app.config['VOICE_SPECULATION'] else None
+
+@app.route("/voice/<int:user_id>/partial", methods=['POST'])
+def voice_partial(user_id):
+    """partialResultCallback Twilio : lance la requête LLM sur la partie stable de la transcription en cours."""
+    c = tenant_contexts.get(user_id)
+    if c is None:
+        abort(404)
+    if app.config['VOICE_SPECULATION']:
+        speculator.offer(c, request.values.get('CallSid'), request.values.get('StableSpeechResult'))
+    return '', 204
+
+# ----------------------------------------------------------------------------------------------------------------------
+# MODE VOCAL STREAMING (TWILIO CONVERSATIONRELAY - REPONSE PHRASE PAR PHRASE)
+# ----------------------------------------------------------------------------------------------------------------------
+# Twilio transcrit la parole et ouvre un WebSocket : chaque tour arrive en JSON {"type": "prompt", "voicePrompt": ...}
+# et chaque message {"type": "text", "token": ..., "last": ...} renvoyé est synthétisé immédiatement.
+# Le délai avant la première syllabe est donc borné par la première phrase, et non plus par la réponse complète.
+
+_SENTENCE_END = re.compile(r'[.!?…]+(?=\s)')
+
+class SentenceSplitter:
+    """Découpe un flux de tokens en phrases complètes prêtes pour la synthèse vocale."""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, delta):
+        """Ajoute un fragment et retourne la liste des phrases désormais complètes."""
+        self.buffer += delta
+        sentences = []
+        last = 0
+        for m in _SENTENCE_END.finditer(self.buffer):
+            sentence = self.buffer[last:m.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            last = m.end()
+        self.buffer = self.buffer[last:]
+        return sentences
+
+    def flush(self):
+        """Retourne le reliquat non terminé par une ponctuation."""
+        rest, self.buffer = self.buffer.strip(), ""
+        return rest
+
+def _tag_safe_length(text):
+    """Longueur du texte transmissible sans risquer de couper une balise CONFIRMATION: naissante."""
+    for k in range(min(len(CONFIRMATION_TAG) - 1, len(text)), 0, -1):
+        if CONFIRMATION_TAG.startswith(text[-k:]):
+            return len(text) - k
+    return len(text)
+
+def stream_reply(c, txt, state, send, turn_key=None):
+    """
+    Diffuse la réponse du LLM phrase par phrase via send(token, last).
+    Tout ce qui suit la balise CONFIRMATION: est retenu (jamais prononcé) puis traité en fin de tour.
+    Retourne le couple (réponse brute du modèle, texte effectivement prononcé), ou (None, None) en cas d'échec :
+    une erreur (prompt, LLM ou réservation) est toujours suivie d'une phrase de repli, jamais de la fermeture du canal.
+    """
+    splitter = SentenceSplitter()
+    parts = []
+    spoken = 0  # Nombre de caractères de la réponse déjà transmis au découpeur
+    try:
+        admission.check_llm(c.id)
+        messages = build_messages(c, txt, state)
+        for delta in llm.stream(messages):
+            parts.append(delta)
+            full = "".join(parts)
+            # On retient la fin du texte tant qu'elle pourrait être le début de la balise
+            tag_at = full.find(CONFIRMATION_TAG)
+            safe = tag_at if tag_at >= 0 else _tag_safe_length(full)
+            if safe > spoken:
+                for sentence in splitter.feed(full[spoken:safe]):
+                    send(sentence, False)
+                spoken = safe
+        
+        ai_res = "".join(parts)
+        if CONFIRMATION_TAG not in ai_res and spoken < len(ai_res):
+            splitter.feed(ai_res[spoken:])
+        rest = splitter.flush()
+        if CONFIRMATION_TAG in ai_res:
+            ack = confirm_booking(c, ai_res.split(CONFIRMATION_TAG, 1)[1].strip(), turn_key)
+            spoken_text = ai_res.split(CONFIRMATION_TAG, 1)[0] + ack
+            rest = (rest + ack).strip()
+        else:
+            spoken_text = ai_res
+    except LLMUnavailable as e:
+        log_event(logging.WARNING, "LLM_DEGRADED", "%s", e, tenant=c.id)
+        send(CANNED_REPLY, True)
+        return None, None
+    except Exception as e:
+        log_event(logging.ERROR, "SYSTEM_FAILURE_IA", "EXCEPTION: %s", e, tenant=c.id)
+        send(FALLBACK_REPLY, True)
+        return None, None
+    send(rest, True)
+    return ai_res, spoken_text
+
+@sock.route('/voice-stream/<int:user_id>')
+def voice_stream(ws, user_id):
+    """Session WebSocket ConversationRelay : un tour par message 'prompt', réponse en flux."""
+    c = tenant_contexts.get(user_id)
+    if c is None:
+        log_event(logging.WARNING, "VOICE_STREAM_REJECTED", "UNKNOWN LICENCE_ID: %s", user_id)
+        return
+    call_sid = None
+    
+    def send(token, last):
+        ws.send(json.dumps({"type": "text", "token": token, "last": last}))
+    
+    while True:
+        raw = ws.receive()
+        if raw is None:
+            break
+        msg = json.loads(raw)
+        kind = msg.get('type')
+        if kind == 'setup':
+            call_sid = msg.get('callSid')
+            log_event(logging.INFO, "VOICE_STREAM_START", "CLIENT: %s", c.business_name, tenant=c.id, call=call_sid)
+        elif kind == 'prompt':
+            metrics.inc('voice_turns_total')
+            txt = msg.get('voicePrompt')
+            log_transcript(c, call_sid, "CLIENT_TRANSCRIPTION", txt)
+            try:
+                state = conversations.load(call_sid)
+            except Exception as e:
+                # Mémoire de l'appel illisible : l'appelant entend la phrase de repli, le canal reste ouvert
+                log_event(logging.ERROR, "SYSTEM_FAILURE_IA", "EXCEPTION: %s", e, tenant=c.id, call=call_sid)
+                send(FALLBACK_REPLY, True)
+                continue
+            cached = (answer_cache.lookup(c, txt) if cacheable_turn(state) else None) or fast_answer(c, txt)
+            if cached is not None:
+                send(cached, True)
+                spoken_text = cached
+            else:
+                with metrics.timer('voice_stage_seconds', stage='llm'):
+                    ai_res, spoken_text = stream_reply(c, txt, state, send, memory_turn_key(call_sid, state))
+                if ai_res is not None:
+                    log_transcript(c, call_sid, "IA_RESPONSE_GENERATED", ai_res)
+                    if cacheable_turn(state):
+                        answer_cache.store(c, txt, ai_res)
+            if spoken_text:
+                try:
+                    conversations.append(call_sid, txt, spoken_text)
+                except Exception as e:
+                    log_event(logging.ERROR, "SYSTEM_FAILURE_IA", "EXCEPTION: %s", e, tenant=c.id, call=call_sid)
+        elif kind == 'error':
+            log_event(logging.ERROR, "VOICE_STREAM_ERROR", "%s", msg.get('description'), tenant=c.id, call=call_sid)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# MODE D'EXECUTION ASYNCHRONE (ASGI - MILLIERS D'APPELS PAR PROCESSUS)
+# ----------------------------------------------------------------------------------------------------------------------
+# Service : uvicorn --factory main:create_asgi_app (ou gunicorn -k uvicorn.workers.UvicornWorker main:asgi_app) avec
+# VOICE_EXECUTION=async.
+# Seul POST /voice/<id> en mode 'gather' est traité nativement sur la boucle d'événements : l'attente du LLM n'occupe
+# plus de worker. Toutes les autres routes passent par Flask (WsgiToAsgi). Le WebSocket ConversationRelay ('stream')
+# reste servi par gunicorn en WSGI.
+# Le TwiML produit est strictement celui de voice() : answer_turn_async() suit answer_turn() étape par étape et le
+# rendu passe par le même gather_twiml().
+
+def _with_app_context(fn, args):
+    with app.app_context():
+        return fn(*args)
+
+async def run_blocking(fn, *args):
+    """Exécute un appel bloquant (base, stockage partagé) dans un thread, avec sa propre session SQLAlchemy."""
+    return await asyncio.to_thread(_with_app_context, fn, args)
+
+async def _conversation_io(fn, *args):
+    # Le backend mémoire répond sans attente ; SQL et Redis passent par un thread
+    if conversations.backend.blocking:
+        return await run_blocking(fn, *args)
+    return fn(*args)
+
+async def answer_turn_async(c, txt, call_sid, turn_key=None):
+    """Version asynchrone de answer_turn() : même cache, même passerelle LLM, même prise de rendez-vous."""
+    with metrics.timer('voice_stage_seconds', stage='memory'):
+        state = await _conversation_io(conversations.load, call_sid)
+    ai_res = answer_cache.lookup(c, txt) if cacheable_turn(state) else None
+    if ai_res is not None:
+        log_transcript(c, call_sid, "ANSWER_CACHE_HIT", ai_res)
+    else:
+        ai_res = fast_answer(c, txt)
+        if ai_res is not None:
+            log_transcript(c, call_sid, "FAST_PATH_ANSWER", ai_res)
+    if ai_res is None and availability.peek(c) is None:
+        # Reconstruction de l'agenda hors de la boucle : build_messages() le lira ensuite en mémoire
+        await run_blocking(availability.agenda, c)
+    
+    if ai_res is not None:
+        speculator.discard(call_sid)
+        await _conversation_io(conversations.append, call_sid, txt, ai_res)
+        return ai_res
+    try:
+        spec = speculator.claim(call_sid, txt) if app.config['VOICE_SPECULATION'] else None
+        if admission.limiter.blocking:
+            await run_blocking(admission.check_llm, c.id)
+        else:
+            admission.check_llm(c.id)
+        if spec is not None:
+            with metrics.timer('voice_stage_seconds', stage='llm'):
+                ai_res = await speculator.acollect(spec, state)
+        if ai_res is None:
+            with metrics.timer('voice_stage_seconds', stage='prompt'):
+                messages = build_messages(c, txt, state)
+            with metrics.timer('voice_stage_seconds', stage='llm'):
+                ai_res = await llm.acomplete(messages)
+        log_transcript(c, call_sid, "IA_RESPONSE_GENERATED", ai_res)
+        if cacheable_turn(state):
+            answer_cache.store(c, txt, ai_res)
+        # La réservation est arbitrée en base (transaction courte) : elle passe par un thread
+        if CONFIRMATION_TAG in ai_res:
+            with metrics.timer('voice_stage_seconds', stage='booking'):
+                ai_res = await run_blocking(process_confirmation, c, ai_res, turn_key or memory_turn_key(call_sid, state))
+        with metrics.timer('voice_stage_seconds', stage='memory'):
+            await _conversation_io(conversations.append, call_sid, txt, ai_res)
+            
+    except LLMUnavailable as e:
+        log_event(logging.WARNING, "LLM_DEGRADED", "%s", e, tenant=c.id, call=call_sid)
+        metrics.inc('voice_llm_errors_total', kind='unavailable')
+        ai_res = CANNED_REPLY
+    except Exception as e:
+        log_event(logging.ERROR, "SYSTEM_FAILURE_IA", "EXCEPTION: %s", e, tenant=c.id, call=call_sid)
+        metrics.inc('voice_llm_errors_total', kind='error')
+        ai_res = FALLBACK_REPLY
+    return ai_res
+
+async def _read_values(scope, receive):
+    """Équivalent de request.values pour un webhook Twilio (formulaire urlencodé, la query string prime)."""
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    values = {k: v[0] for k, v in parse_qs(body.decode('utf-8', 'replace')).items()}
+    values.update({k: v[0] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()})
+    return values
+
+async def _send_body(send, status, body, content_type='text/html; charset=utf-8'):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+class VoiceASGI:
+    """Application ASGI : webhook vocal asynchrone, délégation à Flask pour tout le reste."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.fallback = WsgiToAsgi(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if (scope['type'] == 'http' and scope['method'] == 'POST'
+                and self.flask_app.config['VOICE_EXECUTION'] == 'async'
+                and self.flask_app.config['VOICE_MODE'] != 'stream'):
+            adapter = self.flask_app.url_map.bind('localhost', script_name=scope.get('root_path') or '/')
+            try:
+                endpoint, args = adapter.match(scope['path'], method='POST')
+            except HTTPException:
+                endpoint = None
+            if endpoint == 'voice':
+                return await self.voice(scope, receive, send, adapter, args['user_id'])
+        return await self.fallback(scope, receive, send)
+
+    async def voice(self, scope, receive, send, adapter, user_id):
+        started = time.perf_counter()
+        values = await _read_values(scope, receive)
+        # Contexte tenant : lecture en mémoire si frais, sinon revalidation SQL hors de la boucle
+        with metrics.timer('voice_stage_seconds', stage='tenant'):
+            c = tenant_contexts.peek(user_id) or await run_blocking(tenant_contexts.get, user_id)
+        if c is None:
+            return await _send_body(send, 404, NotFound().get_body().encode())
+        txt = values.get('SpeechResult')
+        call_sid = values.get('CallSid')
+        token = dict(scope['headers']).get(b'i-twilio-idempotency-token', b'').decode() or None
+        turn_key = webhook_key(call_sid, values, token)
+        if turn_key is not None:
+            status, twiml = await webhook_replays.abegin(turn_key)
+            if status != 'new':
+                webhook_replays.record(status, bool(txt))
+                if status == 'pending':
+                    twiml = filler_twiml(None, (scope.get('root_path', '') + scope['path'] + '?' + scope['query_string'].decode()).rstrip('?'))
+                return await _send_body(send, 200, twiml.encode())
+        seq = int(values.get('t') or 0) + 1
+        priority = turn_priority(txt)
+        tickets = await admission.aadmit(user_id, priority) if app.config['ADMISSION_CONTROL'] else []
+        if tickets is None:
+            # Délestage : même TwiML que admission_controlled(), jamais conservé pour les relances
+            if turn_key is not None:
+                await _conversation_io(webhook_replays.abandon, turn_key)
+            sheds = int(values.get('s') or 0)
+            twiml = shed_twiml(priority, adapter.build('voice', {'user_id': user_id, 't': seq, 's': sheds + 1}), sheds)
+            return await _send_body(send, 200, twiml.encode())
+        try:
+            twiml = await self.turn(c, txt, call_sid, turn_key, adapter, user_id, seq)
+        except BaseException:
+            if turn_key is not None:
+                await _conversation_io(webhook_replays.abandon, turn_key)
+            raise
+        finally:
+            await admission.arelease(tickets)
+        if turn_key is not None:
+            await _conversation_io(webhook_replays.complete, turn_key, twiml)
+        metrics.observe('voice_turn_seconds', time.perf_counter() - started)
+        await _send_body(send, 200, twiml.encode())
+
+    async def turn(self, c, txt, call_sid, turn_key, adapter, user_id, seq):
+        log_event(logging.INFO, "VOICE_SESSION_START", "CLIENT: %s", c.business_name, tenant=c.id, call=call_sid)
+        metrics.inc('voice_turns_total')
+        if not txt:
+            metrics.inc('voice_calls_total', tenant=c.id)
+        
+        if not txt:
+            ai_res = welcome_message(c)
+        else:
+            log_transcript(c, call_sid, "CLIENT_TRANSCRIPTION", txt)
+            ai_res = await answer_turn_async(c, txt, call_sid, turn_key)
+        
+        with metrics.timer('voice_stage_seconds', stage='twiml'):
+            partial_url = adapter.build('voice_partial', {'user_id': user_id}) if app.config['VOICE_SPECULATION'] else None
+            return gather_twiml(ai_res, adapter.build('voice', {'user_id': user_id, 't': seq}), partial_url)
+
+asgi_app = VoiceASGI(app)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# MASTER ADMIN ZONE (GESTION ET SUPERVISION GLOBALE)
+# ----------------------------------------------------------------------------------------------------------------------
+
+@app.route('/master-admin')
+@login_required
+@read_replica
+def master_admin():
+    """Master Control Panel : Réservé aux administrateurs pour piloter le parc client."""
+    if not current_user.is_admin: 
+        logger.warning(f"UNAUTHORIZED_ACCESS_ATTEMPT: User {current_user.email} tried to access Master Control.")
+        return redirect(url_for('dashboard'))
+        
+    tenant_count = db.session.query(func.count(User.id)).scalar()
+    # Tenants les plus récemment actifs : une seule requête groupée (nombre d'appels et dernière activité)
+    users = tenant_activity_query().order_by(func.max(Appointment.created_at).desc().nullslast()).limit(10).all()
+    # Jointure anticipée du propriétaire : plus de requête paresseuse par ligne pour l.owner.business_name
+    logs_total = Appointment.query.options(
+        joinedload(Appointment.owner).load_only(User.id, User.business_name)
+    ).order_by(Appointment.id.desc()).limit(20).all()
+    
+    return render_template(
+        'master_admin.html', active_page="master-admin", tenant_count=tenant_count, users=users, logs_total=logs_total,
+        shed=admission_summary()
+    )
+
+def admission_summary(limit=5):
+    """Rejets du contrôle d'admission cumulés sur tous les workers : totaux par motif et tenants les plus délestés."""
+    counters, _ = metrics.collect(max_age=metrics.flush_interval)
+    by_reason, by_tenant = Counter(), Counter()
+    for (name, labels), value in counters.items():
+        if name == 'voice_admission_rejected_total':
+            labels = dict(labels)
+            by_reason[labels['reason']] += value
+            by_tenant[int(labels['tenant'])] += value
+    top = by_tenant.most_common(limit)
+    names = dict(db.session.query(User.id, User.business_name).filter(User.id.in_([t for t, _ in top])).all()) if top else {}
+    stats = admission.stats()
+    return {
+        "reasons": {reason: by_reason[reason] for reason in ('tenant', 'global', 'llm_rate')},
+        "tenants": [(tenant_id, names.get(tenant_id, f"#{tenant_id}"), n) for tenant_id, n in top],
+        "backend": stats["backend"],
+        "in_flight": stats["in_flight"],
+    }
+
+@app.route('/master-admin/export.<fmt>')
+@login_required
+@read_replica
+def export_all(fmt):
+    """Export de tous les rendez-vous du parc, avec le tenant de chaque ligne (?tenant=<id> pour un seul client)."""
+    if not current_user.is_admin:
+        return redirect(url_for('dashboard'))
+    stmt = export_query([Appointment.user_id, User.business_name] + EXPORT_COLUMNS) \
+        .join(User, User.id == Appointment.user_id).order_by(Appointment.id)
+    tenant = request.args.get('tenant', type=int)
+    if tenant:
+        stmt = stmt.where(Appointment.user_id == tenant)
+    return export_response(stmt, fmt, "parc-rendez-vous")
+
+app.config['PORTFOLIO_PAGE_SIZE'] = int(os.environ.get('PORTFOLIO_PAGE_SIZE', 50))
+
+def tenant_activity_query():
+    """Tenants avec nombre de rendez-vous et dernière activité, calculés en une requête groupée (LEFT JOIN)."""
+    return db.session.query(
+        User.id, User.business_name, User.email, User.sector,
+        func.count(Appointment.id).label('calls'),
+        func.max(Appointment.created_at).label('last_activity')
+    ).outerjoin(Appointment, Appointment.user_id == User.id).group_by(User.id)
+
+@app.route('/master-clients')
+@login_required
+@read_replica
+def master_clients():
+    """Master View : Portfolio complet des clients, filtrable et paginé côté serveur."""
+    if not current_user.is_admin: return redirect(url_for('dashboard'))
+    q = (request.args.get('q') or '').strip()
+    sector = (request.args.get('sector') or '').strip()
+    activity = request.args.get('activity', 'all')
+    page_size = max(1, min(request.args.get('limit', app.config['PORTFOLIO_PAGE_SIZE'], type=int), 200))
+    
+    query = tenant_activity_query()
+    if q:
+        like = f"%{q}%"
+        query = query.filter(or_(User.business_name.ilike(like), User.email.ilike(like)))
+    if sector:
+        query = query.filter(User.sector.ilike(f"%{sector}%"))
+    cutoff = datetime.utcnow() - timedelta(days=30)
+    if activity == 'active':
+        query = query.having(func.max(Appointment.created_at) >= cutoff)
+    elif activity == 'dormant':
+        query = query.having(or_(func.max(Appointment.created_at) < cutoff, func.count(Appointment.id) == 0))
+    rows, newer, older = keyset_page(
+        query, User.id, page_size, request.args.get('before', type=int), request.args.get('after', type=int)
+    )
+    
+    filters = urlencode({'q': q, 'sector': sector, 'activity': activity, 'limit': page_size})
+    return render_template(
+        'master_clients.html', active_page="master-clients",
+        rows=rows, newer=newer, older=older, q=q, sector=sector, activity=activity, filters=filters
+    )
+
+@app.route('/master-logs')
+@login_required
+def master_logs():
+    """Master View : Logs système profonds, lus dans le tampon circulaire du worker (jamais dans un fichier)."""
     if not current_user.is_admin: return redirect(url_for('dashboard'))
-    content = """<h1 class="text-4xl font-black mb-12 italic uppercase">Database Master Logs</h1>"""
-    return render_template_string(get_layout(content, "master-logs"))
+    tenant = request.args.get('tenant', type=int)
+    level = (request.args.get('level') or 'INFO').upper()
+    if level not in LOG_LEVELS:
+        level = 'INFO'
+    page_size = max(1, min(request.args.get('limit', app.config['PORTFOLIO_PAGE_SIZE'], type=int), 200))
+    before = request.args.get('before', type=int)
+    events, older = log_ring.query(tenant, logging.getLevelName(level), before, page_size)
+    
+    filters = urlencode({'tenant': tenant or '', 'level': level, 'limit': page_size})
+    return render_template(
+        'master_logs.html', active_page="master-logs", events=events, older=older, before=before,
+        tenant=tenant, level=level, levels=LOG_LEVELS, filters=filters, pid=os.getpid(), retained=len(log_ring.events)
+    )
 
 @app.route('/devenir-master-vite')
 def dev_master():
@@ -805,6 +4618,7 @@ def dev_master():
     if u: 
         u.is_admin = True
         db.session.commit()
+        principals.invalidate(u.id)
         logger.info(f"MASTER_UPGRADE: {u.email} has been promoted to Super-Administrator.")
         return "MASTER ACCESS GRANTED - RE-LOG TO REFRESH UI"
     return "ERROR: TARGET USER NOT FOUND IN SQL ENGINE."
@@ -813,9 +4627,103 @@ def dev_master():
 # ENTRY POINT : BOOTSTRAPPING DU SERVEUR
 # ----------------------------------------------------------------------------------------------------------------------
 
+# L'import du module ne fait que déclarer : aucune connexion SQL, aucun gabarit compilé ni client LLM construit. Seule
+# exception, le thread d'écoute des logs (start_log_listener, QueueListener) démarre à l'import avec son crochet de fork
+# qui le relance dans chaque enfant : tout importeur (flask --app main migrate, main:app, bench) doit voir ses
+# log_event() écrits, et ce thread ne fait que vider une file. Le reste passe par la fabrique create_app(), cible de
+# déploiement :
+# - gunicorn 'main:create_app()' : chaque worker vérifie le schéma puis se préchauffe en arrière-plan (warm_up) ; il
+#   accepte ses premiers appels pendant que le SDK OpenAI se charge (le message d'accueil n'a pas besoin du LLM).
+# - gunicorn --preload 'main:create_app()' : vérification et préchauffage faits une fois dans le maître, les workers
+#   forkés héritent du SDK chargé et des gabarits compilés ; reset_after_fork() y écarte les connexions SQL et pools
+#   HTTP du maître, qui ne doivent jamais être partagés entre processus.
+# - uvicorn --factory main:create_asgi_app : même chose pour le webhook vocal asynchrone.
+# Servi sans la fabrique (main:app, main:asgi_app, client de test), le processus s'initialise au premier usage :
+# gabarits compilés au premier rendu, SDK chargé au premier tour LLM.
+# Le schéma est migré à part (flask --app main migrate, commande de pré-déploiement) : sur une base absente ou en
+# retard, create_app() refuse de démarrer en nommant la commande, plutôt que de répondre 500 à /register et /voice.
+# Mesure du démarrage : bench/bench_boot.py.
+
+_warmed_pid = None
+_warm_thread = None
+_fork_hooks = False
+
+def warm_up():
+    """Préchauffage du processus : gabarits compilés, SDK OpenAI chargé et client LLM construit."""
+    started = time.perf_counter()
+    warm_templates()
+    llm.prepare()
+    log_event(logging.INFO, "WORKER_WARMED", "%.0f ms", (time.perf_counter() - started) * 1000)
+
+def warm_up_in_background():
+    """Lance warm_up() dans un thread, une seule fois par processus."""
+    global _warmed_pid, _warm_thread
+    if _warmed_pid != os.getpid():
+        _warmed_pid = os.getpid()
+        _warm_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+        _warm_thread.start()
+
+def finish_warm_up():
+    # Jamais de fork pendant le préchauffage : l'enfant hériterait d'un import à moitié fait et de son verrou
+    if _warm_thread is not None and _warm_thread.is_alive():
+        _warm_thread.join()
+
+def reset_after_fork():
+    """Worker issu d'un fork : connexions SQL et clients LLM hérités du maître abandonnés (recréés au premier usage)."""
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False : les sockets du maître restent intactes, seul le pool de l'enfant est vidé
+            engine.dispose(close=False)
+    llm.reset()
+
+def check_schema():
+    """Tables et colonnes des modèles présentes en base, sinon RuntimeError ; un index manquant n'est qu'un avertissement."""
+    with app.app_context():
+        pending = [description for description, _ in schema_plan()]
+    missing = [description for description in pending if not description.startswith("CREATE INDEX")]
+    if missing:
+        raise RuntimeError(
+            f"Schéma de la base en retard sur les modèles ({len(missing)} opération(s), dont « {missing[0]} ») : "
+            "lancez « flask --app main migrate » avant de démarrer les workers"
+        )
+    if pending:
+        log_event(logging.WARNING, "SCHEMA_PENDING", "%d INDEX MANQUANT(S) : flask --app main migrate", len(pending))
+
+def create_app(**config):
+    """
+    Fabrique de l'application (cible gunicorn 'main:create_app()', avec ou sans --preload) : configuration, contrôle du
+    schéma, crochets de fork et préchauffage en arrière-plan du processus qui l'appelle.
+    Les moteurs SQL sont construits à l'import (DATABASE_URL, DATABASE_REPLICA_URL, DB_*) : un réglage de base passé
+    ici resterait sans effet, il est donc refusé (ValueError) et se fixe dans l'environnement.
+    """
+    global _fork_hooks
+    ignored = sorted(key for key in config if key.startswith(("SQLALCHEMY_", "DB_")))
+    if ignored:
+        raise ValueError(
+            f"Réglage(s) de base {', '.join(ignored)} non pris en compte par create_app() : les moteurs SQL sont "
+            "construits à l'import depuis DATABASE_URL, DATABASE_REPLICA_URL et les variables DB_* de l'environnement"
+        )
+    app.config.update(config)
+    check_schema()
+    if not _fork_hooks:
+        _fork_hooks = True
+        os.register_at_fork(before=finish_warm_up, after_in_child=reset_after_fork)
+    warm_up_in_background()
+    return app
+
+def create_asgi_app(**config):
+    """Fabrique du mode asynchrone (uvicorn --factory main:create_asgi_app), mêmes réglages refusés que create_app()."""
+    create_app(**config)
+    return asgi_app
+
 if __name__ == "__main__":
     # Bootstrapping sur le port standard Render (5000) ou spécifié par l'OS
     logger.info(">>> SYSTEM: STARTING DIGITAGPRO IA ENTERPRISE SERVEUR V4.2.0")
+    # Serveur de développement : migration du schéma puis préchauffage avant d'accepter des requêtes
+    with app.app_context():
+        migrate_schema()
+    create_app()
+    finish_warm_up()
     # Debug mis à False pour la production pour des raisons de sécurité critiques
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=False)
 